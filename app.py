@@ -2,18 +2,127 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from functools import wraps
+import contextlib
 from flask import Flask, jsonify, Response, request, redirect, url_for
 import flask
+import concurrent.futures
+import itertools
 import os
-from cache import MemoryCache
+import threading
+import time
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from cache import MemoryCache, ColumnarFrame, SqlResultCache, StaleWhileRevalidateValue, PlotlyCodeCache, normalize_sql
+from result_export import EXPORT_FORMATS, iter_csv, iter_parquet, iter_xlsx, gzip_stream
+from sql_runner import iter_sql_chunks, run_sql_capped
+from sql_jobs import SqlJobManager, JobQueueFull
+from precompute import Precomputer
+from chart_reduction import reduce_for_chart
+from fast_json import json_response, wants_native, frame_json, figure_json, dumps
+from http_compression import compress_response, serve_static_asset, compression_stats
+from ingest_queue import IngestQueue, InvalidItem
+from chunking import document_records
+from request_control import SingleFlight, AdmissionLimit, Overloaded, backend_slot, normalize_question
 # from vanna_config import vn, init_db_connection
-from vanna_pgvector_qwen import vn, init_db_connection
+from vanna_pgvector_qwen import vn, init_db_connection, db_config
 
 app = Flask(__name__, static_url_path='')
 
 # SETUP
 cache = MemoryCache()
 
+# vanna的generate_followup_questions只使用结果的前25行
+FOLLOWUP_PREVIEW_ROWS = 25
+
+# run_sql 首页返回的行数，以及分页接口允许的最大页大小
+RUN_SQL_PAGE_SIZE = int(os.environ.get('RUN_SQL_PAGE_SIZE', '10'))
+RUN_SQL_MAX_PAGE_SIZE = int(os.environ.get('RUN_SQL_MAX_PAGE_SIZE', '1000'))
+
+# run_sql 结果缓存：相同（规范化后）SQL在TTL内直接返回缓存结果
+SQL_CACHE_ENABLED = os.environ.get('SQL_CACHE_ENABLED', 'true').lower() == 'true'
+sql_result_cache = SqlResultCache(
+    ttl=float(os.environ.get('SQL_CACHE_TTL', '300')),
+    max_entries=int(os.environ.get('SQL_CACHE_MAX_ENTRIES', '256')),
+    max_bytes=int(os.environ.get('SQL_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+)
+SQL_CACHE_TARGET = f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
+
+# 异步SQL作业：有界线程池 + 每个查询的 statement_timeout
+SQL_JOB_WORKERS = int(os.environ.get('SQL_JOB_WORKERS', '4'))
+SQL_JOB_MAX_PENDING = int(os.environ.get('SQL_JOB_MAX_PENDING', '32'))
+SQL_JOB_TIMEOUT_MS = int(os.environ.get('SQL_JOB_TIMEOUT_MS', '300000'))
+SQL_JOB_MAX_TIMEOUT_MS = int(os.environ.get('SQL_JOB_MAX_TIMEOUT_MS', '1800000'))
+
+# 查询结果就绪后在后台并发生成图表和追问问题（默认关闭）
+PRECOMPUTE_ENABLED = os.environ.get('PRECOMPUTE_ENABLED', 'false').lower() == 'true'
+precomputer = Precomputer(
+    cache,
+    max_workers=int(os.environ.get('PRECOMPUTE_WORKERS', '4')),
+    wait_timeout=float(os.environ.get('PRECOMPUTE_WAIT_TIMEOUT', '120')),
+)
+
+# 绘图点数上限：超过时按图表类型降采样/聚合后再交给plotly
+PLOT_MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', '5000'))
+PLOT_TOP_N = int(os.environ.get('PLOT_TOP_N', '20'))
+
+# 按SQL和结果列类型复用已验证的plotly代码，命中时不再调用LLM
+PLOTLY_CODE_CACHE_ENABLED = os.environ.get('PLOTLY_CODE_CACHE_ENABLED', 'true').lower() == 'true'
+plotly_code_cache = PlotlyCodeCache(max_entries=int(os.environ.get('PLOTLY_CODE_CACHE_MAX_ENTRIES', '1024')))
+
+# 合并相同的并发请求：同一问题的generate_sql、同一SQL的run_sql只计算一次
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+generate_sql_flight = SingleFlight()
+run_sql_flight = SingleFlight()
+
+# 准入控制：限制各接口和各后端（LLM、embedding、数仓）的并发数，
+# 超出的请求在有界队列中等待，队列已满或等待超时时立即返回429/503和Retry-After
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', '64'))
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', '10'))
+
+def admission_limit(name: str, default: int) -> AdmissionLimit:
+    return AdmissionLimit(
+        name,
+        max_concurrent=int(os.environ.get(f'ADMISSION_{name.upper()}_CONCURRENCY', str(default))),
+        max_waiting=ADMISSION_MAX_WAITING,
+        wait_timeout=ADMISSION_WAIT_TIMEOUT,
+    )
+
+endpoint_limits = {name: admission_limit(name, default) for name, default in [
+    ('generate_sql', 16), ('run_sql', 16), ('generate_plotly_figure', 16), ('generate_followup_questions', 16),
+]}
+backend_limits = {name: admission_limit(name, default) for name, default in [
+    ('llm', 8), ('embedding', 8), ('warehouse', 8),
+]}
+if ADMISSION_ENABLED:
+    # LLM和embedding的调用在vn内部，由它按这些限制获取名额
+    vn.backend_limits = backend_limits
+
+# 批量生成SQL：单次请求的问题数上限和默认并发数
+BATCH_SQL_MAX_QUESTIONS = int(os.environ.get('BATCH_SQL_MAX_QUESTIONS', '1000'))
+BATCH_SQL_CONCURRENCY = int(os.environ.get('BATCH_SQL_CONCURRENCY', '8'))
+BATCH_SQL_MAX_CONCURRENCY = int(os.environ.get('BATCH_SQL_MAX_CONCURRENCY', '32'))
+
+# 训练数据异步写入：/api/v0/train 写入本地队列后立即返回作业id，由后台线程批量生成向量并写入
+TRAIN_ASYNC_ENABLED = os.environ.get('TRAIN_ASYNC_ENABLED', 'false').lower() == 'true'
+TRAIN_QUEUE_PATH = os.environ.get('TRAIN_QUEUE_PATH', 'ingest_queue.db')
+TRAIN_QUEUE_WORKERS = int(os.environ.get('TRAIN_QUEUE_WORKERS', '2'))
+TRAIN_QUEUE_BATCH_SIZE = int(os.environ.get('TRAIN_QUEUE_BATCH_SIZE', '32'))
+TRAIN_QUEUE_LEASE_SECONDS = float(os.environ.get('TRAIN_QUEUE_LEASE_SECONDS', '600'))
+TRAIN_MAX_ITEMS = int(os.environ.get('TRAIN_MAX_ITEMS', '1000'))
+
+# 历史问题分页大小
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '100'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '1000'))
+
+# 首页推荐问题：按TTL和训练数据版本缓存，过期后先返回旧值再在后台刷新
+suggested_questions = StaleWhileRevalidateValue(
+    lambda: vn.generate_questions(allow_llm_to_see_data=True),
+    ttl=float(os.environ.get('GENERATE_QUESTIONS_TTL', '3600')),
+)
+
 # 初始化数据库连接
 init_db_connection()
 
@@ -27,11 +136,13 @@ def requires_cache(fields):
             if id is None:
                 return jsonify({"type": "error", "error": "No id provided"})
             
+            field_values = {}
             for field in fields:
-                if cache.get(id=id, field=field) is None:
+                # 字段正在后台预计算时等待其完成
+                value = precomputer.wait(id=id, field=field)
+                if value is None:
                     return jsonify({"type": "error", "error": f"No {field} found"})
-            
-            field_values = {field: cache.get(id=id, field=field) for field in fields}
+                field_values[field] = value
             
             # Add the id to the field_values
             field_values['id'] = id
@@ -40,15 +151,218 @@ def requires_cache(fields):
         return decorated
     return decorator
 
+def admit(endpoint):
+    """按接口限制并发，未被准入时由 Overloaded 的错误处理返回429/503"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return f(*args, **kwargs)
+            with endpoint_limits[endpoint].slot():
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+def endpoint_slot(endpoint):
+    """接口的执行名额，用于不经过 admit 装饰器的调用（如批量接口中的每个问题）"""
+    return endpoint_limits[endpoint].slot() if ADMISSION_ENABLED else contextlib.nullcontext()
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({"type": "error", "error": str(e)})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def execute_sql(sql: str, use_cache: bool = True, limit_warehouse: bool = True, **run_options):
+    """
+    执行SQL并返回 (ColumnarFrame, 是否截断)，优先使用结果缓存
+
+    limit_warehouse=False 时不受数仓并发限制（异步SQL作业由自己的线程池限制并发）。
+    run_options 传给 run_sql_capped（超时、取消和进度回调等）
+    """
+    use_cache = use_cache and SQL_CACHE_ENABLED
+    if use_cache:
+        cached = sql_result_cache.get(sql, SQL_CACHE_TARGET)
+        if cached is not None:
+            return cached
+
+    # 服务端游标执行，缓存的行数和字节数有硬上限
+    with backend_slot(vn.backend_limits if limit_warehouse else {}, 'warehouse'):
+        df, truncated = run_sql_capped(sql, **run_options)
+
+    # 以压缩列式格式缓存结果，释放原始DataFrame
+    result = ColumnarFrame(df)
+    del df
+
+    if use_cache:
+        sql_result_cache.put(sql, SQL_CACHE_TARGET, (result, truncated), nbytes=result.nbytes)
+
+    return result, truncated
+
+def execute_plotly_code(compiled, df):
+    """
+    执行编译好的plotly代码，代码必须生成名为fig的图表
+
+    LLM生成的代码常用 pd/np（如 pd.to_datetime、np.where）；vanna 在自身模块的全局变量中执行代码，pd 可用，这里同样提供
+    """
+    namespace = {"df": df, "px": px, "go": go, "pd": pd, "np": np}
+    exec(compiled, namespace)
+    fig = namespace.get("fig")
+    if fig is None:
+        raise ValueError("plotly代码没有生成fig")
+    return fig
+
+def build_plotly_figure(id, question, sql, df) -> str:
+    """
+    生成plotly代码并执行，返回图表JSON
+
+    相同SQL和列类型的结果复用缓存中已验证的代码，否则调用LLM生成。
+    """
+    cached = plotly_code_cache.get(sql, df.dtypes) if PLOTLY_CODE_CACHE_ENABLED else None
+    if cached is not None:
+        code, compiled = cached
+    else:
+        code = vn.generate_plotly_code(**plotly_code_args(question, sql, df))
+        compiled = None
+    return render_plotly_figure(id, sql, df, code, compiled)
+
+def plotly_code_args(question, sql, df) -> dict:
+    return {"question": question, "sql": sql, "df_metadata": f"Running df.dtypes gives:\n {df.dtypes}"}
+
+def render_plotly_figure(id, sql, df, code, compiled=None) -> str:
+    """
+    执行plotly代码并返回图表JSON，compiled 不为None表示代码来自缓存
+
+    大结果先按图表类型缩减，原始与实际绘制的点数记录在缓存的 fig_points 字段
+    """
+    dtypes = df.dtypes
+    from_cache = compiled is not None
+    plot_df, points = reduce_for_chart(df.to_pandas(), plotly_code=code,
+                                       max_points=PLOT_MAX_POINTS, top_n=PLOT_TOP_N)
+
+    try:
+        if compiled is None:
+            compiled = compile(code, '<plotly_code>', 'exec')
+        fig = execute_plotly_code(compiled, plot_df)
+        if not from_cache and PLOTLY_CODE_CACHE_ENABLED:
+            plotly_code_cache.put(sql, dtypes, code, compiled)
+    except Exception as e:
+        print(f"[WARNING] plotly代码执行失败，使用默认图表: {e}")
+        if from_cache:
+            plotly_code_cache.invalidate(sql, dtypes)
+        # vanna在代码执行失败时会根据列类型选择默认图表
+        fig = vn.get_plotly_figure(plotly_code=code, df=plot_df, dark_mode=False)
+
+    cache.set(id=id, field='fig_points', value=points)
+    return fig.to_json()
+
+def build_followup_questions(question, sql, df) -> list:
+    return vn.generate_followup_questions(question=question, sql=sql, df=df.head(FOLLOWUP_PREVIEW_ROWS))
+
+def start_precompute(id, sql, df):
+    """结果写入缓存后，在后台同时开始生成图表和追问问题"""
+    if not PRECOMPUTE_ENABLED:
+        return
+
+    question = cache.get(id=id, field='question')
+    if question is None:
+        return
+
+    precomputer.submit(id, 'fig_json', build_plotly_figure, id, question, sql, df)
+    precomputer.submit(id, 'followup_questions', build_followup_questions, question, sql, df)
+
+def _run_sql_job(job, on_connect, on_progress):
+    return execute_sql(job.sql, use_cache=job.context.get('use_cache', True), limit_warehouse=False,
+                       statement_timeout_ms=job.statement_timeout_ms,
+                       on_connect=on_connect, on_progress=on_progress)
+
+def _store_sql_job_result(job):
+    result, truncated = job.result
+    cache.set(id=job.context['id'], field='df', value=result)
+    cache.set(id=job.context['id'], field='df_truncated', value=truncated)
+    start_precompute(job.context['id'], job.sql, result)
+
+sql_jobs = SqlJobManager(_run_sql_job, max_workers=SQL_JOB_WORKERS, max_pending=SQL_JOB_MAX_PENDING)
+
+def training_items(body) -> list:
+    """请求中的训练条目：单个条目，或 items 中的多个条目"""
+    if not isinstance(body, dict):
+        raise ValueError("No training data provided")
+    items = body['items'] if 'items' in body else [body]
+    if not isinstance(items, list) or not items:
+        raise ValueError("No training data provided")
+    if len(items) > TRAIN_MAX_ITEMS:
+        raise ValueError(f"Too many training items (max {TRAIN_MAX_ITEMS})")
+
+    cleaned = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f"Invalid training item: {item!r}")
+        item = {key: item[key] for key in ('question', 'sql', 'ddl', 'documentation') if item.get(key)}
+        if not item:
+            raise ValueError("No training data provided")
+        if 'question' in item and 'sql' not in item:
+            raise ValueError("Please also provide a SQL query")
+        cleaned.append(item)
+    return cleaned
+
+def training_records(item: dict) -> list:
+    """
+    与 vn.train 的优先级相同：文档、问答对、DDL；只有SQL时由LLM生成问题
+
+    长文档与 vn.add_documentation 一样切分为父行和多个块，见 chunking.document_records
+    """
+    if item.get('documentation'):
+        return document_records(item['documentation'])
+    if item.get('sql'):
+        question = item.get('question') or vn.generate_question(item['sql'])
+        return [{'type': 'question_sql', 'content': f"{question} :: {item['sql']}"}]
+    if item.get('ddl'):
+        return [{'type': 'ddl', 'content': item['ddl']}]
+    raise InvalidItem("条目需要包含 documentation、sql 或 ddl")
+
+_ingest_local = threading.local()
+
+def insert_training_batch(records: list) -> list:
+    """队列的每个工作线程使用自己的向量库连接"""
+    conn = getattr(_ingest_local, 'conn', None)
+    if conn is None or conn.closed:
+        conn = _ingest_local.conn = vn.new_connection()
+    return vn._bulk_insert(records, conn=conn)
+
+ingest_queue = IngestQueue(
+    TRAIN_QUEUE_PATH,
+    to_records=training_records,
+    embed_batch=vn.generate_embeddings,
+    insert_batch=insert_training_batch,
+    workers=TRAIN_QUEUE_WORKERS,
+    batch_size=TRAIN_QUEUE_BATCH_SIZE,
+    lease_timeout=TRAIN_QUEUE_LEASE_SECONDS,
+) if TRAIN_ASYNC_ENABLED else None
+
+def sql_job_payload(job, native=False):
+    payload = {"type": "sql_job", "id": job.context.get('id'), **job.to_dict()}
+    if job.status == 'succeeded':
+        result, truncated = job.result
+        payload.update({
+            "df": frame_json(result.head(RUN_SQL_PAGE_SIZE), native),
+            "row_count": len(result),
+            "truncated": truncated,
+            "page_size": RUN_SQL_PAGE_SIZE,
+        })
+    return payload
+
 @app.route('/api/v0/generate_questions', methods=['GET'])
 def generate_questions():
     return jsonify({
         "type": "question_list", 
-        "questions": vn.generate_questions(allow_llm_to_see_data=True),
+        "questions": suggested_questions.get(version=vn.training_version),
         "header": "Here are some questions you can ask:"
         })
 
 @app.route('/api/v0/generate_sql', methods=['GET'])
+@admit('generate_sql')
 def generate_sql():
     question = flask.request.args.get('question')
 
@@ -56,7 +370,11 @@ def generate_sql():
         return jsonify({"type": "error", "error": "No question provided"})
 
     id = cache.generate_id(question=question)
-    sql = vn.generate_sql(question=question, allow_llm_to_see_data=True)
+    if SINGLE_FLIGHT_ENABLED:
+        sql = generate_sql_flight.do(normalize_question(question), vn.generate_sql,
+                                     question=question, allow_llm_to_see_data=True)
+    else:
+        sql = vn.generate_sql(question=question, allow_llm_to_see_data=True)
 
     cache.set(id=id, field='question', value=question)
     cache.set(id=id, field='sql', value=sql)
@@ -68,51 +386,320 @@ def generate_sql():
             "text": sql,
         })
 
+def parse_batch_questions(body) -> list:
+    """把请求中的问题列表统一为 [{"question", "expected_sql"}]，元素可以是字符串或对象"""
+    questions = body.get('questions') if isinstance(body, dict) else None
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("No questions provided")
+    if len(questions) > BATCH_SQL_MAX_QUESTIONS:
+        raise ValueError(f"Too many questions (max {BATCH_SQL_MAX_QUESTIONS})")
+
+    items = []
+    for item in questions:
+        if isinstance(item, str):
+            item = {"question": item}
+        if not isinstance(item, dict) or not isinstance(item.get('question'), str) or not item['question'].strip():
+            raise ValueError(f"Invalid question: {item!r}")
+        items.append({"question": item['question'], "expected_sql": item.get('expected_sql')})
+    return items
+
+def results_match(actual, expected) -> bool:
+    """比较两个查询结果，忽略列名和行顺序"""
+    actual, expected = actual.to_pandas(), expected.to_pandas()
+    if actual.shape != expected.shape:
+        return False
+
+    def rows(df):
+        return sorted(tuple(map(str, row)) for row in df.itertuples(index=False, name=None))
+    return rows(actual) == rows(expected)
+
+def run_batch_question(index: int, item: dict, embedding, execute: bool) -> dict:
+    """批量接口中的单个问题：生成SQL，按需执行并与期望SQL的结果比较"""
+    question = item['question']
+    result = {"type": "sql_result", "index": index, "question": question}
+    timings = {}
+    start = time.perf_counter()
+    try:
+        # 与 /api/v0/generate_sql 共用同一个准入限制，批量评估不会绕过接口并发上限
+        with endpoint_slot('generate_sql'):
+            sql = vn.generate_sql(question=question, allow_llm_to_see_data=True, embedding=embedding)
+        timings['generate_sql_ms'] = (time.perf_counter() - start) * 1000
+
+        id = cache.generate_id(question=question)
+        cache.set(id=id, field='question', value=question)
+        cache.set(id=id, field='sql', value=sql)
+        result.update({"id": id, "sql": sql})
+
+        if item['expected_sql'] is not None:
+            result['expected_sql'] = item['expected_sql']
+            result['exact_match'] = normalize_sql(sql) == normalize_sql(item['expected_sql'])
+
+        if execute:
+            step = time.perf_counter()
+            df, truncated = execute_sql(sql)
+            timings['run_sql_ms'] = (time.perf_counter() - step) * 1000
+            cache.set(id=id, field='df', value=df)
+            cache.set(id=id, field='df_truncated', value=truncated)
+            result.update({"row_count": len(df), "truncated": truncated})
+
+            if item['expected_sql'] is not None:
+                expected, _ = execute_sql(item['expected_sql'])
+                result['result_match'] = results_match(df, expected)
+    except Overloaded as e:
+        result.update({"error": str(e), "status": e.status, "retry_after": e.retry_after})
+    except Exception as e:
+        result['error'] = str(e)
+
+    timings['total_ms'] = (time.perf_counter() - start) * 1000
+    result['timings'] = timings
+    return result
+
+@app.route('/api/v0/generate_sql_batch', methods=['POST'])
+def generate_sql_batch():
+    """
+    批量生成SQL，用于评估：所有问题的向量一次批量生成，检索和LLM调用以有限并发执行，
+    每完成一个问题输出一行JSON（NDJSON），最后一行为汇总
+    """
+    body = request.get_json(silent=True)
+    try:
+        items = parse_batch_questions(body)
+    except ValueError as e:
+        return jsonify({"type": "error", "error": str(e)})
+    concurrency = body.get('concurrency')
+    try:
+        concurrency = BATCH_SQL_CONCURRENCY if concurrency is None else int(concurrency)
+    except (TypeError, ValueError):
+        return jsonify({"type": "error", "error": f"Invalid concurrency: {concurrency!r}"})
+    concurrency = max(1, min(concurrency, BATCH_SQL_MAX_CONCURRENCY))
+    execute = bool(body.get('execute', False))
+
+    start = time.perf_counter()
+    try:
+        embeddings = vn.generate_embeddings([item['question'] for item in items])
+    except Exception as e:
+        return jsonify({"type": "error", "error": str(e)})
+    embedding_ms = (time.perf_counter() - start) * 1000
+
+    def results():
+        summary = {"type": "batch_summary", "count": len(items), "errors": 0,
+                   "exact_match": 0, "result_match": 0, "embedding_ms": embedding_ms}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='sql-batch')
+        try:
+            futures = [executor.submit(run_batch_question, i, item, embeddings[i], execute)
+                       for i, item in enumerate(items)]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                summary['errors'] += 'error' in result
+                summary['exact_match'] += bool(result.get('exact_match'))
+                summary['result_match'] += bool(result.get('result_match'))
+                yield dumps(result) + b'\n'
+        finally:
+            # 客户端断开时不再开始剩余的问题
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        summary['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        yield dumps(summary) + b'\n'
+
+    return Response(results(), mimetype='application/x-ndjson')
+
 @app.route('/api/v0/run_sql', methods=['GET'])
+@admit('run_sql')
 @requires_cache(['sql'])
 def run_sql(id: str, sql: str):
     try:
-        df = vn.run_sql(sql=sql)
-
-        cache.set(id=id, field='df', value=df)
-
-        return jsonify(
+        # cache=false 时跳过结果缓存，强制查询数据仓库
+        use_cache = request.args.get('cache', 'true').lower() != 'false'
+        if SINGLE_FLIGHT_ENABLED and use_cache:
+            # cache=false 要求重新执行，不与进行中的查询合并
+            key = SqlResultCache.make_key(sql, SQL_CACHE_TARGET)
+            result, truncated = run_sql_flight.do(key, execute_sql, sql, use_cache=use_cache)
+        else:
+            result, truncated = execute_sql(sql, use_cache=use_cache)
+
+        cache.set(id=id, field='df', value=result)
+        cache.set(id=id, field='df_truncated', value=truncated)
+        start_precompute(id, sql, result)
+
+        return json_response(
             {
                 "type": "df", 
                 "id": id,
-                "df": df.head(10).to_json(orient='records'),
+                "df": frame_json(result.head(RUN_SQL_PAGE_SIZE), wants_native()),
+                "row_count": len(result),
+                "truncated": truncated,
+                "page_size": RUN_SQL_PAGE_SIZE,
             })
 
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"type": "error", "error": str(e)})
 
-@app.route('/api/v0/download_csv', methods=['GET'])
+@app.route('/api/v0/run_sql_async', methods=['GET'])
+@requires_cache(['sql'])
+def run_sql_async(id: str, sql: str):
+    """提交SQL作业并立即返回作业id，结果就绪后写入该问题的缓存"""
+    try:
+        timeout_ms = int(request.args.get('timeout_ms', SQL_JOB_TIMEOUT_MS))
+    except ValueError:
+        return jsonify({"type": "error", "error": "Invalid timeout_ms"})
+    timeout_ms = max(1, min(timeout_ms, SQL_JOB_MAX_TIMEOUT_MS))
+    use_cache = request.args.get('cache', 'true').lower() != 'false'
+
+    try:
+        job = sql_jobs.submit(sql, statement_timeout_ms=timeout_ms,
+                              context={'id': id, 'use_cache': use_cache},
+                              on_success=_store_sql_job_result)
+    except JobQueueFull as e:
+        return jsonify({"type": "error", "error": str(e)})
+
+    return json_response(sql_job_payload(job, wants_native()))
+
+@app.route('/api/v0/sql_job_status', methods=['GET'])
+def sql_job_status():
+    job = sql_jobs.get(request.args.get('job_id', ''))
+    if job is None:
+        return jsonify({"type": "error", "error": "No job found"})
+
+    return json_response(sql_job_payload(job, wants_native()))
+
+@app.route('/api/v0/sql_job_events', methods=['GET'])
+def sql_job_events():
+    """以Server-Sent Events推送作业状态，直到作业结束"""
+    job = sql_jobs.get(request.args.get('job_id', ''))
+    if job is None:
+        return jsonify({"type": "error", "error": "No job found"})
+
+    def events():
+        last = None
+        while True:
+            finished = job.finished
+            payload = sql_job_payload(job) if finished else {"type": "sql_job", **job.to_dict()}
+            state = (payload['status'], payload['rows'])
+            if state != last:
+                yield f"data: {dumps(payload).decode('utf-8')}\n\n"
+                last = state
+            if finished:
+                return
+            time.sleep(0.5)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/v0/cancel_sql_job', methods=['POST'])
+def cancel_sql_job():
+    job_id = flask.request.json.get('job_id')
+
+    if job_id is None:
+        return jsonify({"type": "error", "error": "No job_id provided"})
+
+    if sql_jobs.cancel(job_id):
+        return jsonify({"success": True})
+    else:
+        return jsonify({"type": "error", "error": "Couldn't cancel job"})
+
+@app.route('/api/v0/get_result_page', methods=['GET'])
 @requires_cache(['df'])
-def download_csv(id: str, df):
-    csv = df.to_csv()
+def get_result_page(id: str, df):
+    """分页读取缓存的查询结果，只解码该页覆盖的row group"""
+    try:
+        page = max(0, int(request.args.get('page', 0)))
+        page_size = int(request.args.get('page_size', RUN_SQL_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"type": "error", "error": "Invalid page or page_size"})
+
+    page_size = max(1, min(page_size, RUN_SQL_MAX_PAGE_SIZE))
+    offset = page * page_size
+
+    return json_response(
+        {
+            "type": "df",
+            "id": id,
+            "df": frame_json(df.slice(offset, page_size), wants_native()),
+            "page": page,
+            "page_size": page_size,
+            "row_count": len(df),
+            "has_more": offset + page_size < len(df),
+            "truncated": bool(cache.get(id=id, field='df_truncated')),
+        })
+
+@app.route('/api/v0/download_csv', methods=['GET'])
+@requires_cache(['sql'])
+def download_csv(id: str, sql: str):
+    """
+    流式导出查询结果
+
+    参数:
+        format: csv(默认) / parquet / xlsx
+        compression: gzip 时对导出文件做gzip压缩
+        source: cache(默认，使用缓存结果) / db（用服务端游标重新执行SQL）
+    """
+    export_format = request.args.get('format', 'csv')
+    compression = request.args.get('compression')
+    source = request.args.get('source', 'cache')
+
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"type": "error", "error": f"Unsupported format: {export_format}"})
+
+    if source == 'db':
+        frames = iter_sql_chunks(sql)
+        result = None
+    else:
+        result = cache.get(id=id, field='df')
+        if result is None:
+            return jsonify({"type": "error", "error": "No df found"})
+        frames = result.iter_batches()
+
+    try:
+        if export_format == 'parquet' and result is not None and result.columnar:
+            # 缓存本身就是Parquet，直接输出，无需重新编码
+            body = result.iter_parquet()
+        elif export_format == 'parquet':
+            body = iter_parquet(frames)
+        elif export_format == 'xlsx':
+            body = iter_xlsx(frames)
+        else:
+            body = iter_csv(frames)
+
+        # 先取出第一块，让SQL执行错误在开始响应之前暴露出来
+        first = next(body, b'')
+        body = itertools.chain([first], body)
+    except Exception as e:
+        return jsonify({"type": "error", "error": str(e)})
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"{id}.{extension}"
+    if compression == 'gzip':
+        body = gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
 
     return Response(
-        csv,
-        mimetype="text/csv",
+        body,
+        mimetype=mimetype,
         headers={"Content-disposition":
-                 f"attachment; filename={id}.csv"})
+                 f"attachment; filename={filename}"})
 
 @app.route('/api/v0/generate_plotly_figure', methods=['GET'])
+@admit('generate_plotly_figure')
 @requires_cache(['df', 'question', 'sql'])
 def generate_plotly_figure(id: str, df, question, sql):
     try:
-        code = vn.generate_plotly_code(question=question, sql=sql, df_metadata=f"Running df.dtypes gives:\n {df.dtypes}")
-        fig = vn.get_plotly_figure(plotly_code=code, df=df, dark_mode=False)
-        fig_json = fig.to_json()
+        # 已在后台生成（或正在生成）时直接使用其结果
+        fig_json = precomputer.wait(id=id, field='fig_json') if PRECOMPUTE_ENABLED else None
+        if fig_json is None:
+            fig_json = build_plotly_figure(id, question, sql, df)
 
         cache.set(id=id, field='fig_json', value=fig_json)
 
-        return jsonify(
+        return json_response(
             {
                 "type": "plotly_figure", 
                 "id": id,
-                "fig": fig_json,
+                "fig": figure_json(fig_json, wants_native()),
+                "points": cache.get(id=id, field='fig_points'),
             })
+    except Overloaded:
+        raise
     except Exception as e:
         # Print the stack trace
         import traceback
@@ -124,11 +711,11 @@ def generate_plotly_figure(id: str, df, question, sql):
 def get_training_data():
     df = vn.get_training_data()
 
-    return jsonify(
+    return json_response(
     {
         "type": "df", 
         "id": "training_data",
-        "df": df.head(1000).to_json(orient='records'),
+        "df": frame_json(df.head(1000), wants_native()),
     })
 
 @app.route('/api/v0/remove_training_data', methods=['POST'])
@@ -146,23 +733,46 @@ def remove_training_data():
 
 @app.route('/api/v0/train', methods=['POST'])
 def add_training_data():
-    question = flask.request.json.get('question')
-    sql = flask.request.json.get('sql')
-    ddl = flask.request.json.get('ddl')
-    documentation = flask.request.json.get('documentation')
+    body = flask.request.json
+    try:
+        items = training_items(body)
+    except ValueError as e:
+        return jsonify({"type": "error", "error": str(e)})
+
+    if ingest_queue is not None:
+        # 写入队列后立即返回，通过 /api/v0/train_job_status 查询进度
+        job_id = ingest_queue.submit(items)
+        return jsonify({"type": "train_job", **ingest_queue.get(job_id)})
 
     try:
-        id = vn.train(question=question, sql=sql, ddl=ddl, documentation=documentation)
+        ids = [vn.train(**item) for item in items]
 
-        return jsonify({"id": id})
+        if 'items' in body:
+            return jsonify({"ids": ids})
+        return jsonify({"id": ids[0]})
+    except Overloaded:
+        raise
     except Exception as e:
         print("TRAINING ERROR", e)
         return jsonify({"type": "error", "error": str(e)})
 
+@app.route('/api/v0/train_job_status', methods=['GET'])
+def train_job_status():
+    if ingest_queue is None:
+        return jsonify({"type": "error", "error": "Async training is disabled"})
+
+    status = ingest_queue.get(request.args.get('job_id', ''))
+    if status is None:
+        return jsonify({"type": "error", "error": "No job found"})
+    return jsonify({"type": "train_job", **status})
+
 @app.route('/api/v0/generate_followup_questions', methods=['GET'])
+@admit('generate_followup_questions')
 @requires_cache(['df', 'question', 'sql'])
 def generate_followup_questions(id: str, df, question, sql):
-    followup_questions = vn.generate_followup_questions(question=question, sql=sql, df=df)
+    followup_questions = precomputer.wait(id=id, field='followup_questions') if PRECOMPUTE_ENABLED else None
+    if followup_questions is None:
+        followup_questions = build_followup_questions(question, sql, df)
 
     cache.set(id=id, field='followup_questions', value=followup_questions)
 
@@ -178,14 +788,15 @@ def generate_followup_questions(id: str, df, question, sql):
 @requires_cache(['question', 'sql', 'df', 'fig_json', 'followup_questions'])
 def load_question(id: str, question, sql, df, fig_json, followup_questions):
     try:
-        return jsonify(
+        native = wants_native()
+        return json_response(
             {
                 "type": "question_cache", 
                 "id": id,
                 "question": question,
                 "sql": sql,
-                "df": df.head(10).to_json(orient='records'),
-                "fig": fig_json,
+                "df": frame_json(df.head(10), native),
+                "fig": figure_json(fig_json, native),
                 "followup_questions": followup_questions,
             })
 
@@ -194,11 +805,68 @@ def load_question(id: str, question, sql, df, fig_json, followup_questions):
 
 @app.route('/api/v0/get_question_history', methods=['GET'])
 def get_question_history():
-    return jsonify({"type": "question_history", "questions": cache.get_all(field_list=['question']) })
+    """
+    分页返回历史问题（从新到旧）
+
+    参数: limit 页大小, cursor 上一页返回的next_cursor, q 搜索词, match=prefix 时按前缀匹配
+    """
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"type": "error", "error": "Invalid limit or cursor"})
+
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    questions, next_cursor = cache.get_question_page(
+        limit=limit,
+        cursor=cursor,
+        search=request.args.get('q'),
+        prefix=request.args.get('match') == 'prefix',
+    )
+
+    return jsonify({
+        "type": "question_history",
+        "questions": questions,
+        "next_cursor": next_cursor,
+        "total": cache.question_count,
+    })
+
+@app.route('/api/v0/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        "type": "metrics",
+        "sql_result_cache": sql_result_cache.get_stats(),
+        "sql_jobs": sql_jobs.get_stats(),
+        "precompute": precomputer.get_stats(),
+        "suggested_questions": suggested_questions.get_stats(),
+        "plotly_code_cache": plotly_code_cache.get_stats(),
+        "compression": compression_stats.get_stats(),
+        "admission": {
+            "enabled": ADMISSION_ENABLED,
+            "endpoints": {name: limit.get_stats() for name, limit in endpoint_limits.items()},
+            "backends": {name: limit.get_stats() for name, limit in backend_limits.items()},
+        },
+        "train_queue": ingest_queue.get_stats() if ingest_queue is not None else None,
+        "single_flight": {
+            "generate_sql": generate_sql_flight.get_stats(),
+            "run_sql": run_sql_flight.get_stats(),
+        },
+    })
+
+@app.route('/assets/<path:filename>')
+def static_assets(filename):
+    # 带哈希的构建产物可以长期缓存，支持时发送预压缩版本
+    return serve_static_asset(app, filename)
 
 @app.route('/')
 def root():
-    return app.send_static_file('index.html')
+    response = app.send_static_file('index.html')
+    # index.html引用的资源文件名随构建变化，需要每次校验
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+app.after_request(compress_response)
 
 # 修改初始化部分，移除检查Ollama模型的代码
 def init_app():
@@ -0,0 +1,185 @@
+# asgi.py
+"""
+异步服务模式
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+生成SQL、图表和追问问题这三个接口的大部分时间花在等待LLM、Ollama embedding和pgvector上。
+线程模式下每个进行中的请求占用一个线程；这里改为在事件循环中等待这些调用，
+少量工作进程即可承载大量并发请求。
+其余接口（执行SQL、下载、训练等）仍由原Flask应用处理，通过 WsgiToAsgi 在线程池中运行。
+两种模式共享同一个问题缓存和结果缓存，可以混合调用。
+"""
+
+import asyncio
+import traceback
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (app as flask_app, cache, precomputer, plotly_code_cache, vn, generate_sql_flight, endpoint_limits,
+                 plotly_code_args, render_plotly_figure, ADMISSION_ENABLED,
+                 FOLLOWUP_PREVIEW_ROWS, PLOTLY_CODE_CACHE_ENABLED, PRECOMPUTE_ENABLED, SINGLE_FLIGHT_ENABLED)
+from fast_json import dumps, figure_json
+from request_control import Overloaded, normalize_question
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def cached_field(id: str, field: str):
+    """读取问题缓存中的字段，字段正在后台预计算时等待其完成"""
+    value = cache.get(id=id, field=field)
+    if value is not None:
+        return value
+
+    future = precomputer.pending(id, field)
+    if future is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=precomputer.wait_timeout)
+    except Exception as e:
+        print(f"[WARNING] 等待预计算 {field} 失败: {e}")
+        return None
+
+
+async def require_fields(params: dict, fields: list):
+    """与 app.requires_cache 相同：返回 (字段值, None) 或 (None, 错误响应)"""
+    id = params.get('id')
+    if id is None:
+        return None, {"type": "error", "error": "No id provided"}
+
+    values = {'id': id}
+    for field in fields:
+        value = await cached_field(id, field)
+        if value is None:
+            return None, {"type": "error", "error": f"No {field} found"}
+        values[field] = value
+    return values, None
+
+
+async def generate_sql(params: dict) -> dict:
+    question = params.get('question')
+
+    if question is None:
+        return {"type": "error", "error": "No question provided"}
+
+    id = cache.generate_id(question=question)
+    if SINGLE_FLIGHT_ENABLED:
+        sql = await generate_sql_flight.ado(normalize_question(question), vn.agenerate_sql,
+                                            question=question, allow_llm_to_see_data=True)
+    else:
+        sql = await vn.agenerate_sql(question=question, allow_llm_to_see_data=True)
+
+    cache.set(id=id, field='question', value=question)
+    cache.set(id=id, field='sql', value=sql)
+
+    return {"type": "sql", "id": id, "text": sql}
+
+
+async def generate_plotly_figure(params: dict) -> dict:
+    values, error = await require_fields(params, ['df', 'question', 'sql'])
+    if error is not None:
+        return error
+    id, df, question, sql = values['id'], values['df'], values['question'], values['sql']
+
+    fig_json = await cached_field(id, 'fig_json') if PRECOMPUTE_ENABLED else None
+    if fig_json is None:
+        cached = plotly_code_cache.get(sql, df.dtypes) if PLOTLY_CODE_CACHE_ENABLED else None
+        if cached is not None:
+            code, compiled = cached
+        else:
+            code = await vn.agenerate_plotly_code(**plotly_code_args(question, sql, df))
+            compiled = None
+        # 缩减数据和执行绘图代码是CPU密集的，放到线程中
+        fig_json = await asyncio.to_thread(render_plotly_figure, id, sql, df, code, compiled)
+
+    cache.set(id=id, field='fig_json', value=fig_json)
+
+    return {
+        "type": "plotly_figure",
+        "id": id,
+        "fig": figure_json(fig_json, params.get('format') == 'native'),
+        "points": cache.get(id=id, field='fig_points'),
+    }
+
+
+async def generate_followup_questions(params: dict) -> dict:
+    values, error = await require_fields(params, ['df', 'question', 'sql'])
+    if error is not None:
+        return error
+    id, df, question, sql = values['id'], values['df'], values['question'], values['sql']
+
+    followup_questions = await cached_field(id, 'followup_questions') if PRECOMPUTE_ENABLED else None
+    if followup_questions is None:
+        followup_questions = await vn.agenerate_followup_questions(
+            question=question, sql=sql, df=df.head(FOLLOWUP_PREVIEW_ROWS))
+
+    cache.set(id=id, field='followup_questions', value=followup_questions)
+
+    return {
+        "type": "question_list",
+        "id": id,
+        "questions": followup_questions,
+        "header": "Here are some followup questions you can ask:",
+    }
+
+
+ROUTES = {
+    '/api/v0/generate_sql': ('generate_sql', generate_sql),
+    '/api/v0/generate_plotly_figure': ('generate_plotly_figure', generate_plotly_figure),
+    '/api/v0/generate_followup_questions': ('generate_followup_questions', generate_followup_questions),
+}
+
+
+async def admitted(endpoint: str, handler, params: dict) -> dict:
+    """与 app.admit 相同的按接口并发限制"""
+    if not ADMISSION_ENABLED:
+        return await handler(params)
+    async with endpoint_limits[endpoint].aslot():
+        return await handler(params)
+
+
+async def send_json(send, payload: dict, status: int = 200, headers: list = ()):
+    body = dumps(payload)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await vn.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    route = ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    if route is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    params = {key: values[0] for key, values in query.items()}
+    try:
+        payload = await admitted(*route, params)
+    except Overloaded as e:
+        await send_json(send, {"type": "error", "error": str(e)}, status=e.status,
+                        headers=[(b'retry-after', str(e.retry_after).encode())])
+        return
+    except Exception as e:
+        traceback.print_exc()
+        payload = {"type": "error", "error": str(e)}
+    await send_json(send, payload)
@@ -0,0 +1,103 @@
+# bench_async_load.py
+"""
+线程模式与异步服务模式的并发负载对比
+
+对同一接口分别向两个服务发送固定并发的请求，输出吞吐量和延迟分位数。
+两个服务应连接相同的LLM/Ollama/pgvector（或 benchmarks 下的模拟服务），例如：
+
+    python app.py                                   # 线程模式，端口5000
+    uvicorn asgi:app --port 8000                    # 异步模式
+
+    python benchmarks/bench_async_load.py \
+        --target threaded=http://127.0.0.1:5000 --target asgi=http://127.0.0.1:8000 \
+        --path /api/v0/generate_sql --param question=各地区的销售额 --concurrency 50 200 500
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def run_load(base_url: str, path: str, params: dict, concurrency: int, total: int, timeout: float) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                    ok = response.status_code == 200 and response.json().get('type') != 'error'
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程模式与异步服务模式的并发负载对比")
+    parser.add_argument('--target', action='append', required=True,
+                        help="名称=地址，例如 asgi=http://127.0.0.1:8000，可重复")
+    parser.add_argument('--path', default='/api/v0/generate_sql')
+    parser.add_argument('--param', action='append', default=[], help="查询参数 key=value，可重复")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--requests', type=int, default=0, help="每轮请求数，默认为并发数的5倍")
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', action='store_true', help="以JSON输出结果")
+    args = parser.parse_args()
+
+    targets = [t.split('=', 1) for t in args.target]
+    params = dict(p.split('=', 1) for p in args.param)
+
+    results = []
+    for concurrency in args.concurrency:
+        total = args.requests or concurrency * 5
+        for name, url in targets:
+            stats = asyncio.run(run_load(url, args.path, params, concurrency, total, args.timeout))
+            results.append({"target": name, "concurrency": concurrency, **stats})
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'target':<12}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['target']:<12}{r['concurrency']:>6}{r['throughput']:>10.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
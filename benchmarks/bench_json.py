@@ -0,0 +1,101 @@
+# bench_json.py
+"""
+API响应JSON序列化基准测试
+
+对比三种编码方式的耗时和响应大小：
+    jsonify   : 现有方式，df/fig先编码为字符串，再由json.dumps整体编码（二次编码）
+    orjson    : orjson整体编码，df/fig仍为字符串（默认兼容模式）
+    native    : orjson整体编码，df/fig以JSON结构嵌入（format=native）
+
+用法:
+    python benchmarks/bench_json.py --rows 10 1000 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_json import dumps, embed_json  # noqa: E402
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'day': pd.date_range('2024-01-01', periods=rows, freq='min'),
+        'region': rng.choice(['华东', '华北', '华南', 'West', 'East'], rows),
+        'amount': rng.random(rows) * 1000,
+        'qty': rng.integers(0, 100, rows),
+    })
+
+
+def make_figure_json(df: pd.DataFrame):
+    try:
+        import plotly.express as px
+    except ImportError:
+        return None
+    return px.line(df, x='day', y='amount', color='region').to_json()
+
+
+def timed(fn, repeat: int):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench(rows: int, repeat: int):
+    df = make_frame(rows)
+    fig_json = make_figure_json(df)
+
+    def legacy():
+        payload = {"type": "question_cache", "df": df.to_json(orient='records'), "fig": fig_json}
+        return json.dumps(payload).encode('utf-8')
+
+    def orjson_strings():
+        payload = {"type": "question_cache", "df": df.to_json(orient='records'), "fig": fig_json}
+        return dumps(payload)
+
+    def native():
+        payload = {"type": "question_cache", "df": embed_json(df.to_json(orient='records')),
+                   "fig": embed_json(fig_json) if fig_json is not None else None}
+        return dumps(payload)
+
+    results = []
+    for name, fn in (('jsonify', legacy), ('orjson', orjson_strings), ('native', native)):
+        elapsed, body = timed(fn, repeat)
+        results.append((name, elapsed, len(body)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API响应JSON序列化基准测试')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 100000],
+                        help='DataFrame行数 (默认: 10 1000 100000)')
+    parser.add_argument('--repeat', type=int, default=5, help='每种方式重复次数，取最快一次 (默认: 5)')
+    args = parser.parse_args()
+
+    # pandas新版本对默认的epoch日期格式给出弃用警告，接口仍在使用该格式
+    warnings.filterwarnings('ignore', message=".*'epoch' date format")
+
+    print(f"{'rows':>8} {'encoder':>8} {'encode ms':>10} {'bytes':>12} {'vs jsonify':>10}")
+    for rows in args.rows:
+        results = bench(rows, args.repeat)
+        base = results[0][1]
+        for name, elapsed, size in results:
+            print(f"{rows:>8} {name:>8} {elapsed * 1000:>10.2f} {size:>12} {base / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
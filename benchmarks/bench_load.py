@@ -0,0 +1,311 @@
+# bench_load.py
+"""
+端到端压测
+
+启动模拟LLM/embedding服务（fake_services.py）和应用（Flask线程模式或ASGI模式），
+按目标速率发起会话：generate_sql → run_sql → generate_plotly_figure → generate_followup_questions，
+统计每个接口的 p50/p95/p99 延迟、吞吐量和应用进程的RSS峰值。
+
+数仓和向量库使用本地Postgres（DB_* 和 PGVECTOR_* 环境变量）。首次运行加 --setup，
+在数仓中创建合成表 bench_sales 并写入与模拟LLM对应的训练问答。
+
+用法:
+    python benchmarks/bench_load.py --setup --rows 200000
+    python benchmarks/bench_load.py --server flask --rate 5 --duration 60
+    python benchmarks/bench_load.py --server asgi --rate 20 --duration 60 --json report.json
+    python benchmarks/bench_load.py --url http://127.0.0.1:5000 --pid 12345   # 压测已运行的服务
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BENCH_DIR)
+
+from fake_services import SQL_TEMPLATES, WAREHOUSE_TABLE, serve  # noqa: E402
+
+QUESTIONS = [
+    "各地区的销售额是多少？",
+    "每天的销售额趋势如何？",
+    "销量最高的20个产品是哪些？",
+    "各地区每天的销售额是多少？",
+    "订单金额和数量的关系如何？",
+    "总共有多少订单，平均金额是多少？",
+]
+
+ENDPOINTS = ['generate_sql', 'run_sql', 'generate_plotly_figure', 'generate_followup_questions']
+
+
+def setup_warehouse(rows: int):
+    """在数仓中创建合成销售表"""
+    conn = psycopg2.connect(
+        host=os.environ.get('DB_HOST', '127.0.0.1'),
+        dbname=os.environ.get('DB_NAME', 'works_dw'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', 'postgres'),
+        port=int(os.environ.get('DB_PORT', 5432)),
+    )
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {WAREHOUSE_TABLE}")
+            cur.execute(f"""
+                CREATE TABLE {WAREHOUSE_TABLE} AS
+                SELECT g AS id,
+                       DATE '2023-01-01' + (g % 730) AS day,
+                       (ARRAY['华东', '华北', '华南', '西南', '东北'])[1 + g % 5] AS region,
+                       'P' || lpad((g % 500)::text, 4, '0') AS product,
+                       round((random() * 1000)::numeric, 2) AS amount,
+                       (random() * 20)::int AS qty
+                FROM generate_series(1, %s) AS g
+            """, (rows,))
+            cur.execute(f"ANALYZE {WAREHOUSE_TABLE}")
+    finally:
+        conn.close()
+    print(f"✅ 已创建合成表 {WAREHOUSE_TABLE}（{rows} 行）")
+
+
+def seed_training(base_url: str):
+    """写入训练问答，使检索能返回合成表上的示例SQL"""
+    for question, sql in zip(QUESTIONS, SQL_TEMPLATES):
+        response = httpx.post(f"{base_url}/api/v0/train", json={"question": question, "sql": sql}, timeout=60)
+        response.raise_for_status()
+    print(f"✅ 已写入 {len(QUESTIONS)} 条训练问答")
+
+
+def start_app(server: str, port: int, env: dict) -> subprocess.Popen:
+    if server == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c',
+               f"from app import app; app.run(port={port}, threaded=True, debug=False, use_reloader=False)"]
+    return subprocess.Popen(cmd, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def wait_ready(base_url: str, process: subprocess.Popen = None, timeout: float = 120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"应用进程已退出，返回码 {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/v0/metrics", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("等待应用启动超时")
+
+
+def read_rss_mb(pid: int):
+    """读取进程的常驻内存（MB），仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class Recorder:
+    def __init__(self, pid: int = None):
+        self.pid = pid
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.peak_rss = defaultdict(float)
+
+    def record(self, endpoint: str, elapsed: float, ok: bool):
+        self.latencies[endpoint].append(elapsed)
+        if not ok:
+            self.errors[endpoint] += 1
+        if self.pid is not None:
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.peak_rss[endpoint] = max(self.peak_rss[endpoint], rss)
+
+    def report(self, elapsed: float) -> list:
+        rows = []
+        for endpoint in ENDPOINTS:
+            latencies = self.latencies.get(endpoint, [])
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                "peak_rss_mb": self.peak_rss.get(endpoint),
+            })
+        return rows
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, params: dict):
+    start = time.perf_counter()
+    try:
+        response = await client.get(f"/api/v0/{endpoint}", params=params)
+        payload = response.json()
+        ok = response.status_code == 200 and payload.get('type') != 'error'
+    except Exception:
+        payload, ok = {}, False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    return payload if ok else None
+
+
+async def session(client, recorder, args, rng: random.Random):
+    """一次完整的提问会话，前一步失败时结束"""
+    question = rng.choice(QUESTIONS)
+    if rng.random() >= args.repeat_ratio:
+        # 每个会话的问题文本不同，不命中合并和缓存
+        question = f"{question} #{rng.randrange(1 << 30)}"
+
+    result = await call(client, recorder, 'generate_sql', {"question": question})
+    if result is None:
+        return
+    id = result['id']
+
+    if await call(client, recorder, 'run_sql', {"id": id}) is None:
+        return
+
+    steps = []
+    if rng.random() < args.plot_ratio:
+        steps.append(call(client, recorder, 'generate_plotly_figure', {"id": id}))
+    if rng.random() < args.followup_ratio:
+        steps.append(call(client, recorder, 'generate_followup_questions', {"id": id}))
+    # 前端在拿到结果后同时请求图表和追问问题
+    await asyncio.gather(*steps)
+
+
+async def run_load(base_url: str, recorder: Recorder, args) -> float:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_sessions * 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        slots = asyncio.Semaphore(args.max_sessions)
+        tasks = []
+        dropped = 0
+
+        async def guarded():
+            try:
+                await session(client, recorder, args, rng)
+            finally:
+                slots.release()
+
+        # 开环：按固定速率发起会话，不等待之前的会话完成
+        start = time.perf_counter()
+        interval = 1.0 / args.rate
+        next_at = start
+        while next_at - start < args.duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            next_at += interval
+            if slots.locked():
+                dropped += 1
+                continue
+            await slots.acquire()
+            tasks.append(asyncio.create_task(guarded()))
+
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    if dropped:
+        print(f"⚠️ 并发会话达到上限 {args.max_sessions}，丢弃了 {dropped} 个会话")
+    return elapsed
+
+
+def print_report(rows: list, elapsed: float):
+    print(f"\n耗时 {elapsed:.1f}s")
+    print(f"{'endpoint':<30}{'req':>7}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+    for r in rows:
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] else '-'
+        print(f"{r['endpoint']:<30}{r['requests']:>7}{r['errors']:>6}{r['throughput']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{rss:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测")
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask', help="启动的服务模式")
+    parser.add_argument('--url', help="压测已运行的服务，不启动应用和模拟服务")
+    parser.add_argument('--pid', type=int, help="配合 --url 使用，采集该进程的RSS")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--fake-port', type=int, default=9055)
+    parser.add_argument('--llm-latency-ms', type=float, default=800)
+    parser.add_argument('--embed-latency-ms', type=float, default=20)
+    parser.add_argument('--setup', action='store_true', help="创建合成表并写入训练问答")
+    parser.add_argument('--rows', type=int, default=200000, help="合成表行数")
+    parser.add_argument('--rate', type=float, default=5, help="每秒发起的会话数")
+    parser.add_argument('--duration', type=float, default=60, help="发起会话的时长（秒）")
+    parser.add_argument('--max-sessions', type=int, default=200, help="同时进行的会话上限")
+    parser.add_argument('--repeat-ratio', type=float, default=0.5, help="使用重复问题的会话比例")
+    parser.add_argument('--plot-ratio', type=float, default=1.0)
+    parser.add_argument('--followup-ratio', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="把结果写入该JSON文件")
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        pid = args.pid
+    else:
+        serve(port=args.fake_port, llm_latency_ms=args.llm_latency_ms,
+              embed_latency_ms=args.embed_latency_ms, background=True)
+        fake_url = f"http://127.0.0.1:{args.fake_port}"
+        env = dict(os.environ, OLLAMA_BASE_URL=fake_url, QWEN_BASE_URL=f"{fake_url}/v1",
+                   QWEN_API_KEY=os.environ.get('QWEN_API_KEY', 'fake'))
+        if args.setup:
+            setup_warehouse(args.rows)
+        base_url = f"http://127.0.0.1:{args.port}"
+        process = start_app(args.server, args.port, env)
+        pid = process.pid
+
+    try:
+        wait_ready(base_url, process)
+        if args.setup:
+            seed_training(base_url)
+
+        recorder = Recorder(pid)
+        baseline_rss = read_rss_mb(pid) if pid else None
+        elapsed = asyncio.run(run_load(base_url, recorder, args))
+        rows = recorder.report(elapsed)
+        print_report(rows, elapsed)
+
+        if args.json:
+            report = {
+                "server": 'external' if args.url else args.server,
+                "rate": args.rate,
+                "duration": args.duration,
+                "elapsed": elapsed,
+                "baseline_rss_mb": baseline_rss,
+                "endpoints": rows,
+            }
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"✅ 结果已写入 {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# bench_training.py
+"""
+训练吞吐量基准
+
+生成合成语料（DDL、Markdown文档、问答对，数量和长度可配置），用模拟embedding服务
+（fake_services.py）和本地Postgres跑训练流水线，遍历批大小和线程数的组合，
+统计每种配置的吞吐量（条/秒）、每批生成向量和写入的 p50/p95/p99 延迟，以及进程RSS峰值，
+结果写入JSON文件，便于比较不同提交或配置。
+
+向量库使用 PGVECTOR_* 环境变量，表名默认为 vanna_pgvector_bench，每种配置开始前清空，
+不会影响正式的训练数据。
+
+用法:
+    python benchmarks/bench_training.py --ddl 200 --docs 500 --pairs 2000 \
+        --batch-sizes 10 50 100 --embed-workers 1 2 4 --write-workers 1 2 --output training_bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(BENCH_DIR)
+sys.path.append(ROOT_DIR)
+
+from fake_services import serve  # noqa: E402
+
+WORDS = ["订单", "客户", "产品", "地区", "金额", "数量", "日期", "渠道", "库存", "退款",
+         "order", "customer", "product", "region", "amount", "channel", "stock", "refund"]
+
+COLUMN_TYPES = ["BIGINT", "INTEGER", "NUMERIC(18,2)", "VARCHAR(64)", "TEXT", "DATE", "TIMESTAMP"]
+
+
+def synthetic_corpus(ddl_count: int, doc_count: int, pair_count: int, columns: int,
+                     doc_chars: int, seed: int = 0) -> list:
+    """返回 [(batch_type, item), ...]，同一参数总是生成相同的语料"""
+    rng = random.Random(seed)
+    items = []
+
+    for i in range(ddl_count):
+        cols = ',\n'.join(f"    col_{j}_{rng.choice(WORDS[10:])} {rng.choice(COLUMN_TYPES)}"
+                          for j in range(columns))
+        items.append(('ddl', {'ddl': f"CREATE TABLE bench_table_{i} (\n    id BIGINT PRIMARY KEY,\n{cols}\n);"}))
+
+    for i in range(doc_count):
+        body = []
+        length = 0
+        while length < doc_chars:
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(12)) + '。'
+            body.append(sentence)
+            length += len(sentence)
+        items.append(('documentation', {'documentation': f"## 文档 {i}\n\n" + ''.join(body)[:doc_chars]}))
+
+    for i in range(pair_count):
+        metric, dimension = rng.choice(WORDS[10:]), rng.choice(WORDS[10:])
+        items.append(('question_sql', {
+            'question': f"按{rng.choice(WORDS[:10])}统计第{i}个指标的{rng.choice(WORDS[:10])}",
+            'sql': f"SELECT {dimension}, SUM({metric}) AS total FROM bench_table_{i % max(1, ddl_count)} "
+                   f"GROUP BY {dimension} ORDER BY total DESC",
+        }))
+
+    rng.shuffle(items)
+    return items
+
+
+def read_rss_mb():
+    """读取本进程的常驻内存（MB），仅支持Linux"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """后台线程定期采样RSS，记录峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = read_rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            rss = read_rss_mb()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+
+def run_config(trainer, corpus: list, batch_size: int, embed_workers: int, write_workers: int,
+               queue_size: int) -> dict:
+    """清空基准表后用指定配置写入整个语料，返回该配置的统计"""
+    trainer.vn.reset_table()
+
+    with RssSampler() as sampler:
+        pipeline = trainer.TrainingPipeline(batch_size=batch_size, embed_workers=embed_workers,
+                                            write_workers=write_workers, queue_size=queue_size)
+        for batch_type, item in corpus:
+            pipeline.add_item(batch_type, item)
+        summary = pipeline.shutdown()
+
+    return {
+        "batch_size": batch_size,
+        "embed_workers": embed_workers,
+        "write_workers": write_workers,
+        "items": len(corpus),
+        "written": summary['written'],
+        "failed": summary['failed'],
+        "batches": summary['batches'],
+        "elapsed_seconds": summary['elapsed_seconds'],
+        "items_per_second": summary['items_per_second'],
+        "embed_latency_ms": summary['embed_latency_ms'],
+        "write_latency_ms": summary['write_latency_ms'],
+        "peak_rss_mb": sampler.peak,
+        "errors": summary['errors'][:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练流水线吞吐量基准")
+    parser.add_argument('--ddl', type=int, default=100, help="DDL语句数")
+    parser.add_argument('--columns', type=int, default=20, help="每个DDL的列数")
+    parser.add_argument('--docs', type=int, default=300, help="文档块数")
+    parser.add_argument('--doc-chars', type=int, default=1500, help="每个文档块的字符数")
+    parser.add_argument('--pairs', type=int, default=1000, help="问答对数")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--embed-workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--write-workers', type=int, nargs='+', default=[2])
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--embed-latency-ms', type=float, default=20, help="模拟embedding每次请求的固定耗时")
+    parser.add_argument('--embed-item-latency-ms', type=float, default=2, help="模拟embedding每个文本增加的耗时")
+    parser.add_argument('--fake-port', type=int, default=9100)
+    parser.add_argument('--table', default='vanna_pgvector_bench', help="基准使用的向量表，每种配置开始前清空")
+    parser.add_argument('--output', default='training_bench.json')
+    args = parser.parse_args()
+
+    serve('127.0.0.1', args.fake_port, embed_latency_ms=args.embed_latency_ms,
+          embed_item_latency_ms=args.embed_item_latency_ms, background=True)
+
+    # vanna_pgvector_qwen 在导入时读取配置，必须先设置环境变量
+    os.environ['OLLAMA_BASE_URL'] = f"http://127.0.0.1:{args.fake_port}"
+    os.environ['PGVECTOR_TABLE'] = args.table
+    os.environ['BATCH_PROCESSING_ENABLED'] = 'false'  # 不创建全局流水线，每种配置单独创建
+    os.environ.setdefault('QWEN_API_KEY', 'fake')
+    import vanna_trainer as trainer
+
+    corpus = synthetic_corpus(args.ddl, args.docs, args.pairs, args.columns, args.doc_chars)
+    print(f"🚀 合成语料 {len(corpus)} 条：DDL {args.ddl}，文档 {args.docs}，问答对 {args.pairs}")
+
+    results = []
+    for batch_size in args.batch_sizes:
+        for embed_workers in args.embed_workers:
+            for write_workers in args.write_workers:
+                print(f"⏩ 批大小={batch_size} 向量线程={embed_workers} 写入线程={write_workers}")
+                results.append(run_config(trainer, corpus, batch_size, embed_workers, write_workers,
+                                          args.queue_size))
+
+    report = {
+        "generated_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "corpus": {"ddl": args.ddl, "columns": args.columns, "docs": args.docs,
+                   "doc_chars": args.doc_chars, "pairs": args.pairs, "items": len(corpus)},
+        "fake_embedding": {"latency_ms": args.embed_latency_ms, "item_latency_ms": args.embed_item_latency_ms},
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'batch':>6}{'embed':>7}{'write':>7}{'items/s':>10}{'emb p95':>10}{'ins p95':>10}{'rss MB':>9}{'failed':>8}")
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] is not None else '-'
+        print(f"{r['batch_size']:>6}{r['embed_workers']:>7}{r['write_workers']:>7}{r['items_per_second']:>10.1f}"
+              f"{r['embed_latency_ms']['p95']:>10.1f}{r['write_latency_ms']['p95']:>10.1f}{rss:>9}{r['failed']:>8}")
+    print(f"📄 报告已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# fake_services.py
+"""
+压测用的本地模拟服务，不需要网络和GPU
+
+- Ollama embedding：POST /api/embeddings、/api/embed，按文本哈希生成确定性的1024维向量
+- OpenAI兼容的流式对话：POST /v1/chat/completions，根据prompt返回合成数仓表上的SQL、
+  plotly代码或追问问题
+
+应用通过环境变量指向该服务：
+    OLLAMA_BASE_URL=http://127.0.0.1:9000
+    QWEN_BASE_URL=http://127.0.0.1:9000/v1
+    QWEN_API_KEY=fake
+
+用法:
+    python benchmarks/fake_services.py --port 9000 --llm-latency-ms 800 --embed-latency-ms 20
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIM = 1024
+
+# 合成数仓表，由 bench_load.py --setup 创建
+WAREHOUSE_TABLE = 'bench_sales'
+
+SQL_TEMPLATES = [
+    f"SELECT region, SUM(amount) AS total_amount FROM {WAREHOUSE_TABLE} GROUP BY region ORDER BY total_amount DESC",
+    f"SELECT day, SUM(amount) AS total_amount FROM {WAREHOUSE_TABLE} GROUP BY day ORDER BY day",
+    f"SELECT product, SUM(qty) AS total_qty FROM {WAREHOUSE_TABLE} GROUP BY product ORDER BY total_qty DESC LIMIT 20",
+    f"SELECT day, region, SUM(amount) AS total_amount FROM {WAREHOUSE_TABLE} GROUP BY day, region ORDER BY day",
+    f"SELECT amount, qty FROM {WAREHOUSE_TABLE} LIMIT 20000",
+    f"SELECT COUNT(*) AS orders, AVG(amount) AS avg_amount FROM {WAREHOUSE_TABLE}",
+]
+
+PLOTLY_CODE = """```python
+import plotly.express as px
+
+if len(df.columns) >= 2:
+    fig = px.bar(df, x=df.columns[0], y=df.columns[-1])
+else:
+    fig = px.histogram(df, x=df.columns[0])
+```"""
+
+FOLLOWUP_QUESTIONS = [
+    "各地区的销售额是多少？",
+    "每天的销售额趋势如何？",
+    "销量最高的20个产品是哪些？",
+    "各地区每天的销售额是多少？",
+    "订单金额和数量的关系如何？",
+]
+
+
+def fake_embedding(text: str) -> list:
+    """同一文本总是得到同一个单位向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def fake_completion(messages: list) -> str:
+    """根据prompt的内容判断请求类型，返回对应的回复"""
+    text = '\n'.join(str(m.get('content', '')) for m in messages)
+    last = str(messages[-1].get('content', '')) if messages else ''
+
+    if 'plotly' in text.lower():
+        return PLOTLY_CODE
+    if 'followup' in text.lower() or 'follow-up' in text.lower():
+        return '\n'.join(FOLLOWUP_QUESTIONS)
+
+    index = int.from_bytes(hashlib.sha256(last.encode('utf-8')).digest()[:4], 'little') % len(SQL_TEMPLATES)
+    return SQL_TEMPLATES[index]
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # 由 serve() 设置
+    llm_latency = 0.0
+    embed_latency = 0.0
+    embed_item_latency = 0.0
+    chunk_chars = 16
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path == '/api/embeddings':
+            time.sleep(self.embed_latency + self.embed_item_latency)
+            self.send_json({"embedding": fake_embedding(body.get('prompt', ''))})
+        elif self.path == '/api/embed':
+            inputs = body.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(self.embed_latency + self.embed_item_latency * len(inputs))
+            self.send_json({"model": body.get('model'), "embeddings": [fake_embedding(t) for t in inputs]})
+        elif self.path.endswith('/chat/completions'):
+            self.stream_completion(body)
+        else:
+            self.send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_completion(self, body):
+        content = fake_completion(body.get('messages', []))
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        delay = self.llm_latency / max(1, len(chunks))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        created = int(time.time())
+        for chunk in chunks + [None]:
+            time.sleep(delay if chunk is not None else 0)
+            event = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get('model', 'fake'),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": chunk} if chunk is not None else {},
+                    "finish_reason": None if chunk is not None else "stop",
+                }],
+            }
+            self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(host: str = '127.0.0.1', port: int = 9000, llm_latency_ms: float = 0,
+          embed_latency_ms: float = 0, embed_item_latency_ms: float = 0,
+          background: bool = False) -> ThreadingHTTPServer:
+    """
+    启动模拟服务；background=True 时在后台线程中运行并返回server
+
+    每次embedding请求耗时 embed_latency_ms + embed_item_latency_ms * 文本数
+    """
+    FakeServiceHandler.llm_latency = llm_latency_ms / 1000
+    FakeServiceHandler.embed_latency = embed_latency_ms / 1000
+    FakeServiceHandler.embed_item_latency = embed_item_latency_ms / 1000
+    server = ThreadingHTTPServer((host, port), FakeServiceHandler)
+    server.daemon_threads = True
+
+    if background:
+        threading.Thread(target=server.serve_forever, name='fake-services', daemon=True).start()
+    else:
+        print(f"模拟LLM/embedding服务: http://{host}:{server.server_port}")
+        server.serve_forever()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测用的模拟LLM和embedding服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--llm-latency-ms', type=float, default=800, help="每次对话的总耗时（分摊到各个流式分片）")
+    parser.add_argument('--embed-latency-ms', type=float, default=20, help="每次embedding请求的固定耗时")
+    parser.add_argument('--embed-item-latency-ms', type=float, default=0, help="每个文本增加的耗时")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.llm_latency_ms, args.embed_latency_ms, args.embed_item_latency_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,24 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
 import uuid
+import weakref
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 
 class Cache(ABC):
     @abstractmethod
@@ -14,6 +33,11 @@ class Cache(ABC):
     def get_all(self, field_list) -> list:
         pass
 
+    @abstractmethod
+    def get_question_page(self, limit: int, cursor: Optional[int] = None,
+                          search: Optional[str] = None, prefix: bool = False) -> Tuple[list, Optional[int]]:
+        pass
+
     @abstractmethod
     def set(self, id, field, value):
         pass
@@ -26,15 +50,24 @@ class Cache(ABC):
 class MemoryCache(Cache):
     def __init__(self):
         self.cache = {}
+        # 按插入顺序保存的问题索引：[(id, 小写问题)]，删除的位置置为None
+        self.question_index = []
+        self.question_positions = {}
+        self.question_count = 0
+        self.lock = threading.RLock()
 
     def generate_id(self, *args, **kwargs):
         return str(uuid.uuid4())
 
     def set(self, id, field, value):
-        if id not in self.cache:
-            self.cache[id] = {}
+        with self.lock:
+            if id not in self.cache:
+                self.cache[id] = {}
 
-        self.cache[id][field] = value
+            self.cache[id][field] = value
+
+            if field == 'question' and value is not None:
+                self._index_question(id, value)
 
     def get(self, id, field):
         if id not in self.cache:
@@ -57,6 +90,536 @@ class MemoryCache(Cache):
             for id in self.cache
         ]
 
+    def get_question_page(self, limit: int, cursor: Optional[int] = None,
+                          search: Optional[str] = None, prefix: bool = False) -> Tuple[list, Optional[int]]:
+        """
+        按从新到旧的顺序返回一页问题
+
+        cursor 为上一页返回的 next_cursor，search 按子串（prefix=True 时按前缀）匹配，忽略大小写。
+        不带搜索条件时只访问一页大小的索引项。
+
+        Returns:
+            ([{"id", "question"}], next_cursor)，没有更多数据时 next_cursor 为None
+        """
+        search = search.lower() if search else None
+        page = []
+
+        with self.lock:
+            position = len(self.question_index) if cursor is None else min(cursor, len(self.question_index))
+            while position > 0 and len(page) < limit:
+                position -= 1
+                entry = self.question_index[position]
+                if entry is None:
+                    continue
+                id, text = entry
+                if search is not None:
+                    if prefix and not text.startswith(search):
+                        continue
+                    if not prefix and search not in text:
+                        continue
+                page.append({"id": id, "question": self.cache[id]['question']})
+
+        return page, position if position > 0 else None
+
     def delete(self, id):
-        if id in self.cache:
-            del self.cache[id]
\ No newline at end of file
+        with self.lock:
+            if id in self.cache:
+                del self.cache[id]
+
+            position = self.question_positions.pop(id, None)
+            if position is not None:
+                self.question_index[position] = None
+                self.question_count -= 1
+
+    def _index_question(self, id, question):
+        position = self.question_positions.get(id)
+        if position is None:
+            self.question_positions[id] = len(self.question_index)
+            self.question_index.append((id, question.lower()))
+            self.question_count += 1
+        else:
+            self.question_index[position] = (id, question.lower())
+
+
+# 查询结果的列式压缩存储配置
+RESULT_COMPRESSION = os.environ.get('RESULT_COMPRESSION', 'zstd')
+RESULT_ROW_GROUP_SIZE = int(os.environ.get('RESULT_ROW_GROUP_SIZE', '10000'))
+RESULT_SPILL_BYTES = int(os.environ.get('RESULT_SPILL_BYTES', str(64 * 1024 * 1024)))
+RESULT_SPILL_DIR = os.environ.get('RESULT_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'vanna_results'))
+
+
+class ColumnarFrame:
+    """
+    以压缩Parquet缓冲区保存的查询结果，按需解码所需的列和行。
+
+    压缩后超过 RESULT_SPILL_BYTES 的结果会写入磁盘文件并通过内存映射读取。
+    未安装pyarrow或数据无法转换为Arrow时，退回到直接保存DataFrame。
+    """
+
+    def __init__(self, df: pd.DataFrame, compression: str = RESULT_COMPRESSION,
+                 row_group_size: int = RESULT_ROW_GROUP_SIZE, spill_bytes: int = RESULT_SPILL_BYTES,
+                 spill_dir: str = RESULT_SPILL_DIR):
+        self.num_rows = len(df)
+        self.columns = [str(c) for c in df.columns]
+        self._df = None
+        self._buffer = None
+        self._path = None
+        self._dtypes = None
+
+        if pa is None:
+            self._df = df
+            return
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            pq.write_table(table, sink, compression=compression, row_group_size=max(1, row_group_size))
+            buffer = sink.getvalue()
+        except Exception as e:
+            print(f"[WARNING] 查询结果无法转换为Arrow，按DataFrame缓存: {e}")
+            self._df = df
+            return
+
+        if buffer.size > spill_bytes:
+            os.makedirs(spill_dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(suffix='.parquet', dir=spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(buffer)
+            self._path = path
+            # 对象被回收时删除磁盘文件
+            weakref.finalize(self, _remove_file, path)
+        else:
+            self._buffer = buffer
+
+    @property
+    def nbytes(self) -> int:
+        """缓存占用的字节数（压缩后大小）"""
+        if self._df is not None:
+            return int(self._df.memory_usage(deep=True).sum())
+        if self._path is not None:
+            return os.path.getsize(self._path)
+        return self._buffer.size
+
+    @property
+    def spilled(self) -> bool:
+        return self._path is not None
+
+    @property
+    def columnar(self) -> bool:
+        """是否以Parquet格式保存（False表示退回到了DataFrame）"""
+        return self._df is None
+
+    @property
+    def dtypes(self) -> pd.Series:
+        """只解码schema即可得到的列类型，不读取任何数据"""
+        if self._df is not None:
+            return self._df.dtypes
+        if self._dtypes is None:
+            self._dtypes = self._open().schema_arrow.empty_table().to_pandas().dtypes
+        return self._dtypes
+
+    def __len__(self):
+        return self.num_rows
+
+    def _open(self):
+        if self._path is not None:
+            return pq.ParquetFile(pa.memory_map(self._path, 'r'))
+        return pq.ParquetFile(pa.BufferReader(self._buffer))
+
+    def head(self, n: int = 5, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """只解码前n行"""
+        return self.slice(0, n, columns=columns)
+
+    def slice(self, offset: int, length: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """解码[offset, offset+length)范围内的行，只读取覆盖该范围的row group"""
+        offset = max(0, offset)
+        length = max(0, min(length, self.num_rows - offset))
+
+        if self._df is not None:
+            df = self._df if columns is None else self._df[columns]
+            return df.iloc[offset:offset + length]
+
+        pf = self._open()
+        groups = []
+        group_start = 0
+        first_group_start = None
+        for i in range(pf.metadata.num_row_groups):
+            group_rows = pf.metadata.row_group(i).num_rows
+            group_end = group_start + group_rows
+            if group_end > offset and group_start < offset + length:
+                if first_group_start is None:
+                    first_group_start = group_start
+                groups.append(i)
+            group_start = group_end
+
+        if not groups or length == 0:
+            df = pf.schema_arrow.empty_table().to_pandas()
+            return df if columns is None else df[columns]
+
+        table = pf.read_row_groups(groups, columns=columns)
+        df = table.slice(offset - first_group_start, length).to_pandas()
+        df.index = pd.RangeIndex(offset, offset + len(df))
+        return df
+
+    def iter_batches(self, batch_size: int = RESULT_ROW_GROUP_SIZE,
+                     columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """逐批解码全部行，内存占用与批大小成正比"""
+        if self._df is not None:
+            df = self._df if columns is None else self._df[columns]
+            for start in range(0, self.num_rows, batch_size):
+                yield df.iloc[start:start + batch_size]
+            return
+
+        offset = 0
+        for batch in self._open().iter_batches(batch_size=batch_size, columns=columns):
+            df = batch.to_pandas()
+            df.index = pd.RangeIndex(offset, offset + len(df))
+            offset += len(df)
+            yield df
+
+    def iter_parquet(self, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """逐块返回已压缩的Parquet文件内容，无需重新编码"""
+        if not self.columnar:
+            raise ValueError("结果未以Parquet格式缓存")
+        if self._path is not None:
+            with open(self._path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            return
+        view = memoryview(self._buffer)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+
+    def to_pandas(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """完整解码为DataFrame"""
+        if self._df is not None:
+            return self._df if columns is None else self._df[columns]
+        return self._open().read(columns=columns).to_pandas()
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# 与 training_parsers 一致：$$ 或 $tag$ 开始的美元引号字符串
+_DOLLAR_TAG = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+
+
+def _is_identifier_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _dollar_tag(sql: str, i: int) -> Optional[str]:
+    """i 处是美元引号的开始标记时返回该标记（$1 参数和标识符中的 $ 不是）"""
+    if i > 0 and _is_identifier_char(sql[i - 1]):
+        return None
+    match = _DOLLAR_TAG.match(sql, i)
+    return match.group() if match else None
+
+
+def _quoted_end(sql: str, i: int, escapes: bool) -> int:
+    """从 sql[i] 的引号开始，返回结束引号的位置（没有结束引号时为 len(sql)-1）；escapes 为 E'...' 的反斜杠转义"""
+    quote = sql[i]
+    n = len(sql)
+    j = i + 1
+    while j < n:
+        if escapes and sql[j] == '\\':
+            j += 2
+            continue
+        if sql[j] == quote:
+            if j + 1 < n and sql[j + 1] == quote:
+                j += 2
+                continue
+            return j
+        j += 1
+    return n - 1
+
+
+def normalize_sql(sql: str, literals: bool = True) -> str:
+    """
+    规范化SQL文本，用作结果缓存的键
+
+    去掉注释和末尾分号，合并空白，字符串常量（包括 E'...' 和 $tag$...$tag$）和双引号标识符之外的内容转为小写。
+    literals=False 时字符串常量和双引号标识符替换为空的 '' 和 ""，只保留SQL代码，用于检查关键字。
+    """
+    out = []
+    i = 0
+    n = len(sql)
+    pending_space = False
+
+    def emit(text):
+        nonlocal pending_space
+        if pending_space and out:
+            out.append(' ')
+        pending_space = False
+        out.append(text)
+
+    while i < n:
+        c = sql[i]
+        if c == '-' and sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = n if end == -1 else end
+            pending_space = True
+        elif c == '/' and sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            pending_space = True
+        elif c in ("'", '"'):
+            # 字符串常量和双引号标识符保持原样，''/"" 为转义；E'...' 中反斜杠也是转义
+            escapes = c == "'" and i > 0 and sql[i - 1] in 'eE' and (i < 2 or not _is_identifier_char(sql[i - 2]))
+            j = _quoted_end(sql, i, escapes)
+            emit(sql[i:j + 1] if literals else c + c)
+            i = j + 1
+        elif c == '$' and _dollar_tag(sql, i):
+            # 美元引号字符串（函数体等）保持原样
+            tag = _dollar_tag(sql, i)
+            end = sql.find(tag, i + len(tag))
+            j = n if end == -1 else end + len(tag)
+            emit(sql[i:j] if literals else "''")
+            i = j
+        elif c.isspace():
+            pending_space = True
+            i += 1
+        else:
+            j = i
+            while j < n and not sql[j].isspace() and sql[j] not in ("'", '"') \
+                    and not sql.startswith('--', j) and not sql.startswith('/*', j) \
+                    and not (j > i and sql[j] == '$' and _dollar_tag(sql, j)):
+                j += 1
+            emit(sql[i:j].lower())
+            i = j
+
+    return ''.join(out).rstrip('; ').strip()
+
+
+# 结果依赖执行时刻或会修改数据的SQL不能缓存
+_VOLATILE_SQL = re.compile(
+    r"\b(now|random|clock_timestamp|statement_timestamp|timeofday|gen_random_uuid|nextval|setval|txid_current)\s*\("
+    r"|\b(current_date|current_time|current_timestamp|localtime|localtimestamp)\b"
+    # WITH d AS (DELETE ... RETURNING *) SELECT ... 这样的CTE、SELECT INTO、SELECT ... FOR UPDATE 也会修改数据或加锁
+    r"|\b(insert|update|delete|merge|into)\b"
+    # 多条语句
+    r"|;"
+)
+
+# 只缓存查询语句，DDL、COPY、CALL、DO 等都不缓存
+_QUERY_SQL = re.compile(r"^[(\s]*(select|with|values|table)\b")
+
+# 在SQL中写入 /* no_cache */ 或 -- no_cache 可以显式跳过结果缓存
+_NO_CACHE_HINT = re.compile(r"(/\*|--)\s*no_cache\b", re.IGNORECASE)
+
+
+class SqlResultCache:
+    """
+    SQL查询结果缓存，键为规范化后的SQL加上连接目标
+
+    按LRU淘汰，同时限制条目数和总字节数，条目在TTL后过期。
+    缓存的值是不可变的ColumnarFrame，可以被多个问题id共享。
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 256, max_bytes: int = 512 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def make_key(sql: str, target: str) -> str:
+        return hashlib.sha256(f"{target}\n{normalize_sql(sql)}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_cacheable(sql: str) -> bool:
+        if _NO_CACHE_HINT.search(sql):
+            return False
+        code = normalize_sql(sql, literals=False)
+        return _QUERY_SQL.match(code) is not None and _VOLATILE_SQL.search(code) is None
+
+    def get(self, sql: str, target: str):
+        """返回缓存的值，未命中、已过期或SQL不可缓存时返回None"""
+        if not self.is_cacheable(sql):
+            with self.lock:
+                self.stats['bypassed'] += 1
+            return None
+
+        key = self.make_key(sql, target)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires'] < time.monotonic():
+                self._remove(key)
+                self.stats['expirations'] += 1
+                entry = None
+
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry['value']
+
+    def put(self, sql: str, target: str, value, nbytes: int):
+        """写入缓存，单条超过字节上限或SQL不可缓存时不写入"""
+        if nbytes > self.max_bytes or not self.is_cacheable(sql):
+            return
+
+        key = self.make_key(sql, target)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = {'value': value, 'nbytes': nbytes, 'expires': time.monotonic() + self.ttl}
+            self.nbytes += nbytes
+
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.nbytes -= entry['nbytes']
+
+
+class StaleWhileRevalidateValue:
+    """
+    单个值的缓存，按TTL和版本号判断是否过期
+
+    过期后仍立即返回旧值，同时在后台线程中刷新；只有第一次加载时同步等待。
+    """
+
+    def __init__(self, loader, ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.value = None
+        self.version = None
+        self.expires = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.stats = {'fresh': 0, 'stale': 0, 'loads': 0, 'errors': 0}
+
+    def get(self, version=None):
+        with self.lock:
+            if self.value is not None:
+                if self.version == version and time.monotonic() < self.expires:
+                    self.stats['fresh'] += 1
+                else:
+                    self.stats['stale'] += 1
+                    self._refresh_in_background(version)
+                return self.value
+
+        # 首次加载：多个并发请求只加载一次
+        with self.load_lock:
+            if self.value is None:
+                self._load(version)
+            return self.value
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {**self.stats, 'version': self.version, 'refreshing': self.refreshing}
+
+    def _refresh_in_background(self, version):
+        if self.refreshing:
+            return
+        self.refreshing = True
+
+        def refresh():
+            try:
+                self._load(version)
+            except Exception as e:
+                print(f"[WARNING] 后台刷新缓存失败，继续使用旧值: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _load(self, version):
+        try:
+            value = self.loader()
+        except Exception:
+            with self.lock:
+                self.stats['errors'] += 1
+            raise
+
+        with self.lock:
+            self.value = value
+            self.version = version
+            self.expires = time.monotonic() + self.ttl
+            self.stats['loads'] += 1
+
+
+class PlotlyCodeCache:
+    """
+    已验证的plotly代码缓存，键为规范化SQL和结果列类型（列名+dtype）的指纹
+
+    值为 (代码文本, 编译后的代码对象)，只有成功执行并生成图表的代码才会写入。
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def fingerprint(sql: str, dtypes) -> str:
+        schema = '\n'.join(f"{name}:{dtype}" for name, dtype in dtypes.items())
+        return hashlib.sha256(f"{normalize_sql(sql)}\n{schema}".encode('utf-8')).hexdigest()
+
+    def get(self, sql: str, dtypes):
+        key = self.fingerprint(sql, dtypes)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, sql: str, dtypes, code: str, compiled):
+        key = self.fingerprint(sql, dtypes)
+        with self.lock:
+            self.entries[key] = (code, compiled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, sql: str, dtypes):
+        key = self.fingerprint(sql, dtypes)
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self.entries),
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,353 @@
+# chart_reduction.py
+"""
+绘图前对大结果做降采样/聚合
+
+结果行数超过上限时，根据生成的plotly代码判断图表类型（无法判断时根据列类型推断），
+选择对应的缩减方法：
+    - 折线/时间序列：LTTB (Largest-Triangle-Three-Buckets) 降采样
+    - 散点：按二维网格分箱，每个非空格子保留一个点
+    - 柱状：按代码中引用的维度列聚合 y 列求和，类别仍过多时保留前N个并合并其余为"Other"
+    - 饼图等类别图：按 names 列聚合 values 列，前N个类别 + "Other"
+
+聚合只在代码中能看出数值列（y=/values=）时进行，只对该列求和，其余被引用的列作为分组键保留。
+看不出数值列的柱状/类别图、直方图/箱线图等按行计数的图表，以及无法识别的代码，不做缩减——
+缩减会改变这些图表显示的数量。没有代码时根据列类型推断，其余情况按等间隔抽样。
+"""
+
+import datetime
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+OTHER_LABEL = 'Other'
+
+# 分组序列数超过该值时不再按组分别降采样
+MAX_SERIES = 50
+
+_CHART_PATTERNS = [
+    # 按行计数/统计分布的图表，任何缩减都会改变结果
+    ('distribution', re.compile(r"px\.(histogram|box|violin|strip|ecdf|density_heatmap|density_contour)\b"
+                                r"|go\.(Histogram|Histogram2d|Histogram2dContour|Box|Violin)\b")),
+    ('line', re.compile(r"px\.(line|area)\b|mode\s*=\s*['\"]lines")),
+    ('scatter', re.compile(r"px\.scatter\b|go\.Scatter(gl)?\b")),
+    ('bar', re.compile(r"px\.bar\b|go\.Bar\b")),
+    ('category', re.compile(r"px\.(pie|treemap|sunburst|funnel)\b|go\.(Pie|Funnel)\b")),
+]
+
+
+# 代码中的列参数：x='col'、values="col"、path=['a', 'b']
+_COLUMN_ARG = re.compile(r"\b(\w+)\s*=\s*(\[[^\]]*\]|'[^'\n]*'|\"[^\"\n]*\")")
+_STRING = re.compile(r"'([^'\n]*)'|\"([^\"\n]*)\"")
+_SUBSCRIPT = re.compile(r"df\s*\[\s*(?:'([^'\n]*)'|\"([^\"\n]*)\")\s*\]")
+
+
+def detect_chart_kind(plotly_code: Optional[str], df: pd.DataFrame) -> str:
+    """根据plotly代码判断图表类型；代码无法识别时为 unknown，没有代码时根据列类型推断"""
+    if plotly_code:
+        for kind, pattern in _CHART_PATTERNS:
+            if pattern.search(plotly_code):
+                return kind
+        return 'unknown'
+
+    numeric = _numeric_columns(df)
+    if _time_column(df) is not None and numeric:
+        return 'line'
+    if len(numeric) >= 2:
+        return 'scatter'
+    if numeric and _category_columns(df):
+        return 'bar'
+    return 'sample'
+
+
+def reduce_for_chart(df: pd.DataFrame, plotly_code: Optional[str] = None, max_points: int = 5000,
+                     top_n: int = 20) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    行数超过 max_points 时缩减DataFrame
+
+    Returns:
+        (缩减后的DataFrame, {"original": 原始点数, "rendered": 绘制点数, "method": 使用的方法})
+    """
+    original = len(df)
+    if original <= max_points:
+        return df, {"original": original, "rendered": original, "method": None}
+
+    kind = detect_chart_kind(plotly_code, df)
+    columns = code_columns(plotly_code, df)
+    try:
+        if kind == 'line':
+            reduced, method = _reduce_line(df, max_points, columns)
+        elif kind == 'scatter':
+            reduced, method = _reduce_scatter(df, max_points, columns)
+        elif kind == 'bar':
+            reduced, method = _reduce_bar(df, max_points, top_n, columns, from_code=bool(plotly_code))
+        elif kind == 'category':
+            reduced, method = _reduce_category(df, top_n, columns, from_code=bool(plotly_code))
+        elif kind == 'sample':
+            reduced, method = _sample(df, max_points), 'stride'
+        else:
+            reduced, method = df, None
+    except Exception as e:
+        print(f"[WARNING] 图表数据缩减({kind})失败，不做缩减: {e}")
+        reduced, method = df, None
+
+    if method is None:
+        return df, {"original": original, "rendered": original, "method": None}
+
+    print(f"[INFO] 图表数据缩减: {original} -> {len(reduced)} 点 ({method})")
+    return reduced, {"original": original, "rendered": len(reduced), "method": method}
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    LTTB降采样，返回保留点的下标（升序）
+
+    向量化实现：三角形的第一个顶点取上一个桶的平均点（标准LTTB取上一个桶选中的点，
+    需要逐桶循环），所有桶一次计算完成
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    # 首尾点固定保留，中间 n_out-2 个桶 [starts[i], ends[i])
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    ends = np.maximum(edges[1:], starts + 1)
+    lengths = ends - starts
+
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    mean_x = (sum_x[ends] - sum_x[starts]) / lengths
+    mean_y = (sum_y[ends] - sum_y[starts]) / lengths
+
+    # 每个桶的前一个顶点（上一桶平均点，第一个桶为首点）和后一个顶点（下一桶平均点，最后一个桶为末点）
+    prev_x = np.concatenate(([x[0]], mean_x[:-1]))[:, None]
+    prev_y = np.concatenate(([y[0]], mean_y[:-1]))[:, None]
+    next_x = np.concatenate((mean_x[1:], [x[-1]]))[:, None]
+    next_y = np.concatenate((mean_y[1:], [y[-1]]))[:, None]
+
+    positions = starts[:, None] + np.arange(lengths.max())[None, :]
+    valid = positions < ends[:, None]
+    positions = np.minimum(positions, n - 1)
+    xs = x[positions]
+    ys = y[positions]
+
+    area = np.abs((prev_x - next_x) * (ys - prev_y) - (prev_x - xs) * (next_y - prev_y))
+    area[~valid] = -1
+    chosen = positions[np.arange(len(starts)), np.argmax(area, axis=1)]
+
+    return np.unique(np.concatenate(([0], chosen, [n - 1])))
+
+
+def grid_sample_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """把平面划分为约 max_points 个格子，每个非空格子保留第一个点"""
+    bins = max(1, int(np.sqrt(max_points)))
+    cells = _bin(x, bins) * bins + _bin(y, bins)
+    _, first = np.unique(cells, return_index=True)
+    return np.sort(first)
+
+
+def code_columns(plotly_code: Optional[str], df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    plotly代码中以字符串字面量引用的列：{参数名: [列名...]}，df['col'] 形式的引用记在 'df' 下
+
+    列名来自 df.columns[0] 之类的表达式时无法识别
+    """
+    columns = {}
+    if not plotly_code:
+        return columns
+    names = {str(c) for c in df.columns}
+    for match in _COLUMN_ARG.finditer(plotly_code):
+        found = [a or b for a, b in _STRING.findall(match.group(2))]
+        found = [c for c in found if c in names]
+        if found:
+            columns.setdefault(match.group(1), []).extend(found)
+    found = [a or b for a, b in _SUBSCRIPT.findall(plotly_code)]
+    found = [c for c in found if c in names]
+    if found:
+        columns['df'] = found
+    return columns
+
+
+def _referenced(columns: Dict[str, List[str]]) -> List[str]:
+    """代码引用的所有列（去重，保持顺序）"""
+    return list(dict.fromkeys(c for cols in columns.values() for c in cols))
+
+
+def aggregate(df: pd.DataFrame, keys: List[str], values: List[str]) -> pd.DataFrame:
+    """按 keys 分组，只对 values 求和"""
+    return df.groupby(keys, sort=False, dropna=False)[values].sum().reset_index()[
+        [c for c in df.columns if c in keys or c in values]]
+
+
+def top_n_with_other(df: pd.DataFrame, category: str, value: str, top_n: int) -> pd.DataFrame:
+    """按 value 合计保留前 top_n 个类别，其余合并为 Other（只保留 category 和 value 两列）"""
+    totals = aggregate(df, [category], [value])
+    if len(totals) <= top_n:
+        return totals
+
+    totals = totals.sort_values(value, ascending=False)
+    top = totals.iloc[:top_n]
+    other = pd.DataFrame({category: [OTHER_LABEL], value: [totals.iloc[top_n:][value].sum()]})
+    return pd.concat([top, other], ignore_index=True)[list(totals.columns)]
+
+
+def _value_columns(columns: Dict[str, List[str]], arg: str, df: pd.DataFrame) -> List[str]:
+    numeric = set(_numeric_columns(df))
+    values = columns.get(arg, [])
+    return values if values and all(c in numeric for c in values) else []
+
+
+def _reduce_line(df: pd.DataFrame, max_points: int,
+                 columns: Optional[Dict[str, List[str]]] = None) -> Tuple[pd.DataFrame, str]:
+    columns = columns or {}
+    x_col = (columns.get('x') or [None])[0] or _time_column(df) or df.columns[0]
+    y_cols = [c for c in (columns.get('y') or _numeric_columns(df)) if c != x_col]
+    if not y_cols:
+        return _sample(df, max_points), 'stride'
+
+    df = df.sort_values(x_col, kind='stable')
+    groups = _series_groups(df, exclude=[x_col], color=(columns.get('color') or [None])[0])
+
+    # 每个序列、每个数值列分到的点数
+    budget = max(3, max_points // (len(groups) * len(y_cols)))
+    keep = []
+    for positions in groups:
+        x = _as_float(df[x_col].iloc[positions])
+        if np.isnan(x).all():
+            # x列无法转换为数值时按行序降采样
+            x = np.arange(len(positions), dtype=np.float64)
+        for y_col in y_cols:
+            keep.append(positions[lttb_indices(x, df[y_col].iloc[positions].to_numpy(), budget)])
+
+    return df.iloc[np.unique(np.concatenate(keep))], 'lttb'
+
+
+def _reduce_scatter(df: pd.DataFrame, max_points: int,
+                    columns: Optional[Dict[str, List[str]]] = None) -> Tuple[pd.DataFrame, str]:
+    columns = columns or {}
+    numeric = _numeric_columns(df)
+    x_col = (columns.get('x') or [None])[0]
+    y_col = (columns.get('y') or [None])[0]
+    if x_col is None or y_col is None:
+        if len(numeric) < 2:
+            return _sample(df, max_points), 'stride'
+        x_col, y_col = numeric[0], numeric[1]
+
+    x = _as_float(df[x_col])
+    y = _as_float(df[y_col])
+    return df.iloc[grid_sample_indices(x, y, max_points)], 'grid_binning'
+
+
+def _reduce_bar(df: pd.DataFrame, max_points: int, top_n: int,
+                columns: Optional[Dict[str, List[str]]] = None,
+                from_code: bool = False) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    按代码引用的其他列（x、color、facet等）分组，只对 y 列求和；
+    同一类别的多根柱子在plotly中本来就会叠加，求和后图形不变
+    """
+    columns = columns or {}
+    # orientation='h' 的横向柱状图数值在 x 上
+    values = _value_columns(columns, 'y', df) or _value_columns(columns, 'x', df)
+    if values:
+        keys = [c for c in _referenced(columns) if c not in values]
+    elif not from_code:
+        # 没有代码时按列类型推断：类别列为维度，第一个数值列为值
+        numeric = _numeric_columns(df)
+        keys = _category_columns(df)
+        values = numeric[:1]
+    else:
+        # 看不出 y 列（如 y=df.columns[-1] 或按行计数），聚合会改变柱高
+        return df, None
+    if not values or not keys:
+        return df, None
+
+    aggregated = aggregate(df, keys, values)
+    if len(aggregated) <= max_points:
+        return aggregated, 'aggregate'
+    if len(keys) == 1 and len(values) == 1:
+        return top_n_with_other(aggregated, keys[0], values[0], top_n), 'top_n'
+    return df, None
+
+
+def _reduce_category(df: pd.DataFrame, top_n: int, columns: Optional[Dict[str, List[str]]] = None,
+                     from_code: bool = False) -> Tuple[pd.DataFrame, Optional[str]]:
+    """按 names（或 path 等）列聚合 values 列；没有 values 时饼图按行计数，不缩减"""
+    columns = columns or {}
+    values = _value_columns(columns, 'values', df)
+    if values:
+        keys = [c for c in _referenced(columns) if c not in values]
+    elif not from_code:
+        keys = _category_columns(df)[:1]
+        values = _numeric_columns(df)[:1]
+    else:
+        return df, None
+    if not values or not keys:
+        return df, None
+
+    if len(keys) == 1 and len(values) == 1:
+        return top_n_with_other(df, keys[0], values[0], top_n), 'top_n'
+    return aggregate(df, keys, values), 'aggregate'
+
+
+def _sample(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    step = int(np.ceil(len(df) / max_points))
+    return df.iloc[::step]
+
+
+def _series_groups(df: pd.DataFrame, exclude: List[str], color: Optional[str] = None) -> List[np.ndarray]:
+    """按 color 列（未指定时为第一个类别列）拆分序列（类别过多时视为单一序列），返回每个序列的行位置"""
+    categories = [color] if color is not None else [c for c in _category_columns(df) if c not in exclude]
+    if categories and df[categories[0]].nunique(dropna=False) <= MAX_SERIES:
+        codes = pd.factorize(df[categories[0]], use_na_sentinel=False)[0]
+        return [np.flatnonzero(codes == code) for code in np.unique(codes)]
+    return [np.arange(len(df))]
+
+
+def _numeric_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns
+            if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+
+
+def _category_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns
+            if (pd.api.types.is_object_dtype(df[c]) or pd.api.types.is_string_dtype(df[c])
+                or isinstance(df[c].dtype, pd.CategoricalDtype)) and not _is_time(df[c])]
+
+
+def _time_column(df: pd.DataFrame) -> Optional[str]:
+    for c in df.columns:
+        if _is_time(df[c]):
+            return c
+    return None
+
+
+def _is_time(series: pd.Series) -> bool:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    # psycopg2 把DATE列读成 datetime.date 对象，DataFrame中为object类型
+    if pd.api.types.is_object_dtype(series):
+        first = series.first_valid_index()
+        return first is not None and isinstance(series[first], (datetime.date, datetime.datetime))
+    return False
+
+
+def _as_float(series: pd.Series) -> np.ndarray:
+    if _is_time(series):
+        series = pd.to_datetime(series, errors='coerce')
+        values = series.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+        values[series.isna().to_numpy()] = np.nan
+        return values
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _bin(values: np.ndarray, bins: int) -> np.ndarray:
+    values = np.nan_to_num(values, nan=np.nanmin(values) if np.isfinite(values).any() else 0.0)
+    low, high = values.min(), values.max()
+    if high <= low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / (high - low) * bins).astype(np.int64), bins - 1)
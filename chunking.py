@@ -0,0 +1,195 @@
+# chunking.py
+"""
+长文档切分
+
+超过 DOC_CHUNK_MAX_TOKENS 的文档按小标题、段落、句子切分为多个块，相邻块重叠约
+DOC_CHUNK_OVERLAP_TOKENS 个token，每个块前加上所属章节的标题作为上下文，
+不再在生成向量时把2048个字符之后的内容截掉。
+
+原文作为父行保存（不生成向量），各块通过 parent_id 关联到父行；
+检索命中某个块时返回整篇父文档（见 PgVectorStore.get_related_documentation）。
+
+embedding模型（bge-m3）的分词器不在依赖中，token数按经验估算：
+每个CJK字符算1个，英文单词和数字每4个字符算1个，其余标点符号各算1个。
+"""
+
+import os
+import re
+import uuid
+from typing import Any, Dict, List, Tuple
+
+DOC_CHUNK_MAX_TOKENS = int(os.environ.get('DOC_CHUNK_MAX_TOKENS', '400'))
+DOC_CHUNK_OVERLAP_TOKENS = int(os.environ.get('DOC_CHUNK_OVERLAP_TOKENS', '50'))
+
+# 块的最大字符数，与生成向量时的截断长度一致
+DOC_CHUNK_MAX_CHARS = 2048
+
+# 块所在行的类型；父行仍为 documentation
+DOC_CHUNK_TYPE = 'documentation_chunk'
+
+_TOKEN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+_HEADING = re.compile(r"#{1,6}\s")
+_SENTENCE = re.compile(r".*?(?:[。！？；]|[.!?;](?=\s)|\n|$)\s*", re.DOTALL)
+
+# (文本, token数, 与前一个单元之间的分隔符)
+Unit = Tuple[str, int, str]
+
+
+def _token_cost(token: str) -> int:
+    if token[0].isascii() and (token[0].isalnum() or token[0] == '_'):
+        return (len(token) + 3) // 4
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    return sum(_token_cost(match.group()) for match in _TOKEN.finditer(text))
+
+
+def _split_by_tokens(text: str, max_tokens: int, max_chars: int) -> List[str]:
+    """没有可用的句子边界时，按token数硬切；单个token超过上限时（如很长的英文或base64串）按字符切"""
+    pieces = []
+    start = 0
+    tokens = 0
+    step = max(1, min(max_chars, max_tokens * 4))
+    for match in _TOKEN.finditer(text):
+        cost = _token_cost(match.group())
+        if cost > max_tokens or len(match.group()) > max_chars:
+            if match.start() > start:
+                pieces.append(text[start:match.start()])
+            pieces.extend(text[i:min(i + step, match.end())] for i in range(match.start(), match.end(), step))
+            start = match.end()
+            tokens = 0
+            continue
+        if tokens + cost > max_tokens or match.end() - start > max_chars:
+            if match.start() > start:
+                pieces.append(text[start:match.start()])
+            start = match.start()
+            tokens = 0
+        tokens += cost
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece.strip()]
+
+
+def _units(paragraph: str, max_tokens: int, max_chars: int) -> List[Unit]:
+    """把段落拆成不超过上限的单元：能整段放下就整段，否则按句子，句子仍太长则硬切"""
+    tokens = estimate_tokens(paragraph)
+    if tokens <= max_tokens and len(paragraph) <= max_chars:
+        return [(paragraph, tokens, '\n\n')]
+
+    units = []
+    for sentence in _SENTENCE.findall(paragraph):
+        if not sentence:
+            continue
+        tokens = estimate_tokens(sentence)
+        if tokens <= max_tokens and len(sentence) <= max_chars:
+            units.append((sentence, tokens, ''))
+        else:
+            units.extend((piece, estimate_tokens(piece), '') for piece in _split_by_tokens(sentence, max_tokens, max_chars))
+    if units:
+        units[0] = (units[0][0], units[0][1], '\n\n')
+    return units
+
+
+def _sections(lines: List[str]) -> List[Tuple[str, List[str]]]:
+    """按正文中的小标题分组，返回 [(小标题, [段落...])]；代码块中以 # 开头的行不是标题"""
+    sections = [('', [])]
+    paragraph = []
+    in_fence = False
+
+    def end_paragraph():
+        text = '\n'.join(paragraph).strip()
+        if text:
+            sections[-1][1].append(text)
+        paragraph.clear()
+
+    for line in lines:
+        if line.lstrip().startswith(('```', '~~~')):
+            in_fence = not in_fence
+            paragraph.append(line)
+        elif in_fence:
+            paragraph.append(line)
+        elif _HEADING.match(line):
+            end_paragraph()
+            sections.append((line.strip(), []))
+        elif not line.strip():
+            end_paragraph()
+        else:
+            paragraph.append(line)
+    end_paragraph()
+    return [(heading, paragraphs) for heading, paragraphs in sections if paragraphs]
+
+
+def _pack(units: List[Unit], max_tokens: int, max_chars: int, overlap_tokens: int) -> List[str]:
+    """按顺序把单元装入块，新块开头重复上一块末尾不超过 overlap_tokens 的单元"""
+    chunks = []
+    current: List[Unit] = []
+    tokens = 0
+    chars = 0
+
+    for unit in units:
+        text, unit_tokens, sep = unit
+        if current and (tokens + unit_tokens > max_tokens or chars + len(sep) + len(text) > max_chars):
+            chunks.append(_join(current))
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + previous[1] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous[1]
+            current = overlap
+            tokens = sum(u[1] for u in current)
+            chars = len(_join(current)) if current else 0
+            if current and (tokens + unit_tokens > max_tokens or chars + len(sep) + len(text) > max_chars):
+                current, tokens, chars = [], 0, 0
+
+        current.append(unit)
+        tokens += unit_tokens
+        chars += (len(sep) if len(current) > 1 else 0) + len(text)
+
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def _join(units: List[Unit]) -> str:
+    return ''.join((sep if i else '') + text for i, (text, _, sep) in enumerate(units)).strip()
+
+
+def split_document(text: str, max_tokens: int = DOC_CHUNK_MAX_TOKENS,
+                   overlap_tokens: int = DOC_CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    切分文档，每个块以章节标题（及所在的小标题）开头；不需要切分时返回 [text]
+    """
+    text = text.strip()
+    if estimate_tokens(text) <= max_tokens and len(text) <= DOC_CHUNK_MAX_CHARS:
+        return [text]
+
+    lines = text.split('\n')
+    title = lines[0].strip() if _HEADING.match(lines[0]) else ''
+    body = lines[1:] if title else lines
+
+    chunks = []
+    for heading, paragraphs in _sections(body):
+        context = '\n'.join(line for line in (title, heading) if line)
+        # 为上下文标题预留空间
+        budget_tokens = max(32, max_tokens - estimate_tokens(context))
+        budget_chars = max(128, DOC_CHUNK_MAX_CHARS - len(context) - 2)
+        units = [unit for paragraph in paragraphs for unit in _units(paragraph, budget_tokens, budget_chars)]
+        for chunk in _pack(units, budget_tokens, budget_chars, overlap_tokens):
+            chunks.append(f"{context}\n\n{chunk}" if context else chunk)
+    return chunks or [text]
+
+
+def document_records(doc: str) -> List[Dict[str, Any]]:
+    """
+    把一篇文档转换为要写入的行：短文档为一行；长文档为一个父行（embed=False）加若干块，共用 parent_id
+    """
+    chunks = split_document(doc)
+    if len(chunks) == 1:
+        return [{'type': 'documentation', 'content': doc}]
+
+    parent_id = uuid.uuid4().hex
+    records = [{'type': 'documentation', 'content': doc, 'parent_id': parent_id, 'embed': False}]
+    records.extend({'type': DOC_CHUNK_TYPE, 'content': chunk, 'parent_id': parent_id} for chunk in chunks)
+    return records
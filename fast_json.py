@@ -0,0 +1,70 @@
+# fast_json.py
+"""
+API响应的快速JSON序列化
+
+使用orjson一次性编码整个响应。DataFrame和图表本身已由pandas/plotly编码为JSON文本，
+在 format=native 模式下以 orjson.Fragment 原样嵌入响应，不再作为字符串二次编码，
+前端也不需要再对字符串做一次JSON.parse。默认仍返回字符串，兼容现有前端。
+"""
+
+import datetime
+import decimal
+import json
+from typing import Any
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+_HAS_FRAGMENT = orjson is not None and hasattr(orjson, 'Fragment')
+
+
+def _default(obj: Any):
+    """orjson/json 无法直接处理的类型"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime, datetime.time)):
+        return obj.isoformat()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(payload, default=_default, ensure_ascii=False).encode('utf-8')
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def wants_native() -> bool:
+    """客户端通过 format=native 请求把df/fig作为JSON结构而不是字符串返回"""
+    return request.args.get('format') == 'native'
+
+
+def embed_json(text: str) -> Any:
+    """把已编码的JSON文本嵌入响应，不重新编码"""
+    if _HAS_FRAGMENT:
+        return orjson.Fragment(text)
+    # 旧版本orjson没有Fragment，只能解码后再编码
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def frame_json(df, native: bool = False) -> Any:
+    """DataFrame的响应表示：默认为records格式的JSON字符串，native模式下为JSON数组"""
+    text = df.to_json(orient='records')
+    return embed_json(text) if native else text
+
+
+def figure_json(fig_json: str, native: bool = False) -> Any:
+    """图表的响应表示：默认为JSON字符串，native模式下为JSON对象"""
+    return embed_json(fig_json) if native else fig_json
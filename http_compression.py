@@ -0,0 +1,130 @@
+# http_compression.py
+"""
+HTTP响应压缩
+
+- 静态资源：优先返回预先压缩好的 .br/.gz 文件（由 tools/precompress_static.py 生成），
+  文件名带内容哈希的资源设置长期 immutable 缓存头
+- API响应：超过阈值的JSON等文本响应按 Accept-Encoding 即时压缩
+两者都会累计压缩前后的字节数，供 /api/v0/metrics 查看。
+"""
+
+import gzip
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Flask, Response, request, send_file, send_from_directory
+from werkzeug.utils import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/plain',
+                          'text/csv', 'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+# 构建工具生成的带哈希文件名，如 index-d29524f4.js
+HASHED_ASSET = re.compile(r"-[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Accept-Encoding -> 预压缩文件后缀，按优先级排列
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+
+class CompressionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {
+            'api_responses': 0, 'api_bytes_before': 0, 'api_bytes_after': 0,
+            'static_responses': 0, 'static_bytes_before': 0, 'static_bytes_after': 0,
+        }
+
+    def record(self, kind: str, before: int, after: int):
+        with self.lock:
+            self.stats[f'{kind}_responses'] += 1
+            self.stats[f'{kind}_bytes_before'] += before
+            self.stats[f'{kind}_bytes_after'] += after
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        for kind in ('api', 'static'):
+            before = stats[f'{kind}_bytes_before']
+            stats[f'{kind}_ratio'] = stats[f'{kind}_bytes_after'] / before if before else 1.0
+        return stats
+
+
+compression_stats = CompressionStats()
+
+
+def choose_encoding() -> str:
+    """根据 Accept-Encoding 选择压缩算法，不支持压缩时返回None"""
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+def serve_static_asset(app: Flask, filename: str) -> Response:
+    """发送静态资源，客户端支持时发送预压缩版本"""
+    directory = os.path.join(app.static_folder, 'assets')
+    path = safe_join(directory, filename)
+    accept = request.accept_encodings
+
+    response = None
+    if path is not None:
+        for encoding, suffix in PRECOMPRESSED:
+            if accept[encoding] and os.path.isfile(path + suffix):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_file(path + suffix, mimetype=mimetype, conditional=True)
+                response.headers['Content-Encoding'] = encoding
+                compression_stats.record('static', os.path.getsize(path), os.path.getsize(path + suffix))
+                break
+
+    if response is None:
+        response = send_from_directory(directory, filename)
+
+    response.vary.add('Accept-Encoding')
+    if HASHED_ASSET.search(filename):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    """after_request钩子：即时压缩较大的文本响应"""
+    if not COMPRESS_ENABLED or response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code >= 300:
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    compressed = compress(data, encoding)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Uncompressed-Length'] = str(len(data))
+    compression_stats.record('api', len(data), len(compressed))
+    return response
@@ -0,0 +1,283 @@
+# ingest_queue.py
+"""
+训练数据的异步写入队列
+
+/api/v0/train 把条目写入本地SQLite队列后立即返回作业id，后台工作线程每次取出一批条目，
+一次请求批量生成向量，再用一条INSERT批量写入pgvector。队列保存在磁盘上，
+进程重启后未完成的条目会继续处理。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 条目状态
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+# 作业状态（根据条目状态汇总）
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+PARTIALLY_FAILED = 'partially_failed'
+
+# 单个条目失败时最多尝试的次数（Ollama或数据库暂时不可用时重试）
+MAX_ATTEMPTS = 3
+
+# 作业状态中最多返回的错误数
+MAX_REPORTED_ERRORS = 20
+
+
+class InvalidItem(ValueError):
+    """条目本身无效（缺少字段、类型未知），重试也不会成功"""
+
+
+class IngestQueue:
+    """
+    to_records(item) -> [record, ...]    把请求中的条目转换为要写入的行（type、content，长文档还有 parent_id，
+                                         不生成向量的父行 embed=False），见 chunking.document_records
+    embed_batch(texts) -> vectors        批量生成向量
+    insert_batch(records) -> ids         批量写入并按顺序返回新行的id
+
+    一个条目的所有行在同一批中写入，条目的 row_id 为其第一行（长文档为父行）的id
+
+    to_records 对无效条目抛出 InvalidItem，条目直接标记为失败；其他异常（如调用LLM失败）按写入失败重试。
+    队列文件可由多个进程共享，处理中的条目超过 lease_timeout 秒未更新时视为其进程已退出，重新排队。
+    lease_timeout 应大于处理一批条目所需的时间
+    """
+
+    def __init__(self, path: str, to_records: Callable[[Dict[str, Any]], List[Dict[str, Any]]],
+                 embed_batch: Callable[[List[str]], List[List[float]]],
+                 insert_batch: Callable[[List[Dict[str, Any]]], List[str]],
+                 workers: int = 2, batch_size: int = 32, poll_interval: float = 1.0,
+                 lease_timeout: float = 600.0):
+        self.to_records = to_records
+        self.embed_batch = embed_batch
+        self.insert_batch = insert_batch
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self._init_db()
+
+        self.threads = [threading.Thread(target=self._work, name=f'ingest-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _init_db(self):
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT,
+                    position INTEGER,
+                    payload TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    row_id TEXT,
+                    updated_at REAL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ingest_items_status ON ingest_items (status, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ingest_items_job ON ingest_items (job_id, position)")
+            # 已退出的进程留下的处理中条目重新排队；其他进程仍在处理的条目租约未过期，不受影响
+            recovered = self._reclaim_expired()
+        if recovered:
+            print(f"[INFO] 训练队列恢复了 {recovered} 条未完成的条目")
+
+    def submit(self, items: List[Dict[str, Any]]) -> str:
+        """写入一个作业的所有条目，返回作业id"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT INTO ingest_jobs (id, created_at) VALUES (?, ?)", (job_id, now))
+                self.conn.executemany(
+                    "INSERT INTO ingest_items (job_id, position, payload, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(job_id, i, json.dumps(item, ensure_ascii=False), PENDING, now) for i, item in enumerate(items)],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """返回作业状态，作业不存在时返回None"""
+        with self.lock:
+            job = self.conn.execute("SELECT created_at FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT position, status, error, row_id, updated_at FROM ingest_items WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            ).fetchall()
+
+        counts = {PENDING: 0, PROCESSING: 0, DONE: 0, FAILED: 0}
+        for _, status, _, _, _ in rows:
+            counts[status] += 1
+
+        if counts[PENDING] + counts[PROCESSING] == len(rows) and counts[PROCESSING] == 0:
+            status = QUEUED
+        elif counts[PENDING] or counts[PROCESSING]:
+            status = RUNNING
+        elif counts[FAILED] == 0:
+            status = SUCCEEDED
+        elif counts[DONE] == 0:
+            status = FAILED
+        else:
+            status = PARTIALLY_FAILED
+
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": len(rows),
+            "done": counts[DONE],
+            "failed": counts[FAILED],
+            "pending": counts[PENDING] + counts[PROCESSING],
+            "ids": [row_id for _, _, _, row_id, _ in rows],
+            "errors": [{"position": position, "error": error}
+                       for position, status, error, _, _ in rows if status == FAILED][:MAX_REPORTED_ERRORS],
+            "submitted_at": job[0],
+            "updated_at": max((updated_at for *_, updated_at in rows), default=job[0]),
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM ingest_items GROUP BY status").fetchall()
+        stats = {PENDING: 0, PROCESSING: 0, DONE: 0, FAILED: 0}
+        stats.update(dict(rows))
+        return stats
+
+    def shutdown(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def _work(self):
+        while not self.stopped.is_set():
+            try:
+                batch = self._claim()
+            except Exception as e:
+                print(f"[ERROR] 读取训练队列失败: {e}")
+                batch = []
+
+            if not batch:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            try:
+                self._process(batch)
+            except Exception as e:
+                # _process 内部已处理条目级错误，这里只防止线程退出
+                print(f"[ERROR] 处理训练队列失败: {e}")
+
+    def _claim(self) -> List[Tuple[int, Dict[str, Any], int]]:
+        """取出一批待处理条目并标记为处理中"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                recovered = self._reclaim_expired()
+                if recovered:
+                    print(f"[WARNING] 训练队列回收了 {recovered} 条租约过期的条目")
+                rows = self.conn.execute(
+                    "SELECT id, payload, attempts FROM ingest_items WHERE status = ? ORDER BY id LIMIT ?",
+                    (PENDING, self.batch_size),
+                ).fetchall()
+                self.conn.executemany("UPDATE ingest_items SET status = ?, updated_at = ? WHERE id = ?",
+                                      [(PROCESSING, time.time(), row[0]) for row in rows])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [(item_id, json.loads(payload), attempts) for item_id, payload, attempts in rows]
+
+    def _reclaim_expired(self) -> int:
+        """把租约过期（updated_at 早于 lease_timeout 秒前）的处理中条目重新排队，调用方需持有 self.lock"""
+        return self.conn.execute(
+            "UPDATE ingest_items SET status = ? WHERE status = ? AND updated_at < ?",
+            (PENDING, PROCESSING, time.time() - self.lease_timeout),
+        ).rowcount
+
+    def _process(self, batch: List[Tuple[int, Dict[str, Any], int]]):
+        records = []
+        for item_id, item, attempts in batch:
+            try:
+                records.append((item_id, attempts, self.to_records(item)))
+            except InvalidItem as e:
+                # 条目本身无效，重试也不会成功
+                self._finish(item_id, FAILED, error=str(e))
+            except Exception as e:
+                # 生成问题时LLM暂时不可用等，与写入失败一样重试
+                self._retry_or_fail(item_id, attempts, e)
+
+        if not records:
+            return
+
+        try:
+            self._write(records)
+        except Exception as e:
+            if len(records) == 1:
+                item_id, attempts, _ = records[0]
+                self._retry_or_fail(item_id, attempts, e)
+                return
+            # 整批失败时逐条写入，找出有问题的条目，不影响其他条目
+            print(f"[WARNING] 训练队列批量写入失败，改为逐条写入: {e}")
+            for record in records:
+                try:
+                    self._write([record])
+                except Exception as item_e:
+                    self._retry_or_fail(record[0], record[1], item_e)
+
+    def _write(self, records: List[Tuple[int, int, List[Dict[str, Any]]]]):
+        rows = [row for _, _, item_rows in records for row in item_rows]
+        to_embed = [row for row in rows if row.get('embed', True)]
+        vectors = self.embed_batch([row['content'] for row in to_embed])
+        for row in rows:
+            row['embedding'] = None
+        for row, vector in zip(to_embed, vectors):
+            row['embedding'] = vector
+        row_ids = self.insert_batch(rows)
+
+        offset = 0
+        for item_id, _, item_rows in records:
+            self._finish(item_id, DONE, row_id=row_ids[offset])
+            offset += len(item_rows)
+
+    def _retry_or_fail(self, item_id: int, attempts: int, error: Exception):
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            print(f"[ERROR] 训练条目 {item_id} 写入失败（已尝试 {attempts} 次）: {error}")
+            self._finish(item_id, FAILED, error=str(error), attempts=attempts)
+        else:
+            self._finish(item_id, PENDING, error=str(error), attempts=attempts)
+            # 留出时间让暂时不可用的服务恢复
+            time.sleep(self.poll_interval)
+
+    def _finish(self, item_id: int, status: str, error: str = None, row_id: str = None, attempts: int = None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE ingest_items SET status = ?, error = ?, row_id = ?, "
+                "attempts = COALESCE(?, attempts), updated_at = ? WHERE id = ?",
+                (status, error, row_id, attempts, time.time(), item_id),
+            )
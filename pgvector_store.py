@@ -1,9 +1,16 @@
 import psycopg2
+import psycopg2.extras
+import contextlib
 import os
+import queue
+import threading
+import numpy as np
 import pandas as pd
 from typing import List, Dict, Any, Optional, Union, Tuple
 from vanna.base import VannaBase
 from dotenv import load_dotenv
+from request_control import Overloaded
+from chunking import DOC_CHUNK_TYPE, document_records
 
 # 加载环境变量
 load_dotenv()
@@ -12,25 +19,102 @@ load_dotenv()
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 VERBOSE = LOG_LEVEL.upper() in ['DEBUG', 'TRACE']
 
+# 生成SQL时检索的相关文档数，0表示不检索文档（与之前的行为相同）
+RELATED_DOCUMENTATION_LIMIT = int(os.environ.get('RELATED_DOCUMENTATION_LIMIT', '0'))
+
+# 返回给LLM的相似问答对数
+SIMILAR_QUESTION_SQL_LIMIT = 5
+# MMR重排：在最相似的 SIMILAR_SQL_MMR_CANDIDATES 个候选中兼顾相关性和多样性，
+# 避免返回多条几乎相同的示例。lambda越大越偏向相关性，0表示不重排
+SIMILAR_SQL_MMR_LAMBDA = float(os.environ.get('SIMILAR_SQL_MMR_LAMBDA', '0'))
+SIMILAR_SQL_MMR_CANDIDATES = int(os.environ.get('SIMILAR_SQL_MMR_CANDIDATES', '20'))
+
+# 检索查询的连接池大小。请求线程和 asyncio.to_thread 的工作线程各自从池中取连接，
+# 不共用 self.conn：一个线程出错后的 rollback 会中断另一个线程在同一连接上正在执行的查询
+PGVECTOR_READ_POOL_SIZE = int(os.environ.get('PGVECTOR_READ_POOL_SIZE', '8'))
+
+
+def _parse_vector(text: str) -> np.ndarray:
+    """pgvector的文本格式 '[0.1,0.2,...]' 转为数组"""
+    return np.array(text.strip('[]').split(','), dtype=np.float32)
+
+
+def _mmr(query: np.ndarray, candidates: np.ndarray, k: int, lambda_: float) -> List[int]:
+    """最大边际相关性：依次选出与问题相关、又与已选结果不重复的候选，返回候选的下标"""
+    def normalize(x):
+        norms = np.linalg.norm(x, axis=-1, keepdims=True)
+        return x / np.where(norms == 0, 1, norms)
+
+    candidates = normalize(candidates)
+    relevance = candidates @ normalize(query)
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(candidates)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
 
 class PgVectorStore(VannaBase):
     def __init__(self, config=None):
         super().__init__(config=config)
 
-        self.conn = psycopg2.connect(
-            host=config['pgvector_host'],
-            port=config['pgvector_port'],
-            database=config['pgvector_db'],
-            user=config['pgvector_user'],
-            password=config['pgvector_password']
-        )
-        # 设置自动提交为False，手动控制事务
-        self.conn.autocommit = False
+        self.pg_config = config
+        self.conn = self.new_connection()
+        # 检索用的连接池，见 read_connection
+        self._read_pool = queue.LifoQueue()
+        self._read_slots = threading.BoundedSemaphore(max(1, PGVECTOR_READ_POOL_SIZE))
 
         self.table_name = config.get("pgvector_table", "vanna_pgvector")
+        # 训练检查点：记录每个源文件（按内容哈希）中已写入的块，与数据行在同一事务中提交
+        self.manifest_table = f"{self.table_name}_manifest"
+
+        # 训练数据版本号，每次写入或删除训练数据后递增，供依赖训练数据的缓存判断是否过期
+        self.training_version = 0
 
         self._init_table()
 
+    def new_connection(self):
+        """创建到向量库的新连接（后台写入线程使用独立连接，不与请求共用事务）"""
+        conn = psycopg2.connect(
+            host=self.pg_config['pgvector_host'],
+            port=self.pg_config['pgvector_port'],
+            database=self.pg_config['pgvector_db'],
+            user=self.pg_config['pgvector_user'],
+            password=self.pg_config['pgvector_password']
+        )
+        # 设置自动提交为False，手动控制事务
+        conn.autocommit = False
+        return conn
+
+    @contextlib.contextmanager
+    def read_connection(self):
+        """
+        从检索连接池取一个连接，用完提交（结束只读事务）后归还；
+        池中连接都在使用时等待，出错时只回滚这个连接，已断开的连接丢弃
+        """
+        with self._read_slots:
+            try:
+                conn = self._read_pool.get_nowait()
+            except queue.Empty:
+                conn = self.new_connection()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        conn.close()
+                raise
+            finally:
+                if not conn.closed:
+                    self._read_pool.put(conn)
+
     def reset_table(self):
         """
         删除并重新创建向量表
@@ -39,6 +123,8 @@ class PgVectorStore(VannaBase):
             with self.conn.cursor() as cur:
                 # 首先尝试删除表（如果存在）
                 cur.execute(f"DROP TABLE IF EXISTS {self.table_name}")
+                # 数据已清空，检查点也随之失效
+                cur.execute(f"DROP TABLE IF EXISTS {self.manifest_table}")
                 self.conn.commit()
                 print(f"表 {self.table_name} 已删除")
                 
@@ -65,6 +151,19 @@ class PgVectorStore(VannaBase):
                         embedding VECTOR(1024)
                     )
                 """)
+                # 长文档切分后，父行（原文，不生成向量）和各块通过 parent_id 关联，见 chunking.py
+                cur.execute(f"ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS parent_id TEXT")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_parent_id ON {self.table_name} (parent_id)")
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.manifest_table} (
+                        file_hash TEXT,
+                        block_index INTEGER,
+                        source TEXT,
+                        status TEXT,
+                        updated_at TIMESTAMPTZ DEFAULT now(),
+                        PRIMARY KEY (file_hash, block_index)
+                    )
+                """)
                 self.conn.commit()
         except Exception as e:
             self.conn.rollback()
@@ -101,6 +200,7 @@ class PgVectorStore(VannaBase):
                     if VERBOSE:
                         print("SQL插入执行成功，准备提交...")
                     self.conn.commit()
+                    self.training_version += 1
                     if VERBOSE:
                         print("事务提交成功")
                 except Exception as e:
@@ -151,6 +251,7 @@ class PgVectorStore(VannaBase):
                 # 执行批量插入
                 cur.execute(query, params)
                 self.conn.commit()
+                self.training_version += 1
                 
                 print(f"[INFO] 成功批量插入 {len(items)} 条数据")
                 return True
@@ -173,11 +274,90 @@ class PgVectorStore(VannaBase):
             print(f"[INFO] 逐条插入完成, 成功: {success_count}/{len(items)}")
             return success_count > 0
 
+    def _bulk_insert(self, items: List[Dict[str, Any]], conn=None,
+                     checkpoints: Optional[List[Tuple[str, int, str]]] = None) -> List[str]:
+        """
+        用一条INSERT批量写入已生成向量的条目，并按输入顺序返回新行的id
+
+        Args:
+            items: 包含type、content和embedding（父行为None）的项目列表，可带 parent_id
+            conn: 使用的连接，默认为共用连接
+            checkpoints: 随这些行一起完成的 (文件哈希, 块序号, 来源) 检查点，在同一事务中写入
+
+        失败时回滚并抛出异常，由调用方决定是否逐条重试
+        """
+        if not items:
+            return []
+
+        conn = conn or self.conn
+        try:
+            with conn.cursor() as cur:
+                rows = psycopg2.extras.execute_values(
+                    cur,
+                    f"INSERT INTO {self.table_name} (type, content, embedding, parent_id) VALUES %s RETURNING id",
+                    [(item['type'], item['content'], item['embedding'], item.get('parent_id')) for item in items],
+                    page_size=len(items),
+                    fetch=True,
+                )
+                if checkpoints:
+                    self._record_checkpoints(cur, checkpoints)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        self.training_version += 1
+        print(f"[INFO] 成功批量插入 {len(items)} 条数据")
+        return [str(row[0]) for row in rows]
+
+    def _record_checkpoints(self, cur, checkpoints: List[Tuple[str, int, str]]):
+        psycopg2.extras.execute_values(
+            cur,
+            f"""
+                INSERT INTO {self.manifest_table} (file_hash, block_index, source, status) VALUES %s
+                ON CONFLICT (file_hash, block_index) DO UPDATE SET status = EXCLUDED.status, updated_at = now()
+            """,
+            [(file_hash, block_index, source, 'done') for file_hash, block_index, source in checkpoints],
+        )
+
+    def record_checkpoints(self, checkpoints: List[Tuple[str, int, str]]):
+        """单独记录检查点（用于逐条 vn.train 的写入方式，行已由 train 提交）"""
+        try:
+            with self.conn.cursor() as cur:
+                self._record_checkpoints(cur, checkpoints)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def get_completed_blocks(self, file_hash: str) -> set:
+        """返回该文件（按检查点键，见 training_parsers.checkpoint_key）中已写入的块序号"""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT block_index FROM {self.manifest_table} WHERE file_hash = %s AND status = 'done'",
+                    (file_hash,),
+                )
+                rows = cur.fetchall()
+            self.conn.commit()
+            return {row[0] for row in rows}
+        except Exception:
+            self.conn.rollback()
+            raise
+
     def add_ddl(self, ddl: str, **kwargs) -> str:
         return self._insert("ddl", ddl)
 
     def add_documentation(self, doc: str, **kwargs) -> str:
-        return self._insert("documentation", doc)
+        records = document_records(doc)
+        if len(records) == 1:
+            return self._insert("documentation", doc)
+
+        # 长文档：父行和各块在同一事务中写入，返回父行的id
+        for record in records:
+            record['embedding'] = self._embed(record['content']) if record.get('embed', True) else None
+        print(f"[INFO] 文档长度 {len(doc)} 字符，切分为 {len(records) - 1} 块")
+        return self._bulk_insert(records)[0]
 
     def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
         return self._insert("question_sql", f"{question} :: {sql}")
@@ -254,7 +434,10 @@ class PgVectorStore(VannaBase):
 
     def get_similar_question_sql(self, question: str, **kwargs) -> list:
         try:
-            embedding = self._embed(question)
+            # 批量接口会预先批量生成问题的向量，通过 embedding 参数传入
+            embedding = kwargs.get('embedding')
+            if embedding is None:
+                embedding = self._embed(question)
             
             # 调试信息
             if VERBOSE:
@@ -263,55 +446,133 @@ class PgVectorStore(VannaBase):
             else:
                 print(f"[INFO] 查询相似问题 (文本长度: {len(question)})")
             
-            with self.conn.cursor() as cur:
-                # 修改查询语法，使用正确的向量类型转换
-                # 尝试将Python列表转换为PG向量格式
-                embedding_str = f"[{','.join(str(x) for x in embedding)}]"
-                query = f"""
-                    SELECT content FROM {self.table_name}
-                    WHERE type = 'question_sql'
-                    ORDER BY embedding <-> '{embedding_str}'::vector LIMIT 5
-                """
-                if VERBOSE:
-                    print(f"执行查询: {query[:100]}...")
-                cur.execute(query)
-                rows = cur.fetchall()
-            
-            # 将结果格式化为Vanna需要的格式
-            results = []
-            for row in rows:
-                content = row[0]
-                # 检查是否包含分隔符"::"
-                if "::" in content:
-                    question, sql = content.split("::", 1)
-                    results.append({"question": question.strip(), "sql": sql.strip()})
-                else:
-                    # 如果没有分隔符，整个内容当作SQL
-                    results.append({"question": "", "sql": content.strip()})
-            
-            return results
+            return self._query_similar_question_sql(embedding)
+        except Overloaded:
+            # embedding服务繁忙，原样抛出以便接口返回429/503
+            raise
         except Exception as e:
-            self.conn.rollback()
             print(f"[ERROR] 查询相似问题失败: {str(e)}")
             raise Exception(f"查询相似问题失败: {e}")
 
+    def _query_similar_question_sql(self, embedding: List[float]) -> list:
+        """按向量距离查询最相似的问答对（使用检索连接池，可在多个线程中同时调用）"""
+        with self.read_connection() as conn, conn.cursor() as cur:
+            # 修改查询语法，使用正确的向量类型转换
+            # 尝试将Python列表转换为PG向量格式
+            embedding_str = f"[{','.join(str(x) for x in embedding)}]"
+            mmr = 0 < SIMILAR_SQL_MMR_LAMBDA < 1
+            query = f"""
+                SELECT content{', embedding::text' if mmr else ''} FROM {self.table_name}
+                WHERE type = 'question_sql'
+                ORDER BY embedding <-> '{embedding_str}'::vector
+                LIMIT {max(SIMILAR_SQL_MMR_CANDIDATES, SIMILAR_QUESTION_SQL_LIMIT) if mmr else SIMILAR_QUESTION_SQL_LIMIT}
+            """
+            if VERBOSE:
+                print(f"执行查询: {query[:100]}...")
+            cur.execute(query)
+            rows = cur.fetchall()
+
+        if mmr and rows:
+            vectors = np.stack([_parse_vector(row[1]) for row in rows])
+            picked = _mmr(np.asarray(embedding, dtype=np.float32), vectors,
+                          SIMILAR_QUESTION_SQL_LIMIT, SIMILAR_SQL_MMR_LAMBDA)
+            rows = [rows[i] for i in picked]
+        
+        # 将结果格式化为Vanna需要的格式
+        results = []
+        for row in rows:
+            content = row[0]
+            # 检查是否包含分隔符"::"
+            if "::" in content:
+                question, sql = content.split("::", 1)
+                results.append({"question": question.strip(), "sql": sql.strip()})
+            else:
+                # 如果没有分隔符，整个内容当作SQL
+                results.append({"question": "", "sql": content.strip()})
+        
+        return results
+
     def get_related_ddl(self, question: str, **kwargs) -> list:
         return []
 
     def get_related_documentation(self, question: str, **kwargs) -> list:
-        return []
+        if RELATED_DOCUMENTATION_LIMIT <= 0:
+            return []
+        try:
+            embedding = kwargs.get('embedding')
+            if embedding is None:
+                embedding = self._embed(question)
+            return self._query_related_documentation(embedding, RELATED_DOCUMENTATION_LIMIT)
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] 查询相关文档失败: {str(e)}")
+            raise Exception(f"查询相关文档失败: {e}")
+
+    def _query_related_documentation(self, embedding: List[float], limit: int) -> list:
+        """
+        按向量距离查询相关文档；命中长文档的块时返回整篇父文档，同一文档只返回一次
+        """
+        embedding_str = f"[{','.join(str(x) for x in embedding)}]"
+        with self.read_connection() as conn, conn.cursor() as cur:
+            # 同一文档的多个块可能同时命中，多取一些候选再按父文档去重
+            cur.execute(
+                f"""
+                    SELECT type, content, parent_id FROM {self.table_name}
+                    WHERE type IN ('documentation', %s) AND embedding IS NOT NULL
+                    ORDER BY embedding <-> %s::vector LIMIT %s
+                """,
+                (DOC_CHUNK_TYPE, embedding_str, limit * 4),
+            )
+            rows = cur.fetchall()
+
+            hits = []
+            seen = set()
+            for data_type, content, parent_id in rows:
+                key = parent_id if data_type == DOC_CHUNK_TYPE else content
+                if key in seen:
+                    continue
+                seen.add(key)
+                hits.append((data_type, content, parent_id))
+                if len(hits) >= limit:
+                    break
+
+            parent_ids = [parent_id for data_type, _, parent_id in hits if data_type == DOC_CHUNK_TYPE]
+            parents = {}
+            if parent_ids:
+                cur.execute(
+                    f"SELECT parent_id, content FROM {self.table_name} "
+                    f"WHERE type = 'documentation' AND parent_id = ANY(%s)",
+                    (parent_ids,),
+                )
+                parents = dict(cur.fetchall())
+
+        # 父行缺失（例如被单独删除）时退回到块本身的内容
+        return [parents.get(parent_id, content) if data_type == DOC_CHUNK_TYPE else content
+                for data_type, content, parent_id in hits]
 
     def get_training_data(self, **kwargs) -> pd.DataFrame:
         try:
-            return pd.read_sql(f"SELECT * FROM {self.table_name}", self.conn)
+            # 文档的块由父行代表，不单独列出
+            return pd.read_sql(f"SELECT * FROM {self.table_name} WHERE type <> '{DOC_CHUNK_TYPE}'", self.conn)
         except Exception as e:
             raise Exception(f"获取训练数据失败: {e}")
 
     def remove_training_data(self, id: str, **kwargs) -> bool:
         try:
             with self.conn.cursor() as cur:
-                cur.execute(f"DELETE FROM {self.table_name} WHERE id = %s", (id,))
+                # 删除长文档的父行时一并删除它的块
+                cur.execute(
+                    f"""
+                        DELETE FROM {self.table_name} WHERE id = %s OR parent_id IN (
+                            SELECT parent_id FROM {self.table_name}
+                            WHERE id = %s AND type = 'documentation' AND parent_id IS NOT NULL
+                        )
+                    """,
+                    (id, id),
+                )
                 self.conn.commit()
+                self.training_version += 1
             return True
         except Exception as e:
             self.conn.rollback()
@@ -0,0 +1,80 @@
+# precompute.py
+"""
+查询结果就绪后在后台预先计算图表和追问问题
+
+计算结果写入问题缓存；接口调用时如果计算仍在进行，则等待对应的future。
+"""
+
+import concurrent.futures
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cache import Cache
+
+
+class Precomputer:
+    def __init__(self, cache: Cache, max_workers: int = 4, wait_timeout: float = 120):
+        self.cache = cache
+        self.wait_timeout = wait_timeout
+        self.futures: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='precompute')
+        self.stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'waited': 0}
+
+    def submit(self, id: str, field: str, fn: Callable[..., Any], *args, **kwargs):
+        """在后台计算 fn(*args, **kwargs)，成功后写入 cache[id][field]"""
+        future = self.executor.submit(fn, *args, **kwargs)
+        key = (id, field)
+        with self.lock:
+            # 旧结果基于之前的查询结果，先清除；与登记future在同一临界区内，被取代的旧计算不会再写入
+            self.cache.set(id=id, field=field, value=None)
+            self.futures[key] = future
+            self.stats['submitted'] += 1
+
+        def done(f: concurrent.futures.Future):
+            with self.lock:
+                # 同一字段可能已被更新的计算取代
+                if self.futures.get(key) is not f:
+                    return
+                # 先写缓存再移除future：wait 在两者之间不会既查不到缓存又找不到future
+                if f.exception() is None:
+                    self.cache.set(id=id, field=field, value=f.result())
+                    self.stats['succeeded'] += 1
+                else:
+                    self.stats['failed'] += 1
+                del self.futures[key]
+
+            if f.exception() is not None:
+                print(f"[WARNING] 后台预计算 {field} 失败: {f.exception()}")
+
+        future.add_done_callback(done)
+
+    def wait(self, id: str, field: str) -> Optional[Any]:
+        """
+        返回字段的值：已缓存则直接返回，正在计算则等待完成。
+        没有对应的计算或计算失败时返回None，由调用方自行计算。
+        """
+        with self.lock:
+            future = self.futures.get((id, field))
+            if future is None:
+                # 没有进行中的计算；已完成的计算在移除future之前已写入缓存
+                return self.cache.get(id=id, field=field)
+            self.stats['waited'] += 1
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            print(f"[WARNING] 等待预计算 {field} 失败: {e}")
+            return None
+
+    def pending(self, id: str, field: str) -> Optional[concurrent.futures.Future]:
+        """返回字段正在进行的计算，供异步服务模式用 asyncio.wrap_future 等待"""
+        with self.lock:
+            future = self.futures.get((id, field))
+            if future is not None:
+                self.stats['waited'] += 1
+            return future
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.stats, 'in_flight': len(self.futures)}
@@ -0,0 +1,277 @@
+# request_control.py
+"""
+请求控制
+
+SingleFlight：相同键的并发请求合并为一次计算。第一个请求（leader）执行计算，
+计算期间到达的相同请求等待并共享其结果（或异常），计算结束后不保留结果——
+结果缓存由各自的缓存负责，这里只消除同时进行的重复工作。
+
+AdmissionLimit：准入控制。限制同时执行的请求数，超出的请求在有界队列中等待，
+队列已满立即拒绝（429），等待超过期限也拒绝（503），两者都带 Retry-After，
+过载时快速失败，而不是让所有请求一起排队直到超时。
+同步请求在 threading.Condition 上等待；异步请求在各自事件循环的 Future 上等待，
+release 时把名额直接交给等待者，排队的异步请求不占用线程。
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable
+
+
+def normalize_question(question: str) -> str:
+    """合并空白并忽略大小写，用作问题的合并键"""
+    return ' '.join(question.split()).casefold()
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls: Dict[Hashable, concurrent.futures.Future] = {}
+        self.async_calls: Dict[Hashable, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.stats = {'executed': 0, 'coalesced': 0, 'failed': 0}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行 fn(*args, **kwargs)；相同key的计算正在进行时等待其结果"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self.calls[key] = future
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(self.calls, key, failed=True)
+            future.set_exception(e)
+            raise
+        self._finish(self.calls, key)
+        future.set_result(result)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        do 的异步版本，在同一事件循环内合并
+
+        共享的计算在单独的任务中执行，所有请求（包括leader）都通过 shield 等待它，
+        任何一个请求被取消（客户端断开）都不会取消其他请求；所有请求都取消后才取消计算。
+        """
+        with self.lock:
+            call = self.async_calls.get(key)
+            if call is None:
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                call = self.async_calls[key] = {'task': task, 'waiters': 0}
+                task.add_done_callback(lambda done: self._finish_async(key, call))
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+            call['waiters'] += 1
+
+        try:
+            return await asyncio.shield(call['task'])
+        except asyncio.CancelledError:
+            with self.lock:
+                call['waiters'] -= 1
+                abandoned = call['waiters'] == 0 and not call['task'].done()
+                if abandoned and self.async_calls.get(key) is call:
+                    # 之后到达的相同请求重新计算，而不是等待已取消的任务
+                    del self.async_calls[key]
+            if abandoned:
+                call['task'].cancel()
+            raise
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {**self.stats, 'in_flight': len(self.calls) + len(self.async_calls)}
+
+    def _finish(self, calls: dict, key: Hashable, failed: bool = False):
+        with self.lock:
+            del calls[key]
+            if failed:
+                self.stats['failed'] += 1
+
+    def _finish_async(self, key: Hashable, call: dict):
+        task = call['task']
+        # 读取异常，避免没有等待者时出现 "exception was never retrieved" 警告
+        failed = task.cancelled() or task.exception() is not None
+        with self.lock:
+            if self.async_calls.get(key) is call:
+                del self.async_calls[key]
+            if failed:
+                self.stats['failed'] += 1
+
+
+class Overloaded(Exception):
+    """请求未被准入，status 为建议返回的HTTP状态码"""
+
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionLimit:
+    def __init__(self, name: str, max_concurrent: int, max_waiting: int = 64, wait_timeout: float = 10):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        # 单个请求占用时长的指数移动平均，用于估算 Retry-After
+        self.avg_hold = 1.0
+        self.condition = threading.Condition()
+        # 排队中的异步请求；release 时直接把名额交给队首（active 不变）
+        self.async_waiters: Deque[asyncio.Future] = collections.deque()
+        # 同步和异步请求都在排队时轮流放行，避免一方饿死
+        self.prefer_async = False
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    def try_acquire(self) -> bool:
+        with self.condition:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                self.stats['admitted'] += 1
+                return True
+            return False
+
+    def _admit_or_queue(self) -> bool:
+        """持有锁时调用：有空闲名额时占用并返回True；队列已满时抛出 Overloaded；否则计入排队"""
+        if self.active < self.max_concurrent:
+            self.active += 1
+            self.stats['admitted'] += 1
+            return True
+
+        if self.waiting >= self.max_waiting:
+            self.stats['rejected'] += 1
+            raise Overloaded(f"{self.name} is overloaded, please retry later", 429, self.retry_after())
+
+        self.waiting += 1
+        self.stats['queued'] += 1
+        return False
+
+    def _timed_out(self) -> Overloaded:
+        self.stats['timed_out'] += 1
+        return Overloaded(f"{self.name} is busy, please retry later", 503, self.retry_after())
+
+    def acquire(self):
+        """获取执行名额，队列已满或等待超时时抛出 Overloaded"""
+        with self.condition:
+            if self._admit_or_queue():
+                return
+
+            try:
+                admitted = self.condition.wait_for(lambda: self.active < self.max_concurrent,
+                                                   timeout=self.wait_timeout)
+            finally:
+                self.waiting -= 1
+
+            if not admitted:
+                raise self._timed_out()
+            self.active += 1
+            self.stats['admitted'] += 1
+
+    async def aacquire(self):
+        """acquire 的异步版本，在事件循环中等待，不占用线程"""
+        with self.condition:
+            if self._admit_or_queue():
+                return
+            future = asyncio.get_running_loop().create_future()
+            self.async_waiters.append(future)
+
+        try:
+            # shield：超时或取消时不取消 future，由下面判断名额是否已经交过来
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.wait_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self.condition:
+                queued = future in self.async_waiters
+                if queued:
+                    self.async_waiters.remove(future)
+                    self.waiting -= 1
+            if not queued:
+                # 名额已经交给本请求，future 完成后立即归还
+                future.add_done_callback(lambda f: self.release())
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            with self.condition:
+                raise self._timed_out() from None
+        with self.condition:
+            self.stats['admitted'] += 1
+
+    def release(self, held: float = None):
+        with self.condition:
+            if held is not None:
+                self.avg_hold = 0.8 * self.avg_hold + 0.2 * held
+
+            sync_waiting = self.waiting - len(self.async_waiters)
+            if self.async_waiters and (sync_waiting <= 0 or self.prefer_async):
+                self.prefer_async = False
+                while self.async_waiters:
+                    future = self.async_waiters.popleft()
+                    self.waiting -= 1
+                    try:
+                        future.get_loop().call_soon_threadsafe(_grant, future)
+                        return
+                    except RuntimeError:
+                        # 事件循环已关闭，等待者不会再醒来
+                        continue
+
+            self.prefer_async = True
+            self.active -= 1
+            self.condition.notify()
+
+    def retry_after(self) -> int:
+        """按平均占用时长估算排在队尾的请求多久后能执行（秒）"""
+        return max(1, math.ceil(self.avg_hold * (self.waiting + 1) / self.max_concurrent))
+
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        """slot 的异步版本"""
+        await self.aacquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.condition:
+            return {**self.stats, 'active': self.active, 'waiting': self.waiting,
+                    'max_concurrent': self.max_concurrent, 'max_waiting': self.max_waiting}
+
+
+def _grant(future: asyncio.Future):
+    """在等待者的事件循环中把名额交给它"""
+    if not future.done():
+        future.set_result(None)
+
+
+def backend_slot(limits: Dict[str, AdmissionLimit], backend: str):
+    """获取后端（llm、embedding、warehouse）的执行名额，没有配置限制时不做任何事"""
+    limit = limits.get(backend)
+    return limit.slot() if limit is not None else contextlib.nullcontext()
+
+
+def abackend_slot(limits: Dict[str, AdmissionLimit], backend: str):
+    limit = limits.get(backend)
+    return limit.aslot() if limit is not None else contextlib.nullcontext()
@@ -0,0 +1,113 @@
+# result_export.py
+"""
+查询结果的流式导出
+
+所有导出函数都接收逐块的DataFrame迭代器，逐块生成字节，
+导出大结果时内存占用只与块大小相关。
+"""
+
+import os
+import tempfile
+import zlib
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 导出格式 -> (MIME类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Excel单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_csv(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    """逐块输出CSV，只在第一块写表头"""
+    header = True
+    for df in frames:
+        yield df.to_csv(header=header).encode('utf-8')
+        header = False
+
+
+def iter_parquet(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    """逐块写入临时Parquet文件，完成后流式输出"""
+    if pq is None:
+        raise ValueError("未安装pyarrow，无法导出Parquet")
+
+    def write(path):
+        writer = None
+        try:
+            for df in frames:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    return _iter_temp_file(write, '.parquet')
+
+
+def iter_xlsx(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    """使用openpyxl的只写模式逐行写入临时xlsx文件，完成后流式输出"""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("未安装openpyxl，无法导出Excel")
+
+    def write(path):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        rows = 0
+        header = True
+        for df in frames:
+            if header:
+                ws.append([str(c) for c in df.columns])
+                rows += 1
+                header = False
+            rows += len(df)
+            if rows > EXCEL_MAX_ROWS:
+                raise ValueError(f"结果超过Excel最大行数 {EXCEL_MAX_ROWS}，请使用CSV或Parquet格式")
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+                ws.append(list(row))
+        wb.save(path)
+
+    return _iter_temp_file(write, '.xlsx')
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """将字节流压缩为gzip格式"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _iter_temp_file(write, suffix: str) -> Iterator[bytes]:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        write(path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
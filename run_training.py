@@ -1,282 +1,266 @@
 # run_training.py
+"""
+训练数据导入
+
+用法:
+    python run_training.py --config training_files.json
+    python run_training.py "D:/TechDoc/NL2SQL/*.sql" docs/ --workers 4
+    python run_training.py data/ --dry-run          # 只统计各文件的块数，不训练
+
+文件类型（ddl、sql、doc、qs_colon、formatted_qs）默认根据扩展名和文件内容自动识别，
+多个文件在子进程中并行解析，解析出的块送入同一个训练流水线（生成向量 → 写入）。
+"""
+import argparse
+import glob
+import importlib
+import json
+import multiprocessing
 import os
+import queue
 import time
-import re
-from vanna_trainer import (
-    train_ddl,
-    train_documentation,
-    train_sql_example,
-    train_question_sql_pair,
-    flush_training,
-    shutdown_trainer
+from collections import Counter
+from training_parsers import (
+    FILE_TYPES,
+    TRAINING_EXTENSIONS,
+    detect_file_type,
+    parse_file_messages,
+    parse_worker
 )
-from tools.chroma_cleaner import clear_chroma_database
 
-def read_file_by_delimiter(filepath, delimiter="---"):
-    """通用读取：将文件按分隔符切片为多个段落"""
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-    blocks = [block.strip() for block in content.split(delimiter) if block.strip()]
-    return blocks
+# 训练类型 → vanna_trainer 中的训练函数，参数见 training_parsers.iter_training_items
+TRAIN_FUNCTIONS = {
+    'ddl': 'train_ddl',
+    'documentation': 'train_documentation',
+    'sql': 'train_sql_example',
+    'question_sql': 'train_question_sql_pair',
+}
 
-def read_markdown_file_by_sections(filepath):
-    """专门用于Markdown文件：按标题(#、##、###)分割文档
-    
-    Args:
-        filepath (str): Markdown文件路径
-        
-    Returns:
-        list: 分割后的Markdown章节列表
+
+def load_trainer():
     """
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-    
-    # 确定文件是否为Markdown
-    is_markdown = filepath.lower().endswith('.md') or filepath.lower().endswith('.markdown')
-    
-    if not is_markdown:
-        # 非Markdown文件使用默认的---分隔
-        return read_file_by_delimiter(filepath, "---")
-    
-    # 直接按照标题级别分割内容，处理#、##和###
-    sections = []
-    
-    # 匹配所有级别的标题（#、##或###开头）
-    header_pattern = r'(?:^|\n)((?:#|##|###)[^#].*?)(?=\n(?:#|##|###)[^#]|\Z)'
-    all_sections = re.findall(header_pattern, content, re.DOTALL)
-    
-    for section in all_sections:
-        section = section.strip()
-        if section:
-            sections.append(section)
-    
-    # 处理没有匹配到标题的情况
-    if not sections and content.strip():
-        sections = [content.strip()]
-        
-    return sections
+    导入 vanna_trainer（导入时连接向量库并启动训练流水线的线程）
 
-def train_ddl_statements(ddl_file):
-    """训练DDL语句
-    Args:
-        ddl_file (str): DDL文件路径
+    在解析进程启动之后才导入：fork 出的子进程不会继承这些线程和连接，
+    spawn 的子进程重新导入本模块时也不会连接向量库；--dry-run 完全不导入
     """
-    print(f"📄 开始训练 DDL: {ddl_file}")
-    if not os.path.exists(ddl_file):
-        print(f"❌ DDL 文件不存在: {ddl_file}")
-        return
-    for idx, ddl in enumerate(read_file_by_delimiter(ddl_file, ";"), start=1):
-        try:
-            print(f"\n🚀 DDL 训练 {idx}")
-            train_ddl(ddl)
-        except Exception as e:
-            print(f"❌ 错误：DDL #{idx} - {e}")
+    return importlib.import_module('vanna_trainer')
+
+def expand_path(path):
+    """文件原样返回；目录返回其中（递归）的训练文件；含通配符时按 glob 展开"""
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names if name.lower().endswith(TRAINING_EXTENSIONS))
+        return sorted(files)
+    if glob.has_magic(path):
+        return sorted(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+    return [path]
 
-def train_documentation_blocks(doc_file):
-    """训练文档块
-    Args:
-        doc_file (str): 文档文件路径
+def load_config(config_file):
     """
-    print(f"📄 开始训练 文档: {doc_file}")
-    if not os.path.exists(doc_file):
-        print(f"❌ 文档文件不存在: {doc_file}")
-        return
-    
-    # 检查是否为Markdown文件
-    is_markdown = doc_file.lower().endswith('.md') or doc_file.lower().endswith('.markdown')
-    
-    if is_markdown:
-        # 使用Markdown专用分割器
-        sections = read_markdown_file_by_sections(doc_file)
-        print(f"🔍 Markdown文档已分割为 {len(sections)} 个章节")
-        
-        for idx, section in enumerate(sections, start=1):
-            try:
-                section_title = section.split('\n', 1)[0].strip()
-                print(f"\n🚀 Markdown章节训练 {idx}: {section_title}")
-                
-                # 检查部分长度并提供警告
-                if len(section) > 2000:
-                    print(f"⚠️ 章节 {idx} 长度为 {len(section)} 字符，接近API限制(2048)")
-                
-                train_documentation(section)
-            except Exception as e:
-                print(f"❌ 错误：章节 #{idx} - {e}")
-    else:
-        # 非Markdown文件使用传统的---分隔
-        for idx, doc in enumerate(read_file_by_delimiter(doc_file, "---"), start=1):
-            try:
-                print(f"\n🚀 文档训练 {idx}")
-                train_documentation(doc)
-            except Exception as e:
-                print(f"❌ 错误：文档 #{idx} - {e}")
+    读取JSON配置，返回 [(路径, 类型或None)]
+
+    格式：{"base_path": "...", "files": ["a.sql", "docs/*.md", {"path": "b.txt", "type": "qs_colon"}]}
+    相对路径相对于 base_path（默认为配置文件所在目录）
+    """
+    with open(config_file, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    base_path = config.get("base_path") or os.path.dirname(os.path.abspath(config_file))
+
+    entries = []
+    for entry in config.get("files", []):
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        file_type = entry.get("type")
+        if file_type is not None and file_type not in FILE_TYPES:
+            raise ValueError(f"{config_file}: 未知的文件类型 {file_type}，可选 {', '.join(FILE_TYPES)}")
+        entries.append((os.path.join(base_path, entry["path"]), file_type))
+    return entries
 
-def train_sql_examples(sql_file):
-    """训练SQL示例
-    Args:
-        sql_file (str): SQL示例文件路径
+def collect_training_files(paths, config_file=None, file_type=None):
+    """展开命令行和配置中的路径，返回去重后的 [(路径, 类型)]；file_type 指定时覆盖自动识别"""
+    entries = [(path, None) for path in paths]
+    if config_file:
+        entries.extend(load_config(config_file))
+
+    files = []
+    seen = set()
+    for pattern, entry_type in entries:
+        matched = expand_path(pattern)
+        if not matched:
+            print(f"⚠️ 没有匹配的文件: {pattern}")
+        for path in matched:
+            if not os.path.exists(path):
+                print(f"❌ 文件不存在: {path}")
+                continue
+            key = os.path.abspath(path)
+            if key in seen:
+                continue
+            seen.add(key)
+            files.append((path, file_type or entry_type or detect_file_type(path)))
+    return files
+
+def iter_parse_messages(files, workers):
     """
-    print(f"📄 开始训练 SQL 示例: {sql_file}")
-    if not os.path.exists(sql_file):
-        print(f"❌ SQL 示例文件不存在: {sql_file}")
-        return
-    for idx, sql in enumerate(read_file_by_delimiter(sql_file, ";"), start=1):
-        try:
-            print(f"\n🚀 SQL 示例训练 {idx}")
-            train_sql_example(sql)
-        except Exception as e:
-            print(f"❌ 错误：SQL #{idx} - {e}")
+    并行解析文件，返回按到达顺序产生 training_parsers.parse_file_messages 消息的迭代器
 
-def train_question_sql_pairs(qs_file):
-    """训练问答对
-    Args:
-        qs_file (str): 问答对文件路径
+    解析进程在调用时立即启动（而不是在第一次迭代时），调用方随后才能导入 vanna_trainer。
+    结果队列有容量上限：训练流水线处理不过来时主进程不再取消息，解析进程随之等待
     """
-    print(f"📄 开始训练 问答对: {qs_file}")
-    if not os.path.exists(qs_file):
-        print(f"❌ 问答文件不存在: {qs_file}")
-        return
+    if workers <= 0 or len(files) <= 1:
+        return (message for path, file_type in files for message in parse_file_messages(path, file_type))
+
+    # 子进程只解析文件，本模块不在顶层导入 vanna_trainer，fork 和 spawn（Windows）都不会带上向量库连接
+    ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    tasks = ctx.Queue()
+    results = ctx.Queue(maxsize=workers * 4)
+    for task in files:
+        tasks.put(task)
+    processes = [ctx.Process(target=parse_worker, args=(tasks, results), daemon=True)
+                 for _ in range(min(workers, len(files)))]
+    for process in processes:
+        tasks.put(None)
+        process.start()
+    return _collect_messages(processes, results, len(files))
+
+def _collect_messages(processes, results, total):
+    finished = 0
     try:
-        with open(qs_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-        for idx, line in enumerate(lines, start=1):
-            if "::" not in line:
+        while finished < total:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    print(f"❌ 解析进程意外退出，{total - finished} 个文件未完成")
+                    return
                 continue
-            question, sql = line.strip().split("::", 1)
-            print(f"\n🚀 问答训练 {idx}")
-            train_question_sql_pair(question.strip(), sql.strip())
-    except Exception as e:
-        print(f"❌ 错误：问答训练 - {e}")
+            if message[0] in ('done', 'error'):
+                finished += 1
+            yield message
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
 
-def train_formatted_question_sql_pairs(formatted_file):
-    """训练格式化的问答对文件
-    支持两种格式：
-    1. Question: xxx\nSQL: xxx (单行SQL)
-    2. Question: xxx\nSQL:\nxxx\nxxx (多行SQL)
-    
-    Args:
-        formatted_file (str): 格式化问答对文件路径
+def report_progress(files_done, files_total, counts, started, trainer=None):
+    elapsed = time.time() - started
+    line = (f"📊 进度: 文件 {files_done}/{files_total}, 已解析 {counts['parsed']} 块, "
+            f"已提交 {counts['submitted']}, 跳过 {counts['skipped']}, 耗时 {elapsed:.0f} 秒")
+    progress = trainer.training_progress() if trainer is not None else None
+    if progress is not None:
+        line += (f" | 已写入 {progress['written']} 行, 失败 {progress['failed']}, "
+                 f"{progress['items_per_second']:.1f} 行/秒")
+    print(line)
+
+def ingest_files(files, workers=4, dry_run=False, progress_interval=10.0, trainer=None):
     """
-    print(f"📄 开始训练 格式化问答对: {formatted_file}")
-    if not os.path.exists(formatted_file):
-        print(f"❌ 格式化问答文件不存在: {formatted_file}")
-        return
-    
-    # 读取整个文件内容
-    with open(formatted_file, "r", encoding="utf-8") as f:
-        content = f.read()
-    
-    # 按双空行分割不同的问答对
-    # 使用更精确的分隔符，避免误识别
-    pairs = []
-    blocks = content.split("\n\nQuestion:")
-    
-    # 处理第一块（可能没有前导的"\n\nQuestion:"）
-    first_block = blocks[0]
-    if first_block.strip().startswith("Question:"):
-        pairs.append(first_block.strip())
-    elif "Question:" in first_block:
-        # 处理文件开头没有Question:的情况
-        question_start = first_block.find("Question:")
-        pairs.append(first_block[question_start:].strip())
-    
-    # 处理其余块
-    for block in blocks[1:]:
-        pairs.append("Question:" + block.strip())
-    
-    # 处理每个问答对
-    successfully_processed = 0
-    for idx, pair in enumerate(pairs, start=1):
-        try:
-            if "Question:" not in pair or "SQL:" not in pair:
-                print(f"⚠️ 跳过不符合格式的对 #{idx}")
-                continue
-                
-            # 提取问题部分
-            question_start = pair.find("Question:") + len("Question:")
-            sql_start = pair.find("SQL:", question_start)
-            
-            if sql_start == -1:
-                print(f"⚠️ SQL部分未找到，跳过对 #{idx}")
-                continue
-                
-            question = pair[question_start:sql_start].strip()
-            
-            # 提取SQL部分（支持多行）
-            sql_part = pair[sql_start + len("SQL:"):].strip()
-            
-            # 检查是否存在下一个Question标记（防止解析错误）
-            next_question = pair.find("Question:", sql_start)
-            if next_question != -1:
-                sql_part = pair[sql_start + len("SQL:"):next_question].strip()
-            
-            if not question or not sql_part:
-                print(f"⚠️ 问题或SQL为空，跳过对 #{idx}")
-                continue
-            
-            # 训练问答对
-            print(f"\n🚀 格式化问答训练 {idx}")
-            print(f"问题: {question}")
-            print(f"SQL: {sql_part}")
-            train_question_sql_pair(question, sql_part)
-            successfully_processed += 1
-            
-        except Exception as e:
-            print(f"❌ 错误：格式化问答训练对 #{idx} - {e}")
-    
-    print(f"✅ 格式化问答训练完成，共成功处理 {successfully_processed} 对问答（总计 {len(pairs)} 对）")
+    并行解析并训练多个文件，返回 (每个文件的统计, 使用的 vanna_trainer 模块)
 
-def main():
-    """主函数：配置和运行训练流程"""
-    # 配置基础路径
-    BASE_PATH = r"D:\TechDoc\NL2SQL"  # Windows 路径格式
+    dry_run 时只解析和统计，不导入 vanna_trainer、不查询断点，因此不需要向量库；
+    trainer 为None时在解析进程启动后导入 vanna_trainer
+    """
+    stats = {path: {'type': file_type, 'blocks': Counter(), 'skipped': 0, 'invalid': 0,
+                    'failed': 0, 'error': None} for path, file_type in files}
+    counts = Counter(parsed=0, submitted=0, skipped=0)
+    checkpoints = {}
+    files_done = 0
+    started = last_report = time.time()
+
+    messages = iter_parse_messages(files, workers)
+    if not dry_run and trainer is None:
+        trainer = load_trainer()
+
+    for kind, path, payload in messages:
+        file_stats = stats[path]
+        if kind == 'start':
+            checkpoints[path] = (payload, set() if dry_run else trainer.completed_blocks(payload))
+            if checkpoints[path][1]:
+                print(f"⏩ 跳过之前已写入的 {len(checkpoints[path][1])} 个块: {path}")
+        elif kind == 'items':
+            file_hash, completed = checkpoints[path]
+            for idx, train_type, args in payload:
+                counts['parsed'] += 1
+                if train_type is None:
+                    file_stats['invalid'] += 1
+                    continue
+                if idx in completed:
+                    file_stats['skipped'] += 1
+                    counts['skipped'] += 1
+                    continue
+                file_stats['blocks'][train_type] += 1
+                if dry_run:
+                    continue
+                try:
+                    getattr(trainer, TRAIN_FUNCTIONS[train_type])(*args, checkpoint=(file_hash, idx, path))
+                    counts['submitted'] += 1
+                except Exception as e:
+                    file_stats['failed'] += 1
+                    print(f"❌ 错误：{path} #{idx} - {e}")
+        elif kind == 'done':
+            files_done += 1
+            print(f"✅ 解析完成 ({files_done}/{len(files)}): {path}，共 {payload} 块")
+        else:
+            files_done += 1
+            file_stats['error'] = payload
+            print(f"❌ 解析失败 ({files_done}/{len(files)}): {path} - {payload}")
 
-    # 配置训练文件路径
-    TRAINING_FILES = {
-        "ddl_1": os.path.join(BASE_PATH, "create_table_0419.sql"),
-        "ddl_2": os.path.join(BASE_PATH, "table_comments_0419.sql"),
-        "ddl_3": os.path.join(BASE_PATH, "relationships_0419.sql"),
-        "doc_1": os.path.join(BASE_PATH, "数据仓库表结构文档 _CN.md"),
-        "doc_2": os.path.join(BASE_PATH, "Data_Warehouse_Table_Doc_English_Vers.md"),
-        "doc_3": os.path.join(BASE_PATH, "table_detail_doc_cn.md"),
-        "doc_4": os.path.join(BASE_PATH, "table_detail_doc_en.md"),
-        "sql_1": os.path.join(BASE_PATH, "SQL_Example_CN.txt"),
-        "sql_2": os.path.join(BASE_PATH, "SQL_Example_EN.txt"),
-        "qs_colon_1": os.path.join(BASE_PATH, "Question_SQL_Colon_EN.txt"),
-        "qs_colon_2": os.path.join(BASE_PATH, "Question_SQL_Simple_Colon_CN.txt"),
-        "qs_colon_3": os.path.join(BASE_PATH, "Question_SQL_Simple_Colon_EN.txt"),
-        "formatted_qs_1": os.path.join(BASE_PATH, "Question_SQL_Pair_CN.txt"),
-        "formatted_qs_2": os.path.join(BASE_PATH, "Question_SQL_Pairs_EN_CN.txt"),
-    }
+        if progress_interval and time.time() - last_report >= progress_interval:
+            report_progress(files_done, len(files), counts, started, trainer)
+            last_report = time.time()
 
-    # 添加DDL语句训练
-    train_ddl_statements(TRAINING_FILES["ddl_1"])
-    train_ddl_statements(TRAINING_FILES["ddl_2"])
-    train_ddl_statements(TRAINING_FILES["ddl_3"])
+    return stats, trainer
+
+def print_ingest_summary(stats, dry_run):
+    print(f"\n===== {'试运行统计（未训练）' if dry_run else '导入统计'} =====")
+    total = Counter()
+    for path, file_stats in stats.items():
+        blocks = ', '.join(f"{name} {count}" for name, count in sorted(file_stats['blocks'].items())) or '无'
+        line = f"{path} [{file_stats['type']}]: {blocks}"
+        if file_stats['skipped']:
+            line += f"，已训练跳过 {file_stats['skipped']}"
+        if file_stats['invalid']:
+            line += f"，格式不符 {file_stats['invalid']}"
+        if file_stats['failed']:
+            line += f"，提交失败 {file_stats['failed']}"
+        if file_stats['error']:
+            line += f"，解析失败: {file_stats['error']}"
+        print(line)
+        total.update(file_stats['blocks'])
+        total['skipped'] += file_stats['skipped']
+        total['invalid'] += file_stats['invalid']
+    print(f"合计: {sum(v for k, v in total.items() if k not in ('skipped', 'invalid'))} 块"
+          f"（{', '.join(f'{k} {v}' for k, v in sorted(total.items()) if k not in ('skipped', 'invalid')) or '无'}），"
+          f"跳过 {total['skipped']}，格式不符 {total['invalid']}")
+
+def main():
+    """主函数：解析命令行，收集训练文件并运行训练流程"""
+    parser = argparse.ArgumentParser(description="解析训练文件并写入向量库")
+    parser.add_argument('paths', nargs='*', help="训练文件、目录或通配符（如 \"docs/**/*.md\"）")
+    parser.add_argument('--config', help="JSON配置文件，格式见 training_files.example.json")
+    parser.add_argument('--type', choices=FILE_TYPES, help="所有文件使用此类型，默认自动识别")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="解析文件的进程数，0表示在主进程中依次解析")
+    parser.add_argument('--dry-run', action='store_true', help="只解析并统计各文件的块数，不训练")
+    parser.add_argument('--progress-interval', type=float, default=10, help="输出进度的间隔（秒），0表示不输出")
+    args = parser.parse_args()
 
-    #添加文档结构训练
-    train_documentation_blocks(TRAINING_FILES["doc_1"])
-    train_documentation_blocks(TRAINING_FILES["doc_2"])
-    train_documentation_blocks(TRAINING_FILES["doc_3"])
-    train_documentation_blocks(TRAINING_FILES["doc_4"])
+    files = collect_training_files(args.paths, args.config, args.type)
+    if not files:
+        parser.error("没有找到训练文件，请指定文件、目录、通配符或 --config")
 
-    # 添加SQL示例训练
-    train_sql_examples(TRAINING_FILES["sql_1"])
-    train_sql_examples(TRAINING_FILES["sql_2"])
+    print(f"🚀 共 {len(files)} 个训练文件，解析进程 {args.workers}")
+    for path, file_type in files:
+        print(f"📄 {path} [{file_type}]")
 
-    # 添加问答对训练, 包含冒号
-    train_question_sql_pairs(TRAINING_FILES["qs_colon_1"])
-    train_question_sql_pairs(TRAINING_FILES["qs_colon_2"])
-    train_question_sql_pairs(TRAINING_FILES["qs_colon_3"])
+    stats, trainer = ingest_files(files, args.workers, args.dry_run, args.progress_interval)
 
-    # 添加问答对训练, 不包含冒号
-    train_formatted_question_sql_pairs(TRAINING_FILES["formatted_qs_1"])
-    train_formatted_question_sql_pairs(TRAINING_FILES["formatted_qs_2"])
-    
-    # 训练结束，刷新和关闭批处理器
-    print("\n===== 训练完成，处理剩余批次 =====")
-    flush_training()
-    shutdown_trainer()
+    if trainer is not None:
+        # 训练结束，刷新和关闭批处理器
+        print("\n===== 解析完成，处理剩余批次 =====")
+        trainer.flush_training()
+        trainer.shutdown_trainer()
+    print_ingest_summary(stats, args.dry_run)
 
 
 if __name__ == "__main__":
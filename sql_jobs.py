@@ -0,0 +1,203 @@
+# sql_jobs.py
+"""
+异步SQL作业
+
+提交SQL后立即返回作业id，查询在有界线程池中执行，客户端轮询状态。
+运行中的作业通过 pg_cancel_backend 取消正在执行的语句；服务端游标在两次FETCH之间空闲时
+pg_cancel_backend 不起作用，由进度回调在读完下一块后检查取消标志并中止。
+"""
+
+import concurrent.futures
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from sql_runner import cancel_backend
+
+# 作业状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """等待中的作业数已达上限"""
+
+
+class JobCancelled(Exception):
+    """作业已被取消，由回调抛出以中止查询"""
+
+
+class SqlJob:
+    def __init__(self, sql: str, statement_timeout_ms: int, context: Optional[Dict[str, Any]] = None):
+        self.id = str(uuid.uuid4())
+        self.sql = sql
+        self.statement_timeout_ms = statement_timeout_ms
+        self.context = context or {}
+        self.status = QUEUED
+        self.rows = 0
+        self.backend_pid = None
+        self.error = None
+        self.result = None
+        self.cancel_requested = False
+        # 查询已结束、正在写入最终状态，此后不能再取消
+        self.completing = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "rows": self.rows,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": now - self.started_at if self.started_at else 0.0,
+        }
+
+
+class SqlJobManager:
+    """
+    管理异步SQL作业
+
+    runner(job, on_connect, on_progress) 在工作线程中执行查询并返回结果；
+    它应把两个回调原样传给 sql_runner，以支持取消和进度上报。
+    """
+
+    def __init__(self, runner: Callable[..., Any], max_workers: int = 4,
+                 max_pending: int = 32, retention: float = 3600):
+        self.runner = runner
+        self.max_pending = max_pending
+        self.retention = retention
+        self.jobs: Dict[str, SqlJob] = {}
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix='sql-job')
+
+    def submit(self, sql: str, statement_timeout_ms: int, context: Optional[Dict[str, Any]] = None,
+               on_success: Optional[Callable[[SqlJob], None]] = None) -> SqlJob:
+        job = SqlJob(sql, statement_timeout_ms, context)
+
+        with self.lock:
+            self._purge_finished()
+            pending = sum(1 for j in self.jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"等待中的SQL作业已达上限 {self.max_pending}")
+            self.jobs[job.id] = job
+            job.future = self.executor.submit(self._run, job, on_success)
+
+        return job
+
+    def get(self, job_id: str) -> Optional[SqlJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消作业：排队中的直接撤销，运行中的对其后端进程执行 pg_cancel_backend，
+        并由回调在连接建立或读完下一块时中止；查询已结束的作业不能取消，返回False
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished or job.completing:
+                return False
+            job.cancel_requested = True
+
+        if job.future.cancel():
+            self._finish(job, CANCELLED)
+            return True
+
+        pid = job.backend_pid
+        if pid is None:
+            # 尚未建立连接，set_backend 会在连接建立后检查 cancel_requested
+            return True
+
+        try:
+            cancel_backend(pid)
+        except Exception as e:
+            # 取消标志已设置，set_progress 读完下一块后仍会中止
+            print(f"[WARNING] 对SQL作业 {job_id} 执行 pg_cancel_backend 失败: {e}")
+        return True
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            stats = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self.jobs.values():
+                stats[job.status] += 1
+            return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: SqlJob, on_success):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+
+        job.status = RUNNING
+        job.started_at = time.time()
+
+        def set_backend(conn):
+            job.backend_pid = conn.get_backend_pid()
+            if job.cancel_requested:
+                raise JobCancelled("作业已取消")
+
+        def set_progress(rows):
+            job.rows = rows
+            # 两次FETCH之间后端空闲，pg_cancel_backend 不会中断游标，在这里中止
+            if job.cancel_requested:
+                raise JobCancelled("作业已取消")
+
+        error = None
+        try:
+            result = self.runner(job, set_backend, set_progress)
+        except Exception as e:
+            error = e
+        finally:
+            job.backend_pid = None
+
+        with self.lock:
+            job.completing = True
+            cancelled = job.cancel_requested
+        if cancelled:
+            # 查询结束前收到的取消请求，即使查询已成功也不写入结果
+            self._finish(job, CANCELLED)
+            return
+
+        try:
+            if error is not None:
+                raise error
+            job.result = result
+            if on_success is not None:
+                on_success(job)
+            self._finish(job, SUCCEEDED)
+        except Exception as e:
+            print(f"[ERROR] SQL作业 {job.id} 失败: {e}")
+            job.error = str(e)
+            job.result = None
+            self._finish(job, FAILED)
+
+    def _finish(self, job: SqlJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+
+    def _purge_finished(self):
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
@@ -0,0 +1,137 @@
+# sql_runner.py
+"""
+直接访问业务数据仓库的SQL执行工具
+
+vn.run_sql 会一次性把整个结果集读入pandas，这里使用命名（服务端）游标
+分块读取结果，用于大结果的流式处理。
+"""
+
+import os
+import uuid
+from typing import Callable, Iterator, Optional, Tuple
+
+import pandas as pd
+import psycopg2
+
+from vanna_pgvector_qwen import db_config
+
+# 服务端游标每次读取的行数
+SQL_FETCH_SIZE = int(os.environ.get('SQL_FETCH_SIZE', '5000'))
+
+# run_sql 缓存结果的硬上限，超出部分被截断
+RUN_SQL_MAX_ROWS = int(os.environ.get('RUN_SQL_MAX_ROWS', '100000'))
+RUN_SQL_MAX_BYTES = int(os.environ.get('RUN_SQL_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def connect_warehouse():
+    """创建一个新的数据仓库连接，调用方负责关闭"""
+    return psycopg2.connect(**db_config)
+
+
+def iter_sql_chunks(sql: str, chunk_size: int = SQL_FETCH_SIZE,
+                    limit: Optional[int] = None,
+                    statement_timeout_ms: Optional[int] = None,
+                    on_connect: Optional[Callable] = None) -> Iterator[pd.DataFrame]:
+    """
+    使用命名游标执行SQL，逐块返回DataFrame
+
+    结果为空时返回一个只有列名的空DataFrame，保证调用方总能拿到表头。
+    每块的索引从上一块结束处继续编号，与一次性读取时一致。
+    limit 不为空时最多读取 limit 行，其余行不会从服务端传输。
+    statement_timeout_ms 为本次查询每条语句设置超时；on_connect(conn) 在执行前被调用，
+    可用于记录后端进程号以便取消。
+    """
+    conn = connect_warehouse()
+    try:
+        if statement_timeout_ms:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = %s", (int(statement_timeout_ms),))
+        if on_connect is not None:
+            on_connect(conn)
+
+        with conn.cursor(name=f"vanna_{uuid.uuid4().hex}") as cur:
+            cur.itersize = chunk_size
+            cur.execute(sql)
+
+            offset = 0
+            columns: Optional[list] = None
+            while limit is None or offset < limit:
+                size = chunk_size if limit is None else min(chunk_size, limit - offset)
+                rows = cur.fetchmany(size)
+                if columns is None:
+                    columns = [desc[0] for desc in cur.description]
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=columns)
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                offset += len(df)
+                yield df
+
+            if offset == 0:
+                yield pd.DataFrame(columns=columns or [])
+    finally:
+        # 只读查询，回滚以结束事务并释放游标
+        conn.rollback()
+        conn.close()
+
+
+def run_sql_capped(sql: str, max_rows: int = RUN_SQL_MAX_ROWS, max_bytes: int = RUN_SQL_MAX_BYTES,
+                   chunk_size: int = SQL_FETCH_SIZE, on_progress: Optional[Callable] = None,
+                   **kwargs) -> Tuple[pd.DataFrame, bool]:
+    """
+    使用服务端游标执行SQL，最多读取 max_rows 行、约 max_bytes 字节
+
+    命名游标让PostgreSQL按快速返回首批行的方式规划查询，并且只传输实际读取的行。
+    on_progress(rows) 在每读完一块后被调用，其余参数传给 iter_sql_chunks。
+
+    Returns:
+        (DataFrame, 是否被截断)
+    """
+    frames = []
+    rows = 0
+    nbytes = 0
+    truncated = False
+
+    # 多读一行，用来判断结果是否被行数上限截断
+    chunks = iter_sql_chunks(sql, chunk_size=chunk_size, limit=max_rows + 1, **kwargs)
+    try:
+        for df in chunks:
+            if rows + len(df) > max_rows:
+                df = df.iloc[:max_rows - rows]
+                truncated = True
+
+            chunk_bytes = int(df.memory_usage(deep=True).sum())
+            if nbytes + chunk_bytes > max_bytes:
+                # 按平均行大小保留能放下的部分行
+                allowed = int(len(df) * (max_bytes - nbytes) / chunk_bytes)
+                df = df.iloc[:max(0, allowed)]
+                chunk_bytes = int(df.memory_usage(deep=True).sum())
+                truncated = True
+
+            frames.append(df)
+            rows += len(df)
+            nbytes += chunk_bytes
+            if on_progress is not None:
+                on_progress(rows)
+            if truncated:
+                break
+    finally:
+        # 提前结束时立即关闭游标和连接
+        chunks.close()
+
+    if truncated:
+        print(f"[WARNING] 查询结果超过上限，已截断为 {rows} 行 ({nbytes} 字节)")
+
+    return pd.concat(frames) if len(frames) > 1 else frames[0], truncated
+
+
+def cancel_backend(pid: int) -> bool:
+    """通过 pg_cancel_backend 取消指定后端进程上正在执行的查询"""
+    conn = connect_warehouse()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_cancel_backend(%s)", (pid,))
+            return bool(cur.fetchone()[0])
+    finally:
+        conn.close()
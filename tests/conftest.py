@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+
+# 测试不连接数仓、向量库和LLM：用假的 vanna_pgvector_qwen 代替，各测试按需替换 vn 的方法
+fake_vanna = types.ModuleType('vanna_pgvector_qwen')
+fake_vanna.vn = types.SimpleNamespace()
+fake_vanna.init_db_connection = lambda: None
+fake_vanna.db_config = {'host': 'localhost', 'port': 5432, 'dbname': 'test', 'user': 'test', 'password': 'test'}
+sys.modules['vanna_pgvector_qwen'] = fake_vanna
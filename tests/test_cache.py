@@ -0,0 +1,39 @@
+from cache import SqlResultCache, normalize_sql
+
+
+def test_normalize_sql_case_whitespace_and_comments():
+    assert normalize_sql("SELECT  *\n FROM Orders -- comment\n WHERE A = 'X';") == \
+        "select * from orders where a = 'X'"
+
+
+def test_dollar_quoted_body_keeps_case():
+    a = normalize_sql("SELECT $$Hello World$$, $Body$ It's; -- not a comment $Body$ FROM t")
+    b = normalize_sql("SELECT $$hello world$$, $body$ it's; -- not a comment $body$ FROM t")
+    assert a == "select $$Hello World$$, $Body$ It's; -- not a comment $Body$ from t"
+    assert a != b
+
+
+def test_dollar_in_identifiers_and_parameters_is_not_a_quote():
+    assert normalize_sql("SELECT A$$B, $1 FROM T") == "select a$$b, $1 from t"
+
+
+def test_e_string_backslash_escape():
+    sql = "SELECT E'It\\'s A Test' AS Label, 'X' FROM T"
+    assert normalize_sql(sql) == "select e'It\\'s A Test' as label, 'X' from t"
+    assert normalize_sql("SELECT E'It\\'s A Test'") != normalize_sql("SELECT E'it\\'s a test'")
+
+
+def test_plain_string_backslash_is_not_escape():
+    assert normalize_sql("SELECT 'C:\\' AS P FROM T") == "select 'C:\\' as p from t"
+
+
+def test_is_cacheable_only_for_read_only_queries():
+    assert SqlResultCache.is_cacheable("SELECT * FROM orders WHERE action = 'delete'")
+    assert SqlResultCache.is_cacheable("(SELECT 1) UNION (SELECT 2)")
+    assert SqlResultCache.is_cacheable("SELECT 'now()' AS label;")
+    assert not SqlResultCache.is_cacheable("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d")
+    assert not SqlResultCache.is_cacheable("SELECT * INTO backup FROM t")
+    assert not SqlResultCache.is_cacheable("SELECT 1; DROP TABLE t")
+    assert not SqlResultCache.is_cacheable("CREATE TABLE t AS SELECT 1")
+    assert not SqlResultCache.is_cacheable("SELECT now()")
+    assert not SqlResultCache.is_cacheable("SELECT * FROM t /* no_cache */")
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from chart_reduction import OTHER_LABEL, lttb_indices, reduce_for_chart
+
+
+def test_pie_with_names_only_is_not_reduced():
+    df = pd.DataFrame({'region': np.random.default_rng(0).choice(list('abcdefghijklmnopqrstuvwxyz'), 10000),
+                       'order_id': np.arange(10000)})
+    code = "fig = px.pie(df, names='region')"
+    reduced, points = reduce_for_chart(df, plotly_code=code, max_points=100, top_n=5)
+    assert reduced is df
+    assert points['method'] is None
+
+
+def test_bar_sums_only_y_and_keeps_color_column():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        'order_id': np.arange(10000),
+        'product': rng.choice(['p1', 'p2', 'p3'], 10000),
+        'color': rng.choice(['red', 'blue'], 10000),
+        'amount': rng.integers(1, 100, 10000),
+    })
+    code = "fig = px.bar(df, x='product', y='amount', color='color')"
+    reduced, points = reduce_for_chart(df, plotly_code=code, max_points=100)
+    assert points['method'] == 'aggregate'
+    assert list(reduced.columns) == ['product', 'color', 'amount']
+    expected = df.groupby(['product', 'color'])['amount'].sum()
+    assert reduced.set_index(['product', 'color'])['amount'].sort_index().equals(expected.sort_index())
+
+
+def test_bar_without_known_y_is_not_reduced():
+    df = pd.DataFrame({'product': ['a', 'b'] * 5000, 'amount': np.arange(10000)})
+    reduced, points = reduce_for_chart(df, plotly_code="fig = px.bar(df, x=df.columns[0], y=df.columns[1])",
+                                       max_points=100)
+    assert reduced is df
+    assert points['method'] is None
+
+
+def test_category_top_n_on_values_column():
+    df = pd.DataFrame({'name': [f"n{i % 50}" for i in range(10000)], 'order_id': np.arange(10000),
+                       'value': np.ones(10000)})
+    reduced, points = reduce_for_chart(df, plotly_code="fig = px.pie(df, names='name', values='value')",
+                                       max_points=100, top_n=5)
+    assert points['method'] == 'top_n'
+    assert list(reduced.columns) == ['name', 'value']
+    assert len(reduced) == 6
+    assert reduced['name'].iloc[-1] == OTHER_LABEL
+    assert reduced['value'].sum() == 10000
+
+
+def test_histogram_is_not_reduced():
+    df = pd.DataFrame({'a': np.arange(10000), 'b': np.arange(10000) * 2.0})
+    reduced, points = reduce_for_chart(df, plotly_code="fig = px.histogram(df, x='a')", max_points=100)
+    assert reduced is df
+    assert points['method'] is None
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(10000, dtype=float)
+    y = np.zeros(10000)
+    y[5000] = 100.0
+    selected = lttb_indices(x, y, 100)
+    assert selected[0] == 0 and selected[-1] == 9999
+    assert len(selected) <= 100
+    assert np.all(np.diff(selected) > 0)
+    assert 5000 in selected
+
+
+def test_line_uses_code_columns():
+    df = pd.DataFrame({'day': pd.date_range('2024-01-01', periods=10000, freq='h'),
+                       'id': np.arange(10000), 'sales': np.sin(np.arange(10000) / 100)})
+    reduced, points = reduce_for_chart(df, plotly_code="fig = px.line(df, x='day', y='sales')", max_points=500)
+    assert points['method'] == 'lttb'
+    assert len(reduced) <= 500
@@ -0,0 +1,27 @@
+from chunking import DOC_CHUNK_MAX_CHARS, DOC_CHUNK_TYPE, document_records, estimate_tokens, split_document
+
+
+def test_short_document_is_not_split():
+    assert split_document("## 标题\n\n一段说明。") == ["## 标题\n\n一段说明。"]
+
+
+def test_single_long_token_is_cut_by_characters():
+    chunks = split_document('a' * 10000, max_tokens=400)
+    assert len(chunks) > 1
+    assert ''.join(chunks) == 'a' * 10000
+    assert all(len(chunk) <= DOC_CHUNK_MAX_CHARS and estimate_tokens(chunk) <= 400 for chunk in chunks)
+
+
+def test_long_token_inside_section_keeps_heading():
+    doc = "# 接口说明\n\n## 签名\n\n密钥示例 " + 'x' * 6000 + " 结束。"
+    chunks = split_document(doc, max_tokens=200)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("# 接口说明\n## 签名") for chunk in chunks)
+    assert all(estimate_tokens(chunk) <= 200 for chunk in chunks)
+
+
+def test_document_records_share_parent():
+    records = document_records("# 标题\n\n" + "很长的段落。" * 2000)
+    parent, chunks = records[0], records[1:]
+    assert parent['type'] == 'documentation' and parent['embed'] is False
+    assert chunks and all(r['type'] == DOC_CHUNK_TYPE and r['parent_id'] == parent['parent_id'] for r in chunks)
@@ -0,0 +1,57 @@
+import gc
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from cache import ColumnarFrame
+
+
+def make_df(rows=35):
+    return pd.DataFrame({
+        "id": range(rows),
+        "name": [f"name-{i}" for i in range(rows)],
+        "amount": [i * 1.5 for i in range(rows)],
+    })
+
+
+def test_slice_reads_only_requested_rows_and_columns(tmp_path):
+    df = make_df()
+    frame = ColumnarFrame(df, row_group_size=10, spill_dir=str(tmp_path))
+    assert not frame.spilled
+    assert len(frame) == 35 and frame.columns == ["id", "name", "amount"]
+
+    # 跨越两个row group
+    page = frame.slice(15, 10)
+    assert list(page.index) == list(range(15, 25))
+    pd.testing.assert_frame_equal(page, df.iloc[15:25])
+
+    assert list(frame.slice(30, 100, columns=["name"]).columns) == ["name"]
+    assert len(frame.slice(30, 100)) == 5
+    assert frame.slice(40, 10).empty and list(frame.slice(40, 10).columns) == ["id", "name", "amount"]
+    pd.testing.assert_frame_equal(frame.head(3), df.head(3))
+    pd.testing.assert_frame_equal(frame.to_pandas(), df)
+    pd.testing.assert_frame_equal(pd.concat(frame.iter_batches(batch_size=8)), df)
+    assert dict(frame.dtypes) == dict(df.dtypes)
+
+
+def test_large_result_spills_to_disk_and_file_is_removed(tmp_path):
+    df = make_df(1000)
+    frame = ColumnarFrame(df, row_group_size=100, spill_bytes=0, spill_dir=str(tmp_path))
+    assert frame.spilled
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and frame.nbytes == os.path.getsize(tmp_path / files[0])
+
+    pd.testing.assert_frame_equal(frame.slice(250, 100), df.iloc[250:350])
+    pd.testing.assert_frame_equal(pq.read_table(tmp_path / files[0]).to_pandas(), df)
+
+    del frame
+    gc.collect()
+    assert os.listdir(tmp_path) == []
+
+
+def test_falls_back_to_dataframe_when_arrow_conversion_fails(tmp_path):
+    df = pd.DataFrame({"mixed": [1, "a", 2.5]})
+    frame = ColumnarFrame(df, spill_bytes=0, spill_dir=str(tmp_path))
+    assert not frame.spilled and os.listdir(tmp_path) == []
+    pd.testing.assert_frame_equal(frame.slice(1, 2), df.iloc[1:3])
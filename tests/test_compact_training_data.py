@@ -0,0 +1,50 @@
+import numpy as np
+
+from compact_training_data import assign_keepers, find_clusters
+
+
+def chain(n, step):
+    """单位向量链：相邻两行的夹角为 step，两端相距 (n-1)*step"""
+    angles = np.arange(n) * step
+    return np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+
+
+def deleted(vectors, threshold, keep='oldest'):
+    ids = list(range(len(vectors)))
+    contents = [''] * len(vectors)
+    groups = []
+    for members in find_clusters(vectors, threshold, block_size=3):
+        groups.extend(assign_keepers(members, vectors, threshold, ids, contents, keep))
+    return groups
+
+
+def test_chained_rows_are_not_deleted_through_neighbours():
+    # 相邻行相似度0.98，两端 cos(9*0.2) ≈ -0.23
+    vectors = chain(10, 0.2)
+    assert np.isclose(vectors[0] @ vectors[1], 0.98, atol=0.001)
+    assert vectors[0] @ vectors[-1] < 0
+
+    groups = deleted(vectors, 0.97)
+    removed = [i for _, rows in groups for i in rows]
+    keepers = {keeper for keeper, _ in groups}
+
+    # 每个被删除的行都与其保留行直接相似
+    for keeper, rows in groups:
+        for i in rows:
+            assert vectors[i] @ vectors[keeper] >= 0.97
+    # 链上的行不会被全部删除，只删除了与保留行直接相似的一半
+    assert len(removed) == 5
+    assert not keepers & set(removed)
+
+
+def test_three_row_chain_keeps_far_end():
+    vectors = chain(3, 0.2)
+    groups = deleted(vectors, 0.97)
+    assert groups == [(0, [1])]
+
+
+def test_exact_duplicates_collapse_to_one_keeper():
+    base = np.eye(4, dtype=np.float32)
+    vectors = np.concatenate([base, base[:1], base[:1]])
+    assert deleted(vectors, 0.97) == [(0, [4, 5])]
+    assert deleted(vectors, 0.97, keep='newest') == [(5, [4, 0])]
@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+import pytest
+
+import app as server
+from cache import ColumnarFrame, MemoryCache
+
+GENERATED = {
+    "total sales": "SELECT sum(amount) FROM sales",
+    "sales by region": "SELECT region, sum(amount) FROM sales GROUP BY region",
+}
+RESULTS = {
+    "SELECT sum(amount) FROM sales": pd.DataFrame({"sum": [30]}),
+    "SELECT region, sum(amount) FROM sales GROUP BY region": pd.DataFrame({"region": ["n", "s"], "sum": [10, 20]}),
+    "SELECT region, sum(amount) AS total FROM sales GROUP BY 1 ORDER BY 2 DESC":
+        pd.DataFrame({"r": ["s", "n"], "total": [20, 10]}),
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    embedded = []
+
+    def generate_embeddings(texts):
+        embedded.append(list(texts))
+        return [[float(i)] for i in range(len(texts))]
+
+    def generate_sql(question, allow_llm_to_see_data, embedding):
+        if question not in GENERATED:
+            raise RuntimeError(f"no sql for {question}")
+        # 每个问题使用批量生成的、与自己对应的向量
+        assert embedding == [float(list(GENERATED).index(question))]
+        return GENERATED[question]
+
+    def execute_sql(sql, use_cache=True, **kwargs):
+        return ColumnarFrame(RESULTS[sql]), False
+
+    monkeypatch.setattr(server.vn, 'generate_embeddings', generate_embeddings, raising=False)
+    monkeypatch.setattr(server.vn, 'generate_sql', generate_sql, raising=False)
+    monkeypatch.setattr(server, 'execute_sql', execute_sql)
+    monkeypatch.setattr(server, 'cache', MemoryCache())
+    client = server.app.test_client()
+    client.embedded = embedded
+    return client
+
+
+def post(client, body):
+    response = client.post('/api/v0/generate_sql_batch', json=body)
+    return response, [json.loads(line) for line in response.data.splitlines()]
+
+
+def test_streams_one_line_per_question_and_summary(client):
+    response, lines = post(client, {
+        "questions": [
+            "total sales",
+            {"question": "sales by region",
+             "expected_sql": "SELECT region, sum(amount) AS total FROM sales GROUP BY 1 ORDER BY 2 DESC"},
+            "unknown question",
+        ],
+        "execute": True,
+        "concurrency": 2,
+    })
+
+    assert response.mimetype == 'application/x-ndjson'
+    # 所有问题的向量一次生成
+    assert client.embedded == [["total sales", "sales by region", "unknown question"]]
+
+    results = {line['index']: line for line in lines[:-1]}
+    assert sorted(results) == [0, 1, 2]
+    assert results[0]['sql'] == GENERATED["total sales"] and results[0]['row_count'] == 1
+    # 列名和行顺序不同，结果相同
+    assert results[1]['exact_match'] is False and results[1]['result_match'] is True
+    assert 'error' in results[2] and 'total_ms' in results[2]['timings']
+    assert server.cache.get(id=results[0]['id'], field='sql') == GENERATED["total sales"]
+
+    summary = lines[-1]
+    assert summary['type'] == 'batch_summary'
+    assert (summary['count'], summary['errors'], summary['exact_match'], summary['result_match']) == (3, 1, 0, 1)
+
+
+def test_rejects_invalid_requests(client):
+    for body in [{}, {"questions": []}, {"questions": [{"expected_sql": "SELECT 1"}]},
+                 {"questions": ["total sales"], "concurrency": "many"}]:
+        _, lines = post(client, body)
+        assert lines[0]['type'] == 'error'
+    assert client.embedded == []
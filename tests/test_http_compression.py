@@ -0,0 +1,58 @@
+import gzip
+import json
+
+from flask import Flask, jsonify
+
+from http_compression import IMMUTABLE_CACHE_CONTROL, compress_response, serve_static_asset
+
+
+def make_app(static_folder):
+    app = Flask(__name__, static_folder=str(static_folder))
+    app.after_request(compress_response)
+
+    @app.route('/big')
+    def big():
+        response = jsonify({"rows": ["x" * 10] * 500})
+        response.headers['Vary'] = 'Origin'
+        return response
+
+    @app.route('/small')
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route('/assets/<path:filename>')
+    def assets(filename):
+        return serve_static_asset(app, filename)
+
+    return app
+
+
+def test_api_response_is_gzipped_and_vary_is_appended(tmp_path):
+    client = make_app(tmp_path).test_client()
+
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data))["rows"][0] == "x" * 10
+    assert set(response.headers['Vary'].split(', ')) == {'Origin', 'Accept-Encoding'}
+
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/big').headers
+
+
+def test_precompressed_static_asset(tmp_path):
+    assets = tmp_path / 'assets'
+    assets.mkdir()
+    body = b"console.log('hello');" * 100
+    (assets / 'index-d29524f4.js').write_bytes(body)
+    (assets / 'index-d29524f4.js.gz').write_bytes(gzip.compress(body))
+    client = make_app(tmp_path).test_client()
+
+    response = client.get('/assets/index-d29524f4.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == body
+
+    response = client.get('/assets/index-d29524f4.js')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == body
@@ -0,0 +1,96 @@
+import time
+
+from chunking import DOC_CHUNK_TYPE, document_records
+from ingest_queue import PENDING, PROCESSING, SUCCEEDED, IngestQueue, InvalidItem
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while queue.get(job_id)['pending'] and time.time() < deadline:
+        time.sleep(0.05)
+    return queue.get(job_id)
+
+
+def test_long_documentation_is_written_as_parent_and_chunks(tmp_path):
+    embedded, inserted = [], []
+
+    def embed_batch(texts):
+        embedded.extend(texts)
+        return [[1.0] for _ in texts]
+
+    def insert_batch(rows):
+        start = len(inserted)
+        inserted.extend(rows)
+        return [str(start + i) for i in range(len(rows))]
+
+    def to_records(item):
+        if 'documentation' in item:
+            return document_records(item['documentation'])
+        return [{'type': 'ddl', 'content': item['ddl']}]
+
+    queue = IngestQueue(str(tmp_path / 'queue.db'), to_records=to_records, embed_batch=embed_batch,
+                        insert_batch=insert_batch, workers=1, poll_interval=0.05)
+    try:
+        job_id = queue.submit([{'documentation': "# 标题\n\n" + "很长的段落。" * 2000},
+                               {'ddl': "CREATE TABLE t (id INT)"}])
+        deadline = time.time() + 5
+        while queue.get(job_id)['status'] != SUCCEEDED and time.time() < deadline:
+            time.sleep(0.05)
+        job = queue.get(job_id)
+    finally:
+        queue.shutdown()
+
+    assert job['status'] == SUCCEEDED
+    parent = inserted[0]
+    chunks = [row for row in inserted if row['type'] == DOC_CHUNK_TYPE]
+    assert parent['type'] == 'documentation' and parent['embedding'] is None
+    assert len(chunks) > 1 and all(row['parent_id'] == parent['parent_id'] for row in chunks)
+    assert parent['content'] not in embedded
+    # 每个条目的 row_id 是它的第一行：文档为父行，DDL在所有块之后
+    assert job['ids'] == ['0', str(len(inserted) - 1)]
+
+
+def test_transient_to_records_error_is_retried_and_invalid_item_fails(tmp_path):
+    calls = []
+
+    def to_records(item):
+        if 'ddl' not in item:
+            raise InvalidItem("条目需要包含 ddl")
+        calls.append(item['ddl'])
+        if len(calls) == 1:
+            raise ConnectionError("LLM暂时不可用")
+        return [{'type': 'ddl', 'content': item['ddl']}]
+
+    queue = IngestQueue(str(tmp_path / 'queue.db'), to_records=to_records,
+                        embed_batch=lambda texts: [[1.0] for _ in texts],
+                        insert_batch=lambda rows: [str(i) for i in range(len(rows))],
+                        workers=1, poll_interval=0.05)
+    try:
+        job = wait_finished(queue, queue.submit([{'ddl': "CREATE TABLE t (id INT)"}, {'question': "?"}]))
+    finally:
+        queue.shutdown()
+
+    assert job['done'] == 1 and job['failed'] == 1
+    assert len(calls) == 2
+    assert job['errors'] == [{'position': 1, 'error': "条目需要包含 ddl"}]
+
+
+def test_only_expired_processing_items_are_reclaimed(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    first = IngestQueue(path, to_records=lambda item: [], embed_batch=lambda texts: [],
+                        insert_batch=lambda rows: [], workers=0, lease_timeout=60)
+    job_id = first.submit([{'ddl': "a"}, {'ddl': "b"}])
+    now = time.time()
+    # 第一个条目由已退出的进程处理，第二个条目由仍在运行的进程处理
+    with first.lock:
+        first.conn.execute("UPDATE ingest_items SET status = ?, updated_at = ? WHERE position = 0",
+                           (PROCESSING, now - 120))
+        first.conn.execute("UPDATE ingest_items SET status = ?, updated_at = ? WHERE position = 1",
+                           (PROCESSING, now))
+
+    second = IngestQueue(path, to_records=lambda item: [], embed_batch=lambda texts: [],
+                         insert_batch=lambda rows: [], workers=0, lease_timeout=60)
+    with second.lock:
+        statuses = [status for status, in second.conn.execute(
+            "SELECT status FROM ingest_items WHERE job_id = ? ORDER BY position", (job_id,))]
+    assert statuses == [PENDING, PROCESSING]
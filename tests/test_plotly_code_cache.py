@@ -0,0 +1,65 @@
+import json
+
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+import app as server
+from cache import ColumnarFrame, PlotlyCodeCache
+
+# LLM生成的代码常用 pd；title 读取第二行，只有一行数据时执行失败
+PLOTLY_CODE = "fig = px.bar(df, x='region', y=pd.to_numeric(df['total']), title=df['region'].iloc[1])"
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = {'generate': 0, 'fallback': 0}
+
+    def generate_plotly_code(question, sql, df_metadata):
+        calls['generate'] += 1
+        return PLOTLY_CODE
+
+    def get_plotly_figure(plotly_code, df, dark_mode):
+        calls['fallback'] += 1
+        return go.Figure()
+
+    monkeypatch.setattr(server.vn, 'generate_plotly_code', generate_plotly_code, raising=False)
+    monkeypatch.setattr(server.vn, 'get_plotly_figure', get_plotly_figure, raising=False)
+    monkeypatch.setattr(server, 'plotly_code_cache', PlotlyCodeCache())
+    return calls
+
+
+def frame(regions, totals=None):
+    totals = totals if totals is not None else list(range(len(regions)))
+    return ColumnarFrame(pd.DataFrame({"region": regions, "total": totals}))
+
+
+def figure(sql, df):
+    return json.loads(server.build_plotly_figure('id', "sales by region", sql, df))
+
+
+def test_validated_code_is_reused_for_same_sql_and_schema(llm):
+    figure("SELECT region, sum(x) AS total FROM t GROUP BY 1", frame(["north", "south"]))
+    assert llm['generate'] == 1 and server.plotly_code_cache.get_stats()['entries'] == 1
+
+    # 空白和大小写不同的相同SQL，新的数据
+    fig = figure("select region,  SUM(x) as total from t group by 1", frame(["east", "west", "north"]))
+    assert llm['generate'] == 1 and llm['fallback'] == 0
+    assert fig['data'][0]['x'] == ["east", "west", "north"]
+    assert server.plotly_code_cache.get_stats()['hits'] == 1
+
+    # 列类型不同时重新生成
+    figure("SELECT region, sum(x) AS total FROM t GROUP BY 1", frame(["north", "south"], [1.5, 2.5]))
+    assert llm['generate'] == 2
+
+
+def test_failing_cached_code_is_invalidated_and_falls_back(llm):
+    sql = "SELECT region, sum(x) AS total FROM t GROUP BY 1"
+    figure(sql, frame(["north", "south"]))
+
+    figure(sql, frame(["north"]))
+    assert llm == {'generate': 1, 'fallback': 1}
+    assert server.plotly_code_cache.get_stats()['invalidations'] == 1
+
+    figure(sql, frame(["north", "south"]))
+    assert llm['generate'] == 2
@@ -0,0 +1,36 @@
+import threading
+
+from cache import MemoryCache
+from precompute import Precomputer
+
+
+def test_value_is_cached_before_future_is_removed():
+    cache = MemoryCache()
+    precomputer = Precomputer(cache, max_workers=1)
+    release = threading.Event()
+    precomputer.submit('q1', 'fig', lambda: release.wait(5) and 'figure')
+    release.set()
+    assert precomputer.wait(id='q1', field='fig') == 'figure'
+    precomputer.executor.shutdown(wait=True)
+    assert cache.get(id='q1', field='fig') == 'figure'
+    assert precomputer.get_stats()['in_flight'] == 0
+
+
+def test_superseded_computation_does_not_overwrite():
+    cache = MemoryCache()
+    precomputer = Precomputer(cache, max_workers=2)
+    old_started = threading.Event()
+    release_old = threading.Event()
+
+    def old():
+        old_started.set()
+        release_old.wait(5)
+        return 'old'
+
+    precomputer.submit('q1', 'fig', old)
+    old_started.wait(5)
+    precomputer.submit('q1', 'fig', lambda: 'new')
+    assert precomputer.wait(id='q1', field='fig') == 'new'
+    release_old.set()
+    precomputer.executor.shutdown(wait=True)
+    assert cache.get(id='q1', field='fig') == 'new'
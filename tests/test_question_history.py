@@ -0,0 +1,64 @@
+import pytest
+
+import app as server
+from cache import MemoryCache
+
+
+def add_questions(cache, questions):
+    ids = []
+    for question in questions:
+        id = cache.generate_id(question=question)
+        cache.set(id=id, field='question', value=question)
+        ids.append(id)
+    return ids
+
+
+def test_pages_newest_first_and_skips_deleted():
+    cache = MemoryCache()
+    ids = add_questions(cache, [f"question {i}" for i in range(5)])
+    cache.delete(ids[3])
+    # 再次设置问题只更新索引项，不改变顺序
+    cache.set(id=ids[1], field='question', value="Question 1 edited")
+
+    page, cursor = cache.get_question_page(limit=2)
+    assert [q['question'] for q in page] == ["question 4", "question 2"]
+    page, cursor = cache.get_question_page(limit=2, cursor=cursor)
+    assert [q['question'] for q in page] == ["Question 1 edited", "question 0"]
+    assert cursor is None
+    assert cache.question_count == 4
+
+
+def test_search_is_case_insensitive_substring_or_prefix():
+    cache = MemoryCache()
+    add_questions(cache, ["Total sales by region", "Top customers by sales", "Orders per day"])
+
+    page, _ = cache.get_question_page(limit=10, search="SALES")
+    assert [q['question'] for q in page] == ["Top customers by sales", "Total sales by region"]
+    page, _ = cache.get_question_page(limit=10, search="to", prefix=True)
+    assert [q['question'] for q in page] == ["Top customers by sales", "Total sales by region"]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'cache', MemoryCache())
+    return server.app.test_client()
+
+
+def test_history_endpoint_follows_next_cursor(client):
+    add_questions(server.cache, [f"question {i}" for i in range(5)])
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+        body = client.get('/api/v0/get_question_history', query_string=params).get_json()
+        assert body['type'] == 'question_history' and body['total'] == 5
+        seen += [q['question'] for q in body['questions']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [f"question {i}" for i in reversed(range(5))]
+
+    body = client.get('/api/v0/get_question_history', query_string={'q': 'question 3'}).get_json()
+    assert [q['question'] for q in body['questions']] == ["question 3"]
+    assert client.get('/api/v0/get_question_history', query_string={'cursor': 'x'}).get_json()['type'] == 'error'
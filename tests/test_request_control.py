@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from request_control import AdmissionLimit, Overloaded, SingleFlight
+
+
+def test_async_waiters_do_not_use_threads():
+    limit = AdmissionLimit('test', max_concurrent=1, max_waiting=50, wait_timeout=5)
+    threads_before = threading.active_count()
+    order = []
+
+    async def worker(i):
+        async with limit.aslot():
+            order.append(i)
+            await asyncio.sleep(0.001)
+
+    async def main():
+        tasks = [asyncio.create_task(worker(i)) for i in range(20)]
+        await asyncio.sleep(0.001)
+        assert threading.active_count() == threads_before
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert sorted(order) == list(range(20))
+    stats = limit.get_stats()
+    assert stats['active'] == 0 and stats['waiting'] == 0
+
+
+def test_async_wait_timeout_and_queue_full():
+    limit = AdmissionLimit('test', max_concurrent=1, max_waiting=1, wait_timeout=0.05)
+
+    async def main():
+        await limit.aacquire()
+        waiter = asyncio.create_task(limit.aacquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as rejected:
+            await limit.aacquire()
+        assert rejected.value.status == 429
+        with pytest.raises(Overloaded) as timed_out:
+            await waiter
+        assert timed_out.value.status == 503
+        limit.release()
+
+    asyncio.run(main())
+    assert limit.get_stats()['active'] == 0
+
+
+def test_cancelled_async_waiter_returns_slot():
+    limit = AdmissionLimit('test', max_concurrent=1, max_waiting=5, wait_timeout=5)
+
+    async def main():
+        await limit.aacquire()
+        waiter = asyncio.create_task(limit.aacquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limit.release()
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    stats = limit.get_stats()
+    assert stats['active'] == 0 and stats['waiting'] == 0
+
+
+def test_release_from_thread_wakes_async_waiter():
+    limit = AdmissionLimit('test', max_concurrent=1, max_waiting=5, wait_timeout=5)
+    limit.acquire()
+
+    async def main():
+        threading.Timer(0.05, limit.release).start()
+        start = time.monotonic()
+        async with limit.aslot():
+            return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.04
+    assert limit.get_stats()['active'] == 0
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * 2
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', compute, 21)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', compute, 21))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.get_stats()['coalesced'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == [42] * 4 and calls == [21]
+    assert flight.get_stats() == {'executed': 1, 'coalesced': 3, 'failed': 0, 'in_flight': 0}
+
+
+def test_single_flight_async_leader_cancel_does_not_cancel_followers():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'sql'
+
+    async def main():
+        leader = asyncio.create_task(flight.ado('k', compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.ado('k', compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await follower == 'sql'
+
+    asyncio.run(main())
+    assert calls == [1]
+    assert flight.get_stats() == {'executed': 1, 'coalesced': 1, 'failed': 0, 'in_flight': 0}
+
+
+def test_single_flight_async_cancelled_when_all_waiters_leave():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def compute():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        waiters = [asyncio.create_task(flight.ado('k', compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert flight.get_stats()['in_flight'] == 0
+
+
+def test_single_flight_async_shares_exception():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError('bad question')
+
+    async def main():
+        return await asyncio.gather(flight.ado('k', compute), flight.ado('k', compute), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(e) for e in results] == [ValueError, ValueError]
+    assert flight.get_stats()['failed'] == 1
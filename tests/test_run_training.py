@@ -0,0 +1,36 @@
+import sys
+import types
+
+import run_training
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_dry_run_does_not_import_trainer(tmp_path, monkeypatch):
+    monkeypatch.delitem(sys.modules, 'vanna_trainer', raising=False)
+    files = [
+        (write(tmp_path / 'a.sql', "CREATE TABLE a (id INT);\nCREATE TABLE b (id INT);\n"), 'ddl'),
+        (write(tmp_path / 'q.txt', "问题一::SELECT 1\n问题二::SELECT 2\n"), 'qs_colon'),
+    ]
+    stats, trainer = run_training.ingest_files(files, workers=2, dry_run=True, progress_interval=0)
+    assert trainer is None
+    assert 'vanna_trainer' not in sys.modules
+    assert sum(stats[files[0][0]]['blocks'].values()) == 2
+    assert sum(stats[files[1][0]]['blocks'].values()) == 2
+
+
+def test_trainer_receives_checkpointed_blocks(tmp_path):
+    calls = []
+    trainer = types.SimpleNamespace(
+        completed_blocks=lambda file_hash: {1},
+        train_ddl=lambda ddl, checkpoint: calls.append((ddl, checkpoint[1])),
+        training_progress=lambda: None,
+    )
+    path = write(tmp_path / 'a.sql', "CREATE TABLE a (id INT);\nCREATE TABLE b (id INT);\n")
+    stats, used = run_training.ingest_files([(path, 'ddl')], workers=0, progress_interval=0, trainer=trainer)
+    assert used is trainer
+    assert [idx for _, idx in calls] == [2]
+    assert stats[path]['skipped'] == 1
@@ -0,0 +1,70 @@
+import threading
+
+from sql_jobs import CANCELLED, SUCCEEDED, SqlJobManager
+
+
+class FakeConn:
+    def get_backend_pid(self):
+        return None
+
+
+def wait(job):
+    job.future.result(timeout=5)
+
+
+def test_cancel_between_fetches_stops_job():
+    fetched = threading.Event()
+    resume = threading.Event()
+
+    def runner(job, on_connect, on_progress):
+        on_connect(FakeConn())
+        rows = 0
+        for _ in range(10):
+            rows += 100
+            on_progress(rows)
+            fetched.set()
+            resume.wait(5)
+        return rows
+
+    manager = SqlJobManager(runner, max_workers=1)
+    job = manager.submit("SELECT 1", 1000)
+    fetched.wait(5)
+    assert manager.cancel(job.id)
+    resume.set()
+    wait(job)
+    assert job.status == CANCELLED
+    assert job.result is None
+    # 读完下一块后中止
+    assert job.rows == 200
+    manager.shutdown()
+
+
+def test_cancel_after_runner_returns_marks_cancelled():
+    returning = threading.Event()
+    proceed = threading.Event()
+
+    def runner(job, on_connect, on_progress):
+        returning.set()
+        proceed.wait(5)
+        return 'result'
+
+    successes = []
+    manager = SqlJobManager(runner, max_workers=1)
+    job = manager.submit("SELECT 1", 1000, on_success=successes.append)
+    returning.wait(5)
+    assert manager.cancel(job.id)
+    proceed.set()
+    wait(job)
+    assert job.status == CANCELLED
+    assert successes == []
+    manager.shutdown()
+
+
+def test_finished_job_cannot_be_cancelled():
+    manager = SqlJobManager(lambda job, on_connect, on_progress: 'ok', max_workers=1)
+    job = manager.submit("SELECT 1", 1000)
+    wait(job)
+    assert job.status == SUCCEEDED
+    assert job.result == 'ok'
+    assert not manager.cancel(job.id)
+    manager.shutdown()
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+import sql_runner
+
+
+@pytest.fixture
+def fake_chunks(monkeypatch):
+    """代替 iter_sql_chunks：共 total 行，每块 chunk_size 行，记录读取的行数和游标是否关闭"""
+    state = {'total': 0, 'fetched': 0, 'closed': False, 'limit': None}
+
+    def iter_sql_chunks(sql, chunk_size, limit=None, **kwargs):
+        state['limit'] = limit
+        end = state['total'] if limit is None else min(state['total'], limit)
+        try:
+            for start in range(0, end, chunk_size):
+                stop = min(start + chunk_size, end)
+                state['fetched'] = stop
+                yield pd.DataFrame({"id": range(start, stop), "name": ["x" * 20] * (stop - start)},
+                                   index=pd.RangeIndex(start, stop))
+        finally:
+            state['closed'] = True
+
+    monkeypatch.setattr(sql_runner, 'iter_sql_chunks', iter_sql_chunks)
+    return state
+
+
+def test_row_cap_truncates_and_closes_cursor(fake_chunks):
+    fake_chunks['total'] = 1000
+    df, truncated = sql_runner.run_sql_capped("SELECT 1", max_rows=25, max_bytes=10 ** 9, chunk_size=10)
+
+    assert truncated and len(df) == 25 and list(df['id']) == list(range(25))
+    # 只多读一行用来判断是否截断
+    assert fake_chunks['limit'] == 26 and fake_chunks['fetched'] == 26
+    assert fake_chunks['closed']
+
+
+def test_result_at_row_cap_is_not_truncated(fake_chunks):
+    fake_chunks['total'] = 25
+    df, truncated = sql_runner.run_sql_capped("SELECT 1", max_rows=25, max_bytes=10 ** 9, chunk_size=10)
+    assert not truncated and len(df) == 25
+
+
+def test_byte_cap_keeps_rows_that_fit(fake_chunks):
+    fake_chunks['total'] = 1000
+    chunk = pd.DataFrame({"id": range(10), "name": ["x" * 20] * 10})
+    chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+
+    df, truncated = sql_runner.run_sql_capped("SELECT 1", max_rows=1000, max_bytes=int(chunk_bytes * 2.5),
+                                              chunk_size=10)
+    assert truncated and 20 <= len(df) < 30
+    assert int(df.memory_usage(deep=True).sum()) <= chunk_bytes * 2.5
+    assert fake_chunks['fetched'] == 30 and fake_chunks['closed']
+
+
+def test_empty_result_keeps_columns(monkeypatch):
+    def iter_sql_chunks(sql, chunk_size, limit=None, **kwargs):
+        yield pd.DataFrame(columns=["id"])
+
+    monkeypatch.setattr(sql_runner, 'iter_sql_chunks', iter_sql_chunks)
+    df, truncated = sql_runner.run_sql_capped("SELECT 1 WHERE false")
+    assert not truncated and df.empty and list(df.columns) == ["id"]
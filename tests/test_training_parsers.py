@@ -0,0 +1,18 @@
+from training_parsers import PARSER_VERSION, checkpoint_key, file_sha256, parse_file_messages
+
+
+def test_checkpoint_key_includes_parser_version_and_type(tmp_path):
+    path = tmp_path / 'a.sql'
+    path.write_text("CREATE TABLE a (id INT);\n", encoding='utf-8')
+    key = checkpoint_key(str(path), 'ddl')
+    assert key == f"{file_sha256(str(path))}:v{PARSER_VERSION}:ddl"
+    assert key != file_sha256(str(path))
+    assert key != checkpoint_key(str(path), 'sql')
+
+
+def test_start_message_carries_checkpoint_key(tmp_path):
+    path = tmp_path / 'a.sql'
+    path.write_text("CREATE TABLE a (id INT);\n", encoding='utf-8')
+    messages = list(parse_file_messages(str(path), 'ddl'))
+    assert messages[0] == ('start', str(path), checkpoint_key(str(path), 'ddl'))
+    assert messages[-1] == ('done', str(path), 1)
@@ -0,0 +1,216 @@
+# compact_training_data.py
+"""
+训练数据去重压缩
+
+中英文重复的训练文件、多次导入同一文件会产生大量几乎相同的行，既占空间，
+又会让 get_similar_question_sql 返回同一个示例的多个副本。
+本工具用库中已存的向量分块计算余弦相似度（每次只计算一块行与其后所有行的相似度，内存可控），
+相似度不低于阈值的行先连成候选簇，簇内按保留顺序依次选出保留行，只删除与保留行本身相似度不低于阈值的行——
+只通过中间行间接相连的行不会被删除。
+
+默认只输出报告，加 --apply 才删除。长文档的父行和块（parent_id 不为空）不参与去重。
+
+用法:
+    python tools/compact_training_data.py                          # 报告 question_sql 中的近似重复
+    python tools/compact_training_data.py --threshold 0.95 --types question_sql ddl --report clusters.json
+    python tools/compact_training_data.py --apply                  # 删除重复行
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+COMPACTABLE_TYPES = ('question_sql', 'ddl', 'documentation', 'sql')
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.environ.get('PGVECTOR_HOST', '127.0.0.1'),
+        port=int(os.environ.get('PGVECTOR_PORT', 5432)),
+        dbname=os.environ.get('PGVECTOR_DB', 'pgvector_store'),
+        user=os.environ.get('PGVECTOR_USER', 'postgres'),
+        password=os.environ.get('PGVECTOR_PASSWORD', 'postgres'),
+    )
+
+
+def load_rows(conn, table, data_type, fetch_size=5000):
+    """读取某类型的所有行，返回 (ids, contents, 归一化后的向量矩阵)"""
+    ids, contents, vectors = [], [], []
+    # 服务端游标分批读取，不一次性把整表放进客户端内存
+    with conn.cursor(name=f"compact_{data_type}") as cur:
+        cur.itersize = fetch_size
+        cur.execute(
+            f"SELECT id, content, embedding::text FROM {table} "
+            f"WHERE type = %s AND embedding IS NOT NULL AND parent_id IS NULL ORDER BY id",
+            (data_type,),
+        )
+        for row_id, content, embedding in cur:
+            ids.append(row_id)
+            contents.append(content)
+            vectors.append(np.array(embedding.strip('[]').split(','), dtype=np.float32))
+    conn.commit()
+
+    if not vectors:
+        return ids, contents, np.zeros((0, 0), dtype=np.float32)
+    matrix = np.stack(vectors)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return ids, contents, matrix / np.where(norms == 0, 1, norms)
+
+
+def find_clusters(vectors, threshold, block_size=1024):
+    """
+    分块计算余弦相似度，把相似度不低于 threshold 的行（传递地）合并为候选簇，
+    返回包含两行以上的簇（行下标列表）；簇内的行不一定两两相似，删除前由 assign_keepers 再分组
+    """
+    parent = list(range(len(vectors)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        # 只与自身及其后的行比较，每对只计算一次
+        similarity = block @ vectors[start:].T
+        rows, cols = np.nonzero(similarity >= threshold)
+        for row, col in zip(rows, cols):
+            i, j = start + int(row), start + int(col)
+            if i < j:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for i in range(len(vectors)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def keeper_order(members, ids, contents, keep):
+    """按保留优先级排序：oldest（id最小）、newest（id最大）或 longest（内容最长）"""
+    if keep == 'newest':
+        return sorted(members, key=lambda i: -ids[i])
+    if keep == 'longest':
+        return sorted(members, key=lambda i: (-len(contents[i]), ids[i]))
+    return sorted(members, key=lambda i: ids[i])
+
+
+def assign_keepers(members, vectors, threshold, ids, contents, keep):
+    """
+    把候选簇分成若干组，返回 [(保留行, [删除行...])]，只包含有删除行的组
+
+    按保留优先级取出尚未分配的第一行作为保留行，与它相似度不低于 threshold 的行归入该组删除，
+    其余行继续分配，因此每个被删除的行都与其保留行直接相似
+    """
+    remaining = keeper_order(members, ids, contents, keep)
+    groups = []
+    while remaining:
+        keeper, rest = remaining[0], remaining[1:]
+        similarity = vectors[rest] @ vectors[keeper] if rest else np.zeros(0)
+        removed = [i for i, sim in zip(rest, similarity) if sim >= threshold]
+        if removed:
+            groups.append((keeper, removed))
+        removed_set = set(removed)
+        remaining = [i for i in rest if i not in removed_set]
+    return groups
+
+
+def delete_rows(conn, table, row_ids, chunk_size=1000):
+    """在一个事务中批量删除"""
+    try:
+        with conn.cursor() as cur:
+            for start in range(0, len(row_ids), chunk_size):
+                cur.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", (row_ids[start:start + chunk_size],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def compact(table, types, threshold, keep='oldest', block_size=1024, apply=False, show=10):
+    """查找并（apply=True 时）删除近似重复的行，返回报告"""
+    conn = connect()
+    report = {"table": table, "threshold": threshold, "keep": keep, "applied": apply, "types": {}}
+    to_delete = []
+
+    try:
+        with conn.cursor() as cur:
+            # 与 PgVectorStore._init_table 一致，兼容尚未升级的表
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS parent_id TEXT")
+        conn.commit()
+
+        for data_type in types:
+            start = time.time()
+            ids, contents, vectors = load_rows(conn, table, data_type)
+            clusters = find_clusters(vectors, threshold, block_size) if len(ids) > 1 else []
+
+            entries = []
+            for members in clusters:
+                for keeper, removed in assign_keepers(members, vectors, threshold, ids, contents, keep):
+                    to_delete.extend(ids[i] for i in removed)
+                    entries.append({
+                        "keep": ids[keeper],
+                        "remove": [ids[i] for i in removed],
+                        "keep_preview": contents[keeper][:120],
+                        "previews": [contents[i][:120] for i in removed][:5],
+                    })
+            entries.sort(key=lambda entry: len(entry["remove"]), reverse=True)
+
+            duplicates = sum(len(entry["remove"]) for entry in entries)
+            report["types"][data_type] = {"rows": len(ids), "clusters": len(entries),
+                                          "duplicates": duplicates, "clusters_detail": entries}
+            print(f"📊 {data_type}: {len(ids)} 行，{len(entries)} 个重复簇，可删除 {duplicates} 行"
+                  f"（耗时 {time.time() - start:.1f} 秒）")
+            for entry in entries[:show]:
+                print(f"   保留 #{entry['keep']}: {entry['keep_preview'][:80]!r}")
+                print(f"   删除 {len(entry['remove'])} 行: {entry['remove'][:10]}"
+                      f"{' ...' if len(entry['remove']) > 10 else ''}")
+
+        report["deleted"] = 0
+        if apply and to_delete:
+            delete_rows(conn, table, to_delete)
+            report["deleted"] = len(to_delete)
+            print(f"✅ 已删除 {len(to_delete)} 行重复数据；运行中的应用需重启，依赖训练数据的缓存才会失效")
+        elif to_delete:
+            print(f"⚠️ 试运行：共 {len(to_delete)} 行可删除，加 --apply 执行删除")
+        else:
+            print("✅ 没有发现近似重复的训练数据")
+    finally:
+        conn.close()
+    return report
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='训练数据近似重复检测与压缩')
+    parser.add_argument('--table', default=os.environ.get('PGVECTOR_TABLE', 'vanna_pgvector'))
+    parser.add_argument('--types', nargs='+', choices=COMPACTABLE_TYPES, default=['question_sql'],
+                        help='参与去重的数据类型 (默认: question_sql)')
+    parser.add_argument('--threshold', type=float, default=0.97, help='视为重复的余弦相似度下限 (默认: 0.97)')
+    parser.add_argument('--keep', choices=('oldest', 'newest', 'longest'), default='oldest',
+                        help='每个重复簇保留哪一行 (默认: oldest)')
+    parser.add_argument('--block-size', type=int, default=1024, help='每次计算相似度的行数，影响内存占用')
+    parser.add_argument('--show', type=int, default=10, help='每种类型输出的重复簇数')
+    parser.add_argument('--report', help='把完整的重复簇写入JSON文件')
+    parser.add_argument('--apply', action='store_true', help='删除重复行（默认只输出报告）')
+    args = parser.parse_args()
+
+    report = compact(args.table, args.types, args.threshold, args.keep, args.block_size, args.apply, args.show)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 报告已写入 {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# precompress_static.py
+"""
+预压缩静态资源
+为 static/ 下的 js/css/html/svg 文件生成 .gz（以及安装了brotli时的 .br）文件，
+应用在客户端支持时直接发送压缩版本
+"""
+
+import argparse
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.html', '.svg', '.json')
+
+DEFAULT_STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+
+def precompress_static(static_dir=DEFAULT_STATIC_DIR):
+    """压缩目录下所有可压缩文件，返回 (原始总字节数, gzip总字节数, brotli总字节数)"""
+    total = total_gz = total_br = 0
+
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            with open(path + '.gz', 'wb') as f:
+                f.write(gz)
+
+            line = f"{os.path.relpath(path, static_dir)}: {len(data)} -> gzip {len(gz)}"
+            total += len(data)
+            total_gz += len(gz)
+
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                with open(path + '.br', 'wb') as f:
+                    f.write(br)
+                line += f", br {len(br)}"
+                total_br += len(br)
+
+            print(f"✅ {line}")
+
+    return total, total_gz, total_br
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='预压缩静态资源')
+    parser.add_argument('--path', type=str, default=DEFAULT_STATIC_DIR,
+                        help='静态资源目录 (默认: 项目的 static 目录)')
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("⚠️ 未安装brotli，只生成gzip文件 (pip install brotli)")
+
+    total, total_gz, total_br = precompress_static(args.path)
+    if total == 0:
+        print("⚠️ 没有找到可压缩的文件")
+        return
+
+    print(f"\n传输字节数: 原始 {total} -> gzip {total_gz} ({total_gz / total:.1%})", end='')
+    if total_br:
+        print(f", br {total_br} ({total_br / total:.1%})")
+    else:
+        print()
+
+
+if __name__ == "__main__":
+    main()
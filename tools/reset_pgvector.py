@@ -55,6 +55,8 @@ def reset_pgvector_database():
         # 删除现有的表（如果存在）
         cursor.execute(f"DROP TABLE IF EXISTS {pgvector_table}")
         print(f"✅ 已删除现有表（如果存在）: {pgvector_table}")
+        # 训练检查点与数据一起清除，否则重新训练时会跳过已记录的文件
+        cursor.execute(f"DROP TABLE IF EXISTS {pgvector_table}_manifest")
         
         # 创建新表，使用1024维向量（适用于BGE-M3模型）
         cursor.execute(f"""
@@ -0,0 +1,329 @@
+# training_parsers.py
+"""
+训练文件的流式解析
+
+逐行（或按固定大小的块）读取文件，解析出一块就交给调用方，内存占用与文件大小无关；
+训练流水线的队列已满时 train_* 会阻塞，读取也随之暂停。
+
+本模块不依赖向量库和LLM，run_training.py 在子进程中用它并行解析多个文件。
+"""
+
+import hashlib
+import io
+import re
+
+# 普通状态下需要处理的记号：语句结束、字符串/标识符引号、美元引号、注释
+_SQL_SPECIAL = re.compile(r"[;'\"$]|--|/\*")
+_DOLLAR_TAG = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+_BLOCK_COMMENT = re.compile(r"/\*|\*/")
+# Markdown标题（#、##、###），####及更深的标题不作为分段
+_MARKDOWN_HEADER = re.compile(r"#{1,3}[^#]")
+
+def _is_identifier_char(char):
+    return char.isalnum() or char == '_'
+
+def _find_e_string_end(line, pos):
+    """E'...' 字符串中反斜杠是转义符，返回结束引号的位置"""
+    end = line.find("'", pos)
+    while end != -1:
+        backslashes = len(line[pos:end]) - len(line[pos:end].rstrip('\\'))
+        if backslashes % 2 == 0:
+            return end
+        end = line.find("'", end + 1)
+    return -1
+
+def iter_sql_statements(lines):
+    """按分号切分SQL语句，逐条返回
+
+    字符串（'...'、E'...'）、双引号标识符、-- 和 /* */ 注释（可嵌套）以及
+    $$/$tag$ 美元引号中的分号不会切分语句。只包含注释的片段会被忽略。
+
+    Args:
+        lines: 逐行产生文本的可迭代对象，例如打开的文件
+
+    Yields:
+        str: 去掉首尾空白、不含结尾分号的语句
+    """
+    buffer = []
+    has_code = False
+    close = None  # 当前所在的引号或注释的结束标记，None 表示普通状态
+    depth = 0     # 块注释嵌套深度
+
+    for line in lines:
+        pos = 0
+        while pos < len(line):
+            if close is None:
+                match = _SQL_SPECIAL.search(line, pos)
+                end = match.start() if match else len(line)
+                if line[pos:end].strip():
+                    has_code = True
+                if match is None:
+                    buffer.append(line[pos:])
+                    break
+
+                token = match.group()
+                if token == ';':
+                    buffer.append(line[pos:end])
+                    statement = ''.join(buffer).strip()
+                    if has_code and statement:
+                        yield statement
+                    buffer = []
+                    has_code = False
+                    pos = end + 1
+                    continue
+
+                if token == '$':
+                    tag = _DOLLAR_TAG.match(line, end)
+                    if tag is None or (end > 0 and _is_identifier_char(line[end - 1])):
+                        # $1 参数或标识符中的 $，不是美元引号
+                        buffer.append(line[pos:end + 1])
+                        has_code = True
+                        pos = end + 1
+                        continue
+                    close = tag.group()
+                    has_code = True
+                    buffer.append(line[pos:tag.end()])
+                    pos = tag.end()
+                    continue
+
+                if token == "'":
+                    escaped = end > 0 and line[end - 1] in 'eE' and (end < 2 or not _is_identifier_char(line[end - 2]))
+                    close = "\\'" if escaped else "'"
+                    has_code = True
+                elif token == '"':
+                    close = '"'
+                    has_code = True
+                elif token == '--':
+                    close = '\n'
+                else:
+                    close = '*/'
+                    depth = 1
+                buffer.append(line[pos:match.end()])
+                pos = match.end()
+
+            elif close == '*/':
+                match = _BLOCK_COMMENT.search(line, pos)
+                if match is None:
+                    buffer.append(line[pos:])
+                    break
+                depth += 1 if match.group() == '/*' else -1
+                buffer.append(line[pos:match.end()])
+                pos = match.end()
+                if depth == 0:
+                    close = None
+
+            else:
+                # 字符串中的 '' 转义会先结束再重新进入字符串，结果相同
+                if close == "\\'":
+                    end, length = _find_e_string_end(line, pos), 1
+                else:
+                    end, length = line.find(close, pos), len(close)
+                if end == -1:
+                    buffer.append(line[pos:])
+                    break
+                buffer.append(line[pos:end + length])
+                pos = end + length
+                close = None
+
+    statement = ''.join(buffer).strip()
+    if has_code and statement:
+        yield statement
+
+def iter_blocks_by_delimiter(f, delimiter="---", chunk_size=1024 * 1024):
+    """按分隔符切分文本，每次只读取 chunk_size 个字符，跨块的分隔符也能识别"""
+    tail = ''
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        parts = (tail + chunk).split(delimiter)
+        tail = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part.strip()
+    if tail.strip():
+        yield tail.strip()
+
+def iter_markdown_sections(lines):
+    """按标题(#、##、###)切分Markdown，代码块中以 # 开头的行不作为标题"""
+    section = []
+    in_fence = False
+    for line in lines:
+        if line.lstrip().startswith(('```', '~~~')):
+            in_fence = not in_fence
+        elif not in_fence and _MARKDOWN_HEADER.match(line) and section:
+            text = ''.join(section).strip()
+            if text:
+                yield text
+            section = []
+        section.append(line)
+    text = ''.join(section).strip()
+    if text:
+        yield text
+
+def iter_formatted_pairs(lines):
+    """按 "Question:" 开头的行切分格式化问答文件，第一个问题之前的内容忽略"""
+    block = None
+    for line in lines:
+        if line.lstrip().startswith("Question:"):
+            if block is not None:
+                yield ''.join(block).strip()
+            block = []
+        if block is not None:
+            block.append(line)
+    if block is not None:
+        yield ''.join(block).strip()
+
+def parse_formatted_pair(pair):
+    """从 "Question: ...\\nSQL: ..." 块中提取 (问题, SQL)，格式不符时返回 None"""
+    if "Question:" not in pair or "SQL:" not in pair:
+        return None
+    question_start = pair.find("Question:") + len("Question:")
+    sql_start = pair.find("SQL:", question_start)
+    if sql_start == -1:
+        return None
+    question = pair[question_start:sql_start].strip()
+    # SQL部分支持多行
+    sql = pair[sql_start + len("SQL:"):].strip()
+    if not question or not sql:
+        return None
+    return question, sql
+
+def read_file_by_delimiter(filepath, delimiter="---"):
+    """通用读取：将文件按分隔符切片为多个段落，逐个返回"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        yield from iter_blocks_by_delimiter(f, delimiter)
+
+def read_sql_statements(filepath):
+    """逐条返回SQL文件中的语句"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        yield from iter_sql_statements(f)
+
+def read_markdown_file_by_sections(filepath):
+    """专门用于Markdown文件：按标题(#、##、###)分割文档，逐个返回章节
+
+    非Markdown文件按 --- 分隔
+    """
+    is_markdown = filepath.lower().endswith('.md') or filepath.lower().endswith('.markdown')
+    if not is_markdown:
+        yield from read_file_by_delimiter(filepath, "---")
+        return
+    with open(filepath, "r", encoding="utf-8") as f:
+        yield from iter_markdown_sections(f)
+
+# 文件类型：ddl（DDL语句）、sql（SQL示例）、doc（Markdown按标题，其他按 --- 分隔）、
+# qs_colon（每行一个 "问题::SQL"）、formatted_qs（"Question:/SQL:" 块）
+FILE_TYPES = ('ddl', 'sql', 'doc', 'qs_colon', 'formatted_qs')
+
+# 目录中参与训练的文件扩展名
+TRAINING_EXTENSIONS = ('.sql', '.txt', '.md', '.markdown')
+
+# 识别文件类型时读取的字符数
+_SNIFF_CHARS = 64 * 1024
+
+_LEADING_COMMENTS = re.compile(r"^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.DOTALL)
+_DDL_KEYWORDS = ('CREATE', 'ALTER', 'COMMENT', 'DROP', 'GRANT')
+_SQL_KEYWORDS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+# 解析规则的版本，块的切分方式变化时递增（2：按SQL语法切分语句，不再简单按分号切分）
+PARSER_VERSION = 2
+
+def file_sha256(filepath):
+    """文件内容的sha256，分块读取"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def checkpoint_key(filepath, file_type):
+    """
+    断点续训中文件的键：内容哈希、解析规则版本和文件类型
+
+    块序号只在同一种切分方式下有意义，任一项变化时旧的检查点不再匹配，所有块重新训练
+    """
+    return f"{file_sha256(filepath)}:v{PARSER_VERSION}:{file_type}"
+
+def detect_file_type(filepath):
+    """根据扩展名和文件开头的内容判断训练文件的类型，见 FILE_TYPES"""
+    if filepath.lower().endswith(('.md', '.markdown')):
+        return 'doc'
+
+    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+        head = f.read(_SNIFF_CHARS)
+    lines = [line.strip() for line in head.splitlines() if line.strip()]
+    if any(line.startswith("Question:") for line in lines):
+        return 'formatted_qs'
+
+    # 看第一条语句的关键字（跳过开头的注释）；问答对的第一“句”是自然语言问题
+    first = next(iter_sql_statements(io.StringIO(head)), '')
+    keyword = _LEADING_COMMENTS.sub('', first).split(None, 1)[0].upper() if first.strip() else ''
+    keyword = keyword.rstrip('(')
+    if keyword in _DDL_KEYWORDS:
+        return 'ddl'
+    if keyword in _SQL_KEYWORDS:
+        return 'sql'
+
+    if lines and sum("::" in line for line in lines) * 2 >= len(lines):
+        return 'qs_colon'
+    return 'ddl' if filepath.lower().endswith('.sql') else 'doc'
+
+def iter_training_items(filepath, file_type):
+    """
+    按文件类型解析，逐个返回 (块序号, 训练类型, 参数)
+
+    训练类型为 ddl/documentation/sql/question_sql，参数为对应 train_* 函数的位置参数；
+    格式不符的块返回 (块序号, None, None)。块序号与断点续训的检查点一致：
+    qs_colon 为行号，其余为块的序号（从1开始）。
+    """
+    if file_type == 'ddl':
+        for idx, ddl in enumerate(read_sql_statements(filepath), start=1):
+            yield idx, 'ddl', (ddl,)
+    elif file_type == 'sql':
+        for idx, sql in enumerate(read_sql_statements(filepath), start=1):
+            yield idx, 'sql', (sql,)
+    elif file_type == 'doc':
+        for idx, doc in enumerate(read_markdown_file_by_sections(filepath), start=1):
+            yield idx, 'documentation', (doc,)
+    elif file_type == 'qs_colon':
+        with open(filepath, "r", encoding="utf-8") as f:
+            for idx, line in enumerate(f, start=1):
+                if "::" not in line:
+                    continue
+                question, sql = line.strip().split("::", 1)
+                yield idx, 'question_sql', (question.strip(), sql.strip())
+    elif file_type == 'formatted_qs':
+        with open(filepath, "r", encoding="utf-8") as f:
+            for idx, pair in enumerate(iter_formatted_pairs(f), start=1):
+                parsed = parse_formatted_pair(pair)
+                yield (idx, 'question_sql', parsed) if parsed else (idx, None, None)
+    else:
+        raise ValueError(f"未知的训练文件类型: {file_type}")
+
+def parse_file_messages(filepath, file_type, batch_size=256):
+    """
+    解析一个文件，产生发给训练进程的消息：
+    ('start', 路径, 检查点键（见 checkpoint_key）) → 若干 ('items', 路径, [(块序号, 训练类型, 参数), ...]) →
+    ('done', 路径, 块数)；出错时最后一条为 ('error', 路径, 错误信息)
+    """
+    try:
+        yield ('start', filepath, checkpoint_key(filepath, file_type))
+        batch = []
+        total = 0
+        for item in iter_training_items(filepath, file_type):
+            total += 1
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield ('items', filepath, batch)
+                batch = []
+        if batch:
+            yield ('items', filepath, batch)
+        yield ('done', filepath, total)
+    except Exception as e:
+        yield ('error', filepath, str(e))
+
+def parse_worker(tasks, results):
+    """解析子进程：从 tasks 取 (路径, 类型)，消息放入 results（有容量上限，训练跟不上时等待）"""
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        for message in parse_file_messages(*task):
+            results.put(message)
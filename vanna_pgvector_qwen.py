@@ -2,8 +2,10 @@ from pgvector_store import PgVectorStore
 from vanna.qianwen import QianWenAI_Chat
 from typing import List
 # from dashscope import TextEmbedding  # 注释掉阿里云API
-import json, os, requests  # 添加requests用于调用Ollama API
+import asyncio
+import json, math, os, re, requests  # 添加requests用于调用Ollama API
 from dotenv import load_dotenv
+from request_control import backend_slot, abackend_slot, Overloaded
 
 # 加载环境变量
 load_dotenv()
@@ -12,6 +14,25 @@ load_dotenv()
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 VERBOSE = LOG_LEVEL.upper() in ['DEBUG', 'TRACE']
 
+# 阿里云百炼的OpenAI兼容接口地址（未配置base_url时 QianWenAI_Chat 也使用该地址）
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 异步模式下到Ollama的最大并发连接数
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', '200'))
+
+LLM_NOT_ALLOWED_TO_SEE_DATA = "The LLM is not allowed to see the data in your database. Your question requires database introspection to generate the necessary SQL. Please set allow_llm_to_see_data=True to enable this."
+
+
+def _l2_normalize(vector: List[float]) -> List[float]:
+    """
+    归一化为单位向量。Ollama /api/embed 返回归一化后的向量，/api/embeddings 返回原始向量，
+    统一归一化后两种接口生成的向量可以互相比较（检索使用L2距离 <->）
+    """
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
 
 class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
     """
@@ -24,6 +45,11 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
         self.ollama_base_url = config.get('ollama_base_url', 'http://localhost:11434')
         self.embedding_model_name = config.get('ollama_embedding_model', 'bge-m3:latest')
         print(f"正在使用Ollama作为embedding模型({self.embedding_model_name})")
+        # 异步客户端在第一次使用时创建
+        self._async_llm = None
+        self._async_http = None
+        # 各后端（llm、embedding）的并发限制，由 app.py 配置
+        self.backend_limits = {}
         
     def submit_prompt(self, prompt, **kwargs) -> str:
         """
@@ -35,6 +61,129 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
         if len(prompt) == 0:
             raise Exception("Prompt is empty")
 
+        with backend_slot(self.backend_limits, 'llm'):
+            response = self.client.chat.completions.create(
+                messages=prompt,
+                stop=None,
+                temperature=self.temperature,
+                stream=True,  # 启用流式模式
+                **self._select_model(prompt, kwargs),
+            )
+
+            # 处理流式响应
+            full_content = ""
+            try:
+                for chunk in response:
+                    if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, 'content') and delta.content is not None:
+                            full_content += delta.content
+            except Exception as e:
+                print(f"处理流式响应时出错: {e}")
+            
+        return full_content
+        
+    # ---------- 生成SQL、图表代码和追问问题：同步和异步版本共用prompt的构造和回复的解析 ----------
+
+    def generate_sql(self, question: str, allow_llm_to_see_data=False, **kwargs) -> str:
+        """
+        与 VannaBase.generate_sql 的流程相同，区别是：问答对和文档的检索共用同一个问题向量；
+        intermediate_sql 分支中LLM未被准入的 Overloaded 原样抛出（由接口返回429/503），
+        不转换为 "Error running intermediate SQL" 字符串
+        """
+        if kwargs.get('embedding') is None:
+            kwargs['embedding'] = self.generate_embedding(question)
+        context = (
+            self.get_similar_question_sql(question, **kwargs),
+            self.get_related_ddl(question, **kwargs),
+            self.get_related_documentation(question, **kwargs),
+        )
+        llm_response = self.submit_prompt(self._sql_prompt(question, *context, **kwargs), **kwargs)
+        self.log(title="LLM Response", message=llm_response)
+
+        if 'intermediate_sql' not in llm_response:
+            return self.extract_sql(llm_response)
+        if not allow_llm_to_see_data:
+            return LLM_NOT_ALLOWED_TO_SEE_DATA
+
+        intermediate_sql = self.extract_sql(llm_response)
+        try:
+            self.log(title="Running Intermediate SQL", message=intermediate_sql)
+            df = self.run_sql(intermediate_sql)
+            prompt = self._sql_prompt(question, *context, intermediate=(intermediate_sql, df), **kwargs)
+            llm_response = self.submit_prompt(prompt, **kwargs)
+            self.log(title="LLM Response", message=llm_response)
+        except Overloaded:
+            raise
+        except Exception as e:
+            return f"Error running intermediate SQL: {e}"
+        return self.extract_sql(llm_response)
+
+    def _sql_prompt(self, question: str, question_sql_list: list, ddl_list: list, doc_list: list,
+                    intermediate=None, **kwargs) -> list:
+        """生成SQL的prompt；intermediate 为 (中间SQL, 结果DataFrame) 时把中间结果作为额外的文档"""
+        if intermediate is not None:
+            intermediate_sql, df = intermediate
+            doc_list = doc_list + [f"The following is a pandas DataFrame with the results of the intermediate SQL query {intermediate_sql}: \n" + df.to_markdown()]
+        prompt = self.get_sql_prompt(
+            initial_prompt=self.config.get("initial_prompt", None) if self.config is not None else None,
+            question=question,
+            question_sql_list=question_sql_list,
+            ddl_list=ddl_list,
+            doc_list=doc_list,
+            **kwargs,
+        )
+        self.log(title="Final SQL Prompt" if intermediate is not None else "SQL Prompt", message=prompt)
+        return prompt
+
+    def generate_plotly_code(self, question: str = None, sql: str = None, df_metadata: str = None, **kwargs) -> str:
+        """与 VannaBase.generate_plotly_code 相同，kwargs 原样传给 submit_prompt"""
+        llm_response = self.submit_prompt(self._plotly_code_prompt(question, sql, df_metadata), **kwargs)
+        return self._sanitize_plotly_code(self._extract_python_code(llm_response))
+
+    def _plotly_code_prompt(self, question: str = None, sql: str = None, df_metadata: str = None) -> list:
+        if question is not None:
+            system_msg = f"The following is a pandas DataFrame that contains the results of the query that answers the question the user asked: '{question}'"
+        else:
+            system_msg = "The following is a pandas DataFrame "
+
+        if sql is not None:
+            system_msg += f"\n\nThe DataFrame was produced using this query: {sql}\n\n"
+
+        system_msg += f"The following is information about the resulting pandas DataFrame 'df': \n{df_metadata}"
+
+        return [
+            self.system_message(system_msg),
+            self.user_message(
+                "Can you generate the Python plotly code to chart the results of the dataframe? Assume the data is in a pandas dataframe called 'df'. If there is only one value in the dataframe, use an Indicator. Respond with only Python code. Do not answer with any explanations -- just the code."
+            ),
+        ]
+
+    def generate_followup_questions(self, question: str, sql: str, df, n_questions: int = 5, **kwargs) -> list:
+        """与 VannaBase.generate_followup_questions 相同"""
+        llm_response = self.submit_prompt(self._followup_questions_prompt(question, sql, df, n_questions), **kwargs)
+        return self._parse_followup_questions(llm_response)
+
+    def _followup_questions_prompt(self, question: str, sql: str, df, n_questions: int) -> list:
+        return [
+            self.system_message(
+                f"You are a helpful data assistant. The user asked the question: '{question}'\n\nThe SQL query for this question was: {sql}\n\nThe following is a pandas DataFrame with the results of the query: \n{df.head(25).to_markdown()}\n\n"
+            ),
+            self.user_message(
+                f"Generate a list of {n_questions} followup questions that the user might ask about this data. Respond with a list of questions, one per line. Do not answer with any explanations -- just the questions. Remember that there should be an unambiguous SQL query that can be generated from the question. Prefer questions that are answerable outside of the context of this conversation. Prefer questions that are slight modifications of the SQL query that generated the dataframe that allow digging deeper into the data. Each question will be turned into a button that the user can click to generate a new SQL query so don't use 'example' type questions. Each question must have a one-to-one correspondence with the instantiated SQL query."
+                + self._response_language()
+            ),
+        ]
+
+    @staticmethod
+    def _parse_followup_questions(llm_response: str) -> list:
+        numbers_removed = re.sub(r"^\d+\.\s*", "", llm_response, flags=re.MULTILINE)
+        return numbers_removed.split("\n")
+
+    def _select_model(self, prompt, kwargs) -> dict:
+        """
+        选择本次调用使用的模型（或engine），返回传给 chat.completions.create 的参数
+        """
         # Count the number of tokens in the message log
         # Use 4 as an approximation for the number of characters per token
         num_tokens = 0
@@ -44,41 +193,17 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
         if kwargs.get("model", None) is not None:
             model = kwargs.get("model", None)
             print(f"Using model {model} for {num_tokens} tokens (approx)")
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=prompt,
-                stop=None,
-                temperature=self.temperature,
-                stream=True,  # 启用流式模式
-            )
+            return {"model": model}
         elif kwargs.get("engine", None) is not None:
             engine = kwargs.get("engine", None)
             print(f"Using model {engine} for {num_tokens} tokens (approx)")
-            response = self.client.chat.completions.create(
-                engine=engine,
-                messages=prompt,
-                stop=None,
-                temperature=self.temperature,
-                stream=True,  # 启用流式模式
-            )
+            return {"engine": engine}
         elif self.config is not None and "engine" in self.config:
             print(f"Using engine {self.config['engine']} for {num_tokens} tokens (approx)")
-            response = self.client.chat.completions.create(
-                engine=self.config["engine"],
-                messages=prompt,
-                stop=None,
-                temperature=self.temperature,
-                stream=True,  # 启用流式模式
-            )
+            return {"engine": self.config["engine"]}
         elif self.config is not None and "model" in self.config:
             print(f"Using model {self.config['model']} for {num_tokens} tokens (approx)")
-            response = self.client.chat.completions.create(
-                model=self.config["model"],
-                messages=prompt,
-                stop=None,
-                temperature=self.temperature,
-                stream=True,  # 启用流式模式
-            )
+            return {"model": self.config["model"]}
         else:
             if num_tokens > 3500:
                 model = "qwen-long"
@@ -86,27 +211,8 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
                 model = "qwen-plus"
 
             print(f"Using model {model} for {num_tokens} tokens (approx)")
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=prompt,
-                stop=None,
-                temperature=self.temperature,
-                stream=True,  # 启用流式模式
-            )
+            return {"model": model}
 
-        # 处理流式响应
-        full_content = ""
-        try:
-            for chunk in response:
-                if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, 'content') and delta.content is not None:
-                        full_content += delta.content
-        except Exception as e:
-            print(f"处理流式响应时出错: {e}")
-            
-        return full_content
-        
     def generate_embedding(self, data: str) -> List[float]:
         """
         使用本地Ollama生成文本向量，替代阿里云的embedding API
@@ -125,10 +231,11 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
         
         try:
             # 直接调用Ollama API
-            response = requests.post(
-                f"{self.ollama_base_url}/api/embeddings",
-                json={"model": self.embedding_model_name, "prompt": data}
-            )
+            with backend_slot(self.backend_limits, 'embedding'):
+                response = requests.post(
+                    f"{self.ollama_base_url}/api/embeddings",
+                    json={"model": self.embedding_model_name, "prompt": data}
+                )
             
             if response.status_code != 200:
                 error_msg = f"API请求错误: {response.status_code}, {response.text}"
@@ -149,6 +256,7 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
                     print(f"[ERROR] {error_msg}")
                 raise Exception(error_msg)
                 
+            vector = _l2_normalize(vector)
             if VERBOSE:
                 print(f"向量长度: {len(vector)}")
                 print(f"向量前5个元素: {vector[:5]}")
@@ -164,6 +272,178 @@ class VannaPgVectorQwen(QianWenAI_Chat,PgVectorStore, ):
                 print("===调试: 嵌入向量生成失败===\n")
             raise
 
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        一次请求批量生成多个文本的向量（Ollama /api/embed），顺序与输入一致
+
+        旧版本Ollama没有 /api/embed 时逐条调用 generate_embedding
+        """
+        # 空文本与 generate_embedding 一致，返回零向量
+        vectors = [[0.0] * 1024 for _ in texts]
+        todo = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not todo:
+            return vectors
+
+        print(f"[INFO] 使用Ollama ({self.embedding_model_name}) 批量生成 {len(todo)} 个嵌入向量")
+        with backend_slot(self.backend_limits, 'embedding'):
+            response = requests.post(
+                f"{self.ollama_base_url}/api/embed",
+                json={"model": self.embedding_model_name, "input": [texts[i] for i in todo]}
+            )
+
+        if response.status_code == 404:
+            print("[WARNING] Ollama不支持 /api/embed，改为逐条生成嵌入向量")
+            for i in todo:
+                vectors[i] = self.generate_embedding(texts[i])
+            return vectors
+
+        if response.status_code != 200:
+            error_msg = f"API请求错误: {response.status_code}, {response.text}"
+            print(f"[ERROR] {error_msg}")
+            raise Exception(error_msg)
+
+        embeddings = response.json().get("embeddings")
+        if not embeddings or len(embeddings) != len(todo):
+            error_msg = "API返回的embeddings数量与输入不一致"
+            print(f"[ERROR] {error_msg}")
+            raise Exception(error_msg)
+
+        for i, vector in zip(todo, embeddings):
+            vectors[i] = _l2_normalize(vector)
+        return vectors
+
+    # ---------- 异步接口（供 asgi.py 的异步服务模式使用） ----------
+
+    def _async_clients(self):
+        """返回异步LLM客户端和Ollama HTTP客户端，首次调用时在当前事件循环中创建"""
+        if self._async_llm is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            self._async_llm = AsyncOpenAI(
+                api_key=self.config.get('api_key'),
+                base_url=self.config.get('base_url', DASHSCOPE_BASE_URL),
+            )
+            self._async_http = httpx.AsyncClient(
+                base_url=self.ollama_base_url,
+                timeout=httpx.Timeout(60.0),
+                limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS),
+            )
+        return self._async_llm, self._async_http
+
+    async def aclose(self):
+        """关闭异步客户端"""
+        if self._async_llm is not None:
+            await self._async_llm.close()
+            await self._async_http.aclose()
+            self._async_llm = None
+            self._async_http = None
+
+    async def asubmit_prompt(self, prompt, **kwargs) -> str:
+        """submit_prompt 的异步版本"""
+        if prompt is None:
+            raise Exception("Prompt is None")
+
+        if len(prompt) == 0:
+            raise Exception("Prompt is empty")
+
+        async with abackend_slot(self.backend_limits, 'llm'):
+            client, _ = self._async_clients()
+            response = await client.chat.completions.create(
+                messages=prompt,
+                stop=None,
+                temperature=self.temperature,
+                stream=True,  # 启用流式模式
+                **self._select_model(prompt, kwargs),
+            )
+
+            full_content = ""
+            try:
+                async for chunk in response:
+                    if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, 'content') and delta.content is not None:
+                            full_content += delta.content
+            except Exception as e:
+                print(f"处理流式响应时出错: {e}")
+
+        return full_content
+
+    async def agenerate_embedding(self, data: str) -> List[float]:
+        """generate_embedding 的异步版本"""
+        if not data or len(data.strip()) == 0:
+            print("[WARNING] 输入文本为空，返回零向量")
+            return [0.0] * 1024
+
+        _, http = self._async_clients()
+        async with abackend_slot(self.backend_limits, 'embedding'):
+            response = await http.post("/api/embeddings", json={"model": self.embedding_model_name, "prompt": data})
+        if response.status_code != 200:
+            error_msg = f"API请求错误: {response.status_code}, {response.text}"
+            print(f"[ERROR] {error_msg}")
+            raise Exception(error_msg)
+
+        vector = response.json().get("embedding")
+        if not vector:
+            raise Exception("API返回中没有embedding字段")
+        return _l2_normalize(vector)
+
+    async def aget_similar_question_sql(self, question: str, **kwargs) -> list:
+        """
+        get_similar_question_sql 的异步版本
+
+        pgvector查询本身只需几毫秒，放在线程中执行，不占用事件循环
+        """
+        embedding = kwargs.get('embedding')
+        if embedding is None:
+            embedding = await self.agenerate_embedding(question)
+
+        # 每次查询从检索连接池取独立的连接，并发的查询之间互不影响
+        return await asyncio.to_thread(self._query_similar_question_sql, embedding)
+
+    async def agenerate_sql(self, question: str, allow_llm_to_see_data=False, **kwargs) -> str:
+        """generate_sql 的异步版本，检索和LLM调用均为异步"""
+        if kwargs.get('embedding') is None:
+            kwargs['embedding'] = await self.agenerate_embedding(question)
+        context = (
+            await self.aget_similar_question_sql(question, **kwargs),
+            self.get_related_ddl(question, **kwargs),
+            await asyncio.to_thread(self.get_related_documentation, question, **kwargs),
+        )
+        llm_response = await self.asubmit_prompt(self._sql_prompt(question, *context, **kwargs), **kwargs)
+        self.log(title="LLM Response", message=llm_response)
+
+        if 'intermediate_sql' not in llm_response:
+            return self.extract_sql(llm_response)
+        if not allow_llm_to_see_data:
+            return LLM_NOT_ALLOWED_TO_SEE_DATA
+
+        intermediate_sql = self.extract_sql(llm_response)
+        try:
+            self.log(title="Running Intermediate SQL", message=intermediate_sql)
+            df = await asyncio.to_thread(self.run_sql, intermediate_sql)
+            prompt = self._sql_prompt(question, *context, intermediate=(intermediate_sql, df), **kwargs)
+            llm_response = await self.asubmit_prompt(prompt, **kwargs)
+            self.log(title="LLM Response", message=llm_response)
+        except Overloaded:
+            raise
+        except Exception as e:
+            return f"Error running intermediate SQL: {e}"
+        return self.extract_sql(llm_response)
+
+    async def agenerate_plotly_code(self, question: str = None, sql: str = None, df_metadata: str = None,
+                                    **kwargs) -> str:
+        """generate_plotly_code 的异步版本"""
+        llm_response = await self.asubmit_prompt(self._plotly_code_prompt(question, sql, df_metadata), **kwargs)
+        return self._sanitize_plotly_code(self._extract_python_code(llm_response))
+
+    async def agenerate_followup_questions(self, question: str, sql: str, df, n_questions: int = 5,
+                                           **kwargs) -> list:
+        """generate_followup_questions 的异步版本"""
+        llm_response = await self.asubmit_prompt(
+            self._followup_questions_prompt(question, sql, df, n_questions), **kwargs)
+        return self._parse_followup_questions(llm_response)
+
 
 # 默认配置（建议你可后续用 .env 或 config.py 替换）
 # 从环境变量读取配置
@@ -181,6 +461,19 @@ config = {
     'pgvector_table': os.environ.get('PGVECTOR_TABLE', 'vanna_pgvector')
 }
 
+# 可选：使用其他OpenAI兼容服务（如本地测试用的模拟LLM）代替阿里云
+if os.environ.get('QWEN_BASE_URL'):
+    config['base_url'] = os.environ['QWEN_BASE_URL']
+
+# 业务数据仓库（run_sql 查询的目标库）连接配置
+db_config = {
+    'host': os.environ.get('DB_HOST', '127.0.0.1'),
+    'dbname': os.environ.get('DB_NAME', 'works_dw'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'postgres'),
+    'port': int(os.environ.get('DB_PORT', 5432))
+}
+
 # 创建实例
 vn = VannaPgVectorQwen(config=config)
 
@@ -189,10 +482,4 @@ def init_db_connection():
     """
     初始化 SQL 查询用的 PostgreSQL 连接（用于 run_sql）
     """
-    vn.connect_to_postgres(
-        host=os.environ.get('DB_HOST', '127.0.0.1'),
-        dbname=os.environ.get('DB_NAME', 'works_dw'),
-        user=os.environ.get('DB_USER', 'postgres'),
-        password=os.environ.get('DB_PASSWORD', 'postgres'),
-        port=int(os.environ.get('DB_PORT', 5432))
-    )
+    vn.connect_to_postgres(**db_config)
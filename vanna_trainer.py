@@ -3,10 +3,8 @@ import os
 import time
 import threading
 import queue
-import concurrent.futures
 from functools import lru_cache
 from dotenv import load_dotenv
-from collections import defaultdict
 from typing import List, Dict, Any, Tuple, Optional, Union, Callable
 
 # 加载环境变量
@@ -14,6 +12,8 @@ load_dotenv()
 
 # from vanna_config import vn, init_db_connection
 from vanna_pgvector_qwen import vn, init_db_connection
+from chunking import document_records
+from training_parsers import checkpoint_key
 
 # 初始化数据库连接
 init_db_connection()
@@ -27,166 +27,353 @@ LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 # 日志级别设置
 VERBOSE = LOG_LEVEL.upper() in ['DEBUG', 'TRACE']
 
-# 数据批处理器
-class BatchProcessor:
-    def __init__(self, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+# 流水线配置：向量生成线程数、写入线程数（各自使用独立的数据库连接）、阶段间队列容量（批）
+EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', str(MAX_WORKERS)))
+WRITE_WORKERS = int(os.environ.get('WRITE_WORKERS', '2'))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', str(MAX_WORKERS * 2)))
+
+# 生成向量时文本的最大长度（超出部分截断，入库的仍是原文）
+EMBED_MAX_CHARS = 2048
+
+# 断点续训：根据检查点跳过之前运行中已写入的块
+TRAINING_RESUME = os.environ.get('TRAINING_RESUME', 'true').lower() == 'true'
+
+# 检查点：(源文件的检查点键（见 training_parsers.checkpoint_key）, 块序号, 源文件路径)
+Checkpoint = Tuple[str, int, str]
+
+# 队列中表示“没有更多批次”的标记
+_STOP = object()
+
+
+class TrainingPipeline:
+    """
+    训练数据写入流水线：解析 → 生成向量 → 写入
+
+    解析由调用方（run_training.py）完成，条目按批大小组批后进入向量队列；
+    多个向量线程批量生成向量后放入写入队列；写入线程各自用独立连接批量INSERT。
+    两个队列都有容量上限，下游处理不过来时 add_item 会阻塞（背压）。
+    单个条目的失败只记录下来，不影响同批其他条目。
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, embed_workers=EMBED_WORKERS,
+                 write_workers=WRITE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
         self.batch_size = batch_size
-        self.max_workers = max_workers
-        self.batches = defaultdict(list)
-        self.lock = threading.Lock()  # 线程安全锁
-        
-        # 初始化工作线程池
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
-        
-        # 是否启用批处理
-        self.batch_enabled = BATCH_PROCESSING_ENABLED
-        
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.pending = []
+        self.lock = threading.Lock()  # 保护 pending、统计和错误列表
+
+        self.stats = {'submitted': 0, 'embedded': 0, 'written': 0, 'failed': 0,
+                      'batches': 0, 'embed_seconds': 0.0, 'write_seconds': 0.0}
+        self.errors = []
+        # 每批生成向量和写入的耗时（秒）
+        self.embed_latencies = []
+        self.write_latencies = []
+        self.started_at = time.time()
+        self.closed = False
+
+        self.embed_threads = [threading.Thread(target=self._embed_worker, name=f'train-embed-{i}', daemon=True)
+                              for i in range(embed_workers)]
+        self.write_threads = [threading.Thread(target=self._write_worker, name=f'train-write-{i}', daemon=True)
+                              for i in range(write_workers)]
+        for thread in self.embed_threads + self.write_threads:
+            thread.start()
+
         if VERBOSE:
-            print(f"[DEBUG] 批处理器初始化: 启用={self.batch_enabled}, 批大小={self.batch_size}, 最大工作线程={self.max_workers}")
-    
-    def add_item(self, batch_type: str, item: Dict[str, Any]):
-        """添加一个项目到批处理队列"""
-        if not self.batch_enabled:
-            # 如果未启用批处理，直接处理
-            self._process_single_item(batch_type, item)
-            return
-        
+            print(f"[DEBUG] 训练流水线初始化: 批大小={batch_size}, 向量线程={embed_workers}, "
+                  f"写入线程={write_workers}, 队列容量={queue_size}")
+
+    def add_item(self, batch_type: str, item: Dict[str, Any], checkpoint: Optional[Checkpoint] = None):
+        """
+        添加一个条目，凑满一批后放入向量队列（队列已满时阻塞）
+
+        checkpoint 不为None时，该条目写入成功后在同一事务中记录检查点
+
+        长文档切分出的父行和所有块放入同一批（该批可能超过批大小），一起写入或一起失败，
+        检查点只随父行记录
+        """
+        if self.closed:
+            raise RuntimeError("训练流水线已关闭")
+
+        records = self._to_records(batch_type, item)
+        records[0]['checkpoint'] = checkpoint
+        with self.lock:
+            self.pending.extend(records)
+            self.stats['submitted'] += len(records)
+            if len(self.pending) < self.batch_size:
+                return
+            batch, self.pending = self.pending, []
+        self.embed_queue.put(batch)
+
+    @staticmethod
+    def _to_records(batch_type: str, item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # 与 PgVectorStore.add_batch 的内容格式一致
+        if batch_type == 'question_sql':
+            return [{'type': batch_type, 'content': f"{item['question']} :: {item['sql']}"}]
+        if batch_type == 'documentation':
+            return document_records(item['documentation'])
+        return [{'type': batch_type, 'content': item[batch_type]}]
+
+    @staticmethod
+    def _groups(records: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """按文档分组：同一 parent_id 的行为一组，其余每行一组"""
+        groups = {}
+        for record in records:
+            groups.setdefault(record.get('parent_id') or id(record), []).append(record)
+        return list(groups.values())
+
+    def flush(self):
+        """把未满的批次送入流水线，并等待所有已提交的条目处理完成"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.embed_queue.put(batch)
+        self.embed_queue.join()
+        self.write_queue.join()
+
+    def shutdown(self) -> Dict[str, Any]:
+        """处理完剩余条目后停止所有线程，返回并打印汇总"""
+        if self.closed:
+            return self.summary()
+
+        self.flush()
+        self.closed = True
+        for _ in self.embed_threads:
+            self.embed_queue.put(_STOP)
+        for thread in self.embed_threads:
+            thread.join()
+        for _ in self.write_threads:
+            self.write_queue.put(_STOP)
+        for thread in self.write_threads:
+            thread.join()
+
+        summary = self.summary()
+        self.print_summary(summary)
+        return summary
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = time.time() - self.started_at
+            return {
+                **self.stats,
+                'elapsed_seconds': elapsed,
+                'items_per_second': self.stats['written'] / elapsed if elapsed else 0.0,
+                'embed_latency_ms': _percentiles(self.embed_latencies),
+                'write_latency_ms': _percentiles(self.write_latencies),
+                'errors': list(self.errors),
+            }
+
+    @staticmethod
+    def print_summary(summary: Dict[str, Any]):
+        print(f"[INFO] 训练汇总: 提交 {summary['submitted']} 条, 写入 {summary['written']} 条, "
+              f"失败 {summary['failed']} 条, 共 {summary['batches']} 批, "
+              f"耗时 {summary['elapsed_seconds']:.2f} 秒 ({summary['items_per_second']:.1f} 条/秒)")
+        print(f"[INFO] 阶段耗时合计: 生成向量 {summary['embed_seconds']:.2f} 秒, "
+              f"写入 {summary['write_seconds']:.2f} 秒")
+        print(f"[INFO] 每批耗时 p50/p95: 生成向量 {summary['embed_latency_ms']['p50']:.0f}/"
+              f"{summary['embed_latency_ms']['p95']:.0f} ms, 写入 {summary['write_latency_ms']['p50']:.0f}/"
+              f"{summary['write_latency_ms']['p95']:.0f} ms")
+        for error in summary['errors'][:20]:
+            print(f"[ERROR] {error['stage']} 失败 ({error['type']}): {error['error']} | {error['preview']}")
+        if len(summary['errors']) > 20:
+            print(f"[ERROR] ... 另有 {len(summary['errors']) - 20} 个失败条目")
+
+    def _fail(self, record: Dict[str, Any], stage: str, error: Exception):
         with self.lock:
-            self.batches[batch_type].append(item)
-            
-            if len(self.batches[batch_type]) >= self.batch_size:
-                batch_items = self.batches[batch_type]
-                self.batches[batch_type] = []
-                # 提交批处理任务到线程池
-                self.executor.submit(self._process_batch, batch_type, batch_items)
-    
-    def _process_single_item(self, batch_type: str, item: Dict[str, Any]):
-        """处理单个项目"""
+            self.stats['failed'] += 1
+            self.errors.append({
+                'stage': stage,
+                'type': record['type'],
+                'error': str(error),
+                'preview': record['content'][:80].replace('\n', ' '),
+            })
+
+    def _embed_worker(self):
+        while True:
+            batch = self.embed_queue.get()
+            try:
+                if batch is _STOP:
+                    return
+                embedded = self._embed_batch(batch)
+                if embedded:
+                    self.write_queue.put(embedded)
+            except Exception as e:
+                print(f"[ERROR] 生成向量线程异常: {e}")
+            finally:
+                self.embed_queue.task_done()
+
+    def _embed_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        start = time.time()
+        # 长文档的父行只保存原文，不生成向量
+        to_embed = [record for record in batch if record.get('embed', True)]
+        texts = [record['content'][:EMBED_MAX_CHARS] for record in to_embed]
         try:
-            if batch_type == 'ddl':
-                vn.train(ddl=item['ddl'])
-            elif batch_type == 'documentation':
-                vn.train(documentation=item['documentation'])
-            elif batch_type == 'sql':
-                vn.train(sql=item['sql'])
-            elif batch_type == 'question_sql':
-                vn.train(question=item['question'], sql=item['sql'])
-            
-            if VERBOSE:
-                print(f"[DEBUG] 单项处理成功: {batch_type}")
-                
+            vectors = vn.generate_embeddings(texts) if texts else []
         except Exception as e:
-            print(f"[ERROR] 处理 {batch_type} 项目失败: {e}")
-    
-    def _process_batch(self, batch_type: str, items: List[Dict[str, Any]]):
-        """处理一批项目"""
-        print(f"[INFO] 开始批量处理 {len(items)} 个 {batch_type} 项")
-        start_time = time.time()
-        
+            # 整批失败时逐条生成，找出有问题的条目
+            print(f"[WARNING] 批量生成向量失败，改为逐条生成: {e}")
+            vectors = []
+            for record, text in zip(to_embed, texts):
+                try:
+                    vectors.append(vn.generate_embedding(text))
+                except Exception as item_e:
+                    self._fail(record, 'embed', item_e)
+                    vectors.append(None)
+
+        vector_of = {id(record): vector for record, vector in zip(to_embed, vectors)}
+        embedded = []
+        for group in self._groups(batch):
+            if any(record.get('embed', True) and vector_of[id(record)] is None for record in group):
+                # 文档的某个块失败时整篇文档都不写入，避免检查点记录了不完整的文档
+                for record in group:
+                    if not record.get('embed', True) or vector_of[id(record)] is not None:
+                        self._fail(record, 'embed', RuntimeError("同一文档的其他块生成向量失败"))
+                continue
+            embedded.extend({**record, 'embedding': vector_of.get(id(record))} for record in group)
+        with self.lock:
+            self.stats['embedded'] += len(embedded)
+            self.stats['embed_seconds'] += time.time() - start
+            self.embed_latencies.append(time.time() - start)
+        return embedded
+
+    def _write_worker(self):
+        conn = None
         try:
-            # 准备批处理数据
-            batch_data = []
-            
-            if batch_type == 'ddl':
-                for item in items:
-                    batch_data.append({
-                        'type': 'ddl',
-                        'content': item['ddl']
-                    })
-            
-            elif batch_type == 'documentation':
-                for item in items:
-                    batch_data.append({
-                        'type': 'documentation',
-                        'content': item['documentation']
-                    })
-            
-            elif batch_type == 'sql':
-                for item in items:
-                    batch_data.append({
-                        'type': 'sql',
-                        'content': item['sql']
-                    })
-            
-            elif batch_type == 'question_sql':
-                for item in items:
-                    batch_data.append({
-                        'type': 'question_sql',
-                        'question': item['question'],
-                        'sql': item['sql']
-                    })
-            
-            # 使用批量添加方法
-            if hasattr(vn, 'add_batch') and callable(getattr(vn, 'add_batch')):
-                success = vn.add_batch(batch_data)
-                if success:
-                    print(f"[INFO] 批量处理成功: {len(items)} 个 {batch_type} 项")
-                else:
-                    print(f"[WARNING] 批量处理部分失败: {batch_type}")
-            else:
-                # 如果没有批处理方法，退回到逐条处理
-                print(f"[WARNING] 批处理不可用，使用逐条处理: {batch_type}")
-                for item in items:
-                    self._process_single_item(batch_type, item)
-                
+            while True:
+                batch = self.write_queue.get()
+                try:
+                    if batch is _STOP:
+                        return
+                    if conn is None or conn.closed:
+                        conn = vn.new_connection()
+                    self._write_batch(batch, conn)
+                except Exception as e:
+                    print(f"[ERROR] 写入线程异常: {e}")
+                    for record in batch:
+                        self._fail(record, 'write', e)
+                finally:
+                    self.write_queue.task_done()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @staticmethod
+    def _checkpoints(records: List[Dict[str, Any]]) -> List[Checkpoint]:
+        return [record['checkpoint'] for record in records if record.get('checkpoint') is not None]
+
+    def _write_batch(self, batch: List[Dict[str, Any]], conn):
+        start = time.time()
+        written = 0
+        try:
+            vn._bulk_insert(batch, conn=conn, checkpoints=self._checkpoints(batch))
+            written = len(batch)
         except Exception as e:
-            print(f"[ERROR] 批处理 {batch_type} 失败: {e}")
-            # 如果批处理失败，尝试逐条处理
-            print(f"[INFO] 尝试逐条处理...")
-            for item in items:
+            print(f"[WARNING] 批量写入失败，改为逐条写入: {e}")
+            # 长文档的父行和块作为一组写入
+            for group in self._groups(batch):
                 try:
-                    self._process_single_item(batch_type, item)
+                    vn._bulk_insert(group, conn=conn, checkpoints=self._checkpoints(group))
+                    written += len(group)
                 except Exception as item_e:
-                    print(f"[ERROR] 处理项目失败: {item_e}")
-        
-        elapsed = time.time() - start_time
-        print(f"[INFO] 批处理完成 {len(items)} 个 {batch_type} 项，耗时 {elapsed:.2f} 秒")
-    
-    def flush_all(self):
-        """强制处理所有剩余项目"""
+                    for record in group:
+                        self._fail(record, 'write', item_e)
+
         with self.lock:
-            for batch_type, items in self.batches.items():
-                if items:
-                    print(f"[INFO] 正在处理剩余的 {len(items)} 个 {batch_type} 项")
-                    self._process_batch(batch_type, items)
-            
-            # 清空队列
-            self.batches = defaultdict(list)
-        
-        print("[INFO] 所有批处理项目已完成")
-    
-    def shutdown(self):
-        """关闭处理器和线程池"""
-        self.flush_all()
-        self.executor.shutdown(wait=True)
-        print("[INFO] 批处理器已关闭")
-
-# 创建全局批处理器实例
-batch_processor = BatchProcessor()
+            self.stats['written'] += written
+            self.stats['batches'] += 1
+            self.stats['write_seconds'] += time.time() - start
+            self.write_latencies.append(time.time() - start)
+        if VERBOSE:
+            print(f"[DEBUG] 写入一批 {written}/{len(batch)} 条")
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    """每批耗时的 p50/p95/p99（毫秒）"""
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] * 1000
+    return {'p50': pick(50), 'p95': pick(95), 'p99': pick(99)}
+
+
+def _train_single_item(batch_type: str, item: Dict[str, Any], checkpoint: Optional[Checkpoint] = None):
+    """未启用批处理时直接调用 vn.train（只有SQL时由LLM生成问题）"""
+    try:
+        if batch_type == 'ddl':
+            vn.train(ddl=item['ddl'])
+        elif batch_type == 'documentation':
+            vn.train(documentation=item['documentation'])
+        elif batch_type == 'sql':
+            vn.train(sql=item['sql'])
+        elif batch_type == 'question_sql':
+            vn.train(question=item['question'], sql=item['sql'])
+
+        if checkpoint is not None:
+            vn.record_checkpoints([checkpoint])
+
+        if VERBOSE:
+            print(f"[DEBUG] 单项处理成功: {batch_type}")
+
+    except Exception as e:
+        print(f"[ERROR] 处理 {batch_type} 项目失败: {e}")
+
+# 创建全局训练流水线（未启用批处理时不创建）
+pipeline = TrainingPipeline() if BATCH_PROCESSING_ENABLED else None
+
+def _add_item(batch_type: str, item: Dict[str, Any], checkpoint: Optional[Checkpoint] = None):
+    if pipeline is None:
+        _train_single_item(batch_type, item, checkpoint)
+    else:
+        pipeline.add_item(batch_type, item, checkpoint)
+
+def file_checkpoint(filepath: str, file_type: str) -> Tuple[str, set]:
+    """
+    返回文件的检查点键（内容哈希、解析规则版本和文件类型，见 training_parsers.checkpoint_key），
+    以及之前的运行中已写入的块序号
+
+    文件内容或切分方式变化后键不同，所有块都会重新训练
+    """
+    file_hash = checkpoint_key(filepath, file_type)
+    return file_hash, completed_blocks(file_hash)
+
+def completed_blocks(file_hash: str) -> set:
+    """之前的运行中该文件内容（按哈希）已写入的块序号，未启用断点续训时为空"""
+    return vn.get_completed_blocks(file_hash) if TRAINING_RESUME else set()
 
 # 原始训练函数的批处理增强版本
-def train_ddl(ddl_sql: str):
+# checkpoint 为 (文件哈希, 块序号, 文件路径)，见 file_checkpoint
+def train_ddl(ddl_sql: str, checkpoint: Optional[Checkpoint] = None):
     print(f"[DDL] Training on DDL:\n{ddl_sql}")
-    batch_processor.add_item('ddl', {'ddl': ddl_sql})
+    _add_item('ddl', {'ddl': ddl_sql}, checkpoint)
 
-def train_documentation(doc: str):
+def train_documentation(doc: str, checkpoint: Optional[Checkpoint] = None):
     print(f"[DOC] Training on documentation:\n{doc}")
-    batch_processor.add_item('documentation', {'documentation': doc})
+    _add_item('documentation', {'documentation': doc}, checkpoint)
 
-def train_sql_example(sql: str):
+def train_sql_example(sql: str, checkpoint: Optional[Checkpoint] = None):
     print(f"[SQL] Training on SQL:\n{sql}")
-    batch_processor.add_item('sql', {'sql': sql})
+    _add_item('sql', {'sql': sql}, checkpoint)
 
-def train_question_sql_pair(question: str, sql: str):
+def train_question_sql_pair(question: str, sql: str, checkpoint: Optional[Checkpoint] = None):
     print(f"[Q-S] Training on:\nQ: {question}\nSQL: {sql}")
-    batch_processor.add_item('question_sql', {'question': question, 'sql': sql})
+    _add_item('question_sql', {'question': question, 'sql': sql}, checkpoint)
 
 # 完成训练后刷新所有待处理项
 def flush_training():
     """强制处理所有待处理的训练项目"""
-    batch_processor.flush_all()
+    if pipeline is not None:
+        pipeline.flush()
+    print("[INFO] 所有批处理项目已完成")
+
+def training_progress() -> Optional[Dict[str, Any]]:
+    """当前训练流水线的统计（未启用批处理时为None）"""
+    return pipeline.summary() if pipeline is not None else None
 
 # 关闭训练器
 def shutdown_trainer():
-    """关闭训练器和相关资源"""
-    batch_processor.shutdown()
+    """关闭训练器和相关资源，返回训练汇总"""
+    if pipeline is None:
+        return None
+    summary = pipeline.shutdown()
+    print("[INFO] 批处理器已关闭")
+    return summary